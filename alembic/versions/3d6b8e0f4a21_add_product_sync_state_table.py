@@ -0,0 +1,30 @@
+"""add product sync state table
+
+Revision ID: 3d6b8e0f4a21
+Revises: f19c3a7d5e82
+Create Date: 2026-10-17 15:20:41.803115
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3d6b8e0f4a21'
+down_revision = 'f19c3a7d5e82'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_sync_state',
+    sa.Column('product_id', sa.Uuid(), nullable=False),
+    sa.Column('offers_fingerprint', sa.String(length=64), nullable=True),
+    sa.Column('synced_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id')
+    )
+
+
+def downgrade():
+    op.drop_table('product_sync_state')
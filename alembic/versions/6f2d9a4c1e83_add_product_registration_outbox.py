@@ -0,0 +1,36 @@
+"""add product registration outbox
+
+Revision ID: 6f2d9a4c1e83
+Revises: a81c5f2d9e46
+Create Date: 2026-10-17 20:12:40.118394
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f2d9a4c1e83'
+down_revision = 'a81c5f2d9e46'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_registration_outbox',
+    sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+    sa.Column('product_id', sa.Uuid(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('product_id')
+    )
+    op.create_index('ix_product_registration_outbox_next_attempt_at_id', 'product_registration_outbox', ['next_attempt_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_product_registration_outbox_next_attempt_at_id', table_name='product_registration_outbox')
+    op.drop_table('product_registration_outbox')
@@ -0,0 +1,35 @@
+"""add offer product price index
+
+Revision ID: 8b2f4e1c9d07
+Revises: c5034a7a7a7a
+Create Date: 2026-10-17 09:12:41.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2f4e1c9d07'
+down_revision = 'c5034a7a7a7a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_offer_product_id_price_id', 'offer', ['product_id', 'price', 'id'], unique=False,
+                    postgresql_include=['items_in_stock'])
+    # ix_offer_product_id is a prefix of the new index, ix_offer_id and ix_product_id duplicate primary keys
+    # and description is free text never filtered by equality
+    op.drop_index('ix_offer_product_id', table_name='offer')
+    op.drop_index('ix_offer_id', table_name='offer')
+    op.drop_index('ix_product_id', table_name='product')
+    op.drop_index('ix_product_description', table_name='product')
+
+
+def downgrade():
+    op.create_index('ix_product_description', 'product', ['description'], unique=False)
+    op.create_index('ix_product_id', 'product', ['id'], unique=False)
+    op.create_index('ix_offer_id', 'offer', ['id'], unique=False)
+    op.create_index('ix_offer_product_id', 'offer', ['product_id'], unique=False)
+    op.drop_index('ix_offer_product_id_price_id', table_name='offer')
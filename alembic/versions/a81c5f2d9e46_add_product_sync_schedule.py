@@ -0,0 +1,38 @@
+"""add product sync schedule
+
+Revision ID: a81c5f2d9e46
+Revises: 3d6b8e0f4a21
+Create Date: 2026-10-17 19:05:12.448210
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a81c5f2d9e46'
+down_revision = '3d6b8e0f4a21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('product_sync_state', sa.Column('next_sync_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+    op.add_column('product_sync_state', sa.Column('sync_interval_seconds', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('product_sync_state', sa.Column('syncs_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('product_sync_state', sa.Column('changes_count', sa.Integer(), server_default='0', nullable=False))
+    op.create_index('ix_product_sync_state_next_sync_at_product_id', 'product_sync_state', ['next_sync_at', 'product_id'], unique=False)
+    # every product gets a schedule, products without one are due right away
+    op.execute(
+        "INSERT INTO product_sync_state (product_id) "
+        "SELECT id FROM product WHERE NOT EXISTS "
+        "(SELECT 1 FROM product_sync_state WHERE product_sync_state.product_id = product.id)"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_product_sync_state_next_sync_at_product_id', table_name='product_sync_state')
+    op.drop_column('product_sync_state', 'changes_count')
+    op.drop_column('product_sync_state', 'syncs_count')
+    op.drop_column('product_sync_state', 'sync_interval_seconds')
+    op.drop_column('product_sync_state', 'next_sync_at')
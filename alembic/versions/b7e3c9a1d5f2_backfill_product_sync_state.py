@@ -0,0 +1,31 @@
+"""backfill product sync state
+
+Revision ID: b7e3c9a1d5f2
+Revises: 6f2d9a4c1e83
+Create Date: 2026-10-17 21:40:27.113905
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3c9a1d5f2'
+down_revision = '6f2d9a4c1e83'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # sync state is created with the products now, the offer download round no longer creates the missing ones -
+    # products created before get theirs here, except products still waiting for their registration
+    op.execute(
+        "INSERT INTO product_sync_state (product_id) "
+        "SELECT id FROM product WHERE NOT EXISTS "
+        "(SELECT 1 FROM product_sync_state WHERE product_sync_state.product_id = product.id) "
+        "AND NOT EXISTS "
+        "(SELECT 1 FROM product_registration_outbox WHERE product_registration_outbox.product_id = product.id)"
+    )
+
+
+def downgrade():
+    pass
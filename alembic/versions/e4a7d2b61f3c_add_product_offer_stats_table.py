@@ -0,0 +1,41 @@
+"""add product offer stats table
+
+Revision ID: e4a7d2b61f3c
+Revises: 8b2f4e1c9d07
+Create Date: 2026-10-17 11:02:17.540312
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a7d2b61f3c'
+down_revision = '8b2f4e1c9d07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_offer_stats',
+    sa.Column('product_id', sa.Uuid(), nullable=False),
+    sa.Column('offers_count', sa.Integer(), nullable=False),
+    sa.Column('min_price', sa.Integer(), nullable=True),
+    sa.Column('max_price', sa.Integer(), nullable=True),
+    sa.Column('avg_price', sa.Float(), nullable=True),
+    sa.Column('items_in_stock', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id')
+    )
+    # products with already downloaded offers get their stats right away instead of after the next download
+    op.execute(
+        "INSERT INTO product_offer_stats "
+        "(product_id, offers_count, min_price, max_price, avg_price, items_in_stock, updated_at) "
+        "SELECT product_id, count(id), min(price), max(price), avg(price), sum(items_in_stock), now() "
+        "FROM offer GROUP BY product_id"
+    )
+
+
+def downgrade():
+    op.drop_table('product_offer_stats')
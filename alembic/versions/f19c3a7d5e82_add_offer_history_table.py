@@ -0,0 +1,38 @@
+"""add offer history table
+
+Revision ID: f19c3a7d5e82
+Revises: e4a7d2b61f3c
+Create Date: 2026-10-17 13:45:09.127664
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f19c3a7d5e82'
+down_revision = 'e4a7d2b61f3c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('offer_history',
+    sa.Column('offer_id', sa.Uuid(), nullable=False),
+    sa.Column('recorded_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('product_id', sa.Uuid(), nullable=False),
+    sa.Column('price', sa.Integer(), nullable=False),
+    sa.Column('items_in_stock', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('offer_id', 'recorded_at'),
+    postgresql_partition_by='RANGE (recorded_at)'
+    )
+    op.create_index('ix_offer_history_recorded_at', 'offer_history', ['recorded_at'], unique=False,
+                    postgresql_using='brin')
+    op.create_index('ix_offer_history_product_id_recorded_at', 'offer_history', ['product_id', 'recorded_at'],
+                    unique=False)
+    # daily partitions are created by the maintain_offer_history_partitions task
+    op.execute("CREATE TABLE offer_history_default PARTITION OF offer_history DEFAULT")
+
+
+def downgrade():
+    op.drop_table('offer_history')
@@ -1,10 +1,14 @@
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from uuid import UUID
 
-from app import crud, schemas
+from app import crud, models, schemas
 from app.api import deps
+from app.api.export import NDJSON_MEDIA_TYPE, ndjson_response
+from app.api.pagination import decode_cursor, set_next_cursor
+from app.core import metrics
 from app.core.config import settings
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 router = APIRouter()
@@ -14,14 +18,104 @@ router = APIRouter()
     "/",
     response_model=List[schemas.Offer])
 def read_offers(
+    response: Response,
     db: Session = Depends(deps.get_db),
     skip: int = 0,
     limit: int = settings.API_MAX_RECORDS_LIMIT,
+    cursor: Optional[str] = None,
 ) -> List[schemas.Offer]:
     """
     A function that reads a list of offers from the database.
+
+    Passing `cursor` (empty for the first page) switches from offset to keyset pagination ordered by offer id.
+    The cursor of the next page is returned in the `X-Next-Cursor` response header.
+    """
+    if cursor is None:
+        return crud.offer.get_multi(db, skip=skip, limit=limit)
+    offers = crud.offer.get_multi_keyset(db, after=decode_cursor(cursor, UUID), limit=limit)
+    set_next_cursor(response, offers, limit, key=lambda offer: (offer.id,))
+    return offers
+
+
+@router.get(
+    "/export",
+    response_class=StreamingResponse,
+    responses={200: {"content": {NDJSON_MEDIA_TYPE: {}}}})
+def export_offers(
+    db: Session = Depends(deps.get_db),
+) -> StreamingResponse:
+    """
+    Stream all offers as newline-delimited JSON, one offer per line.
+    """
+    return ndjson_response(crud.offer.stream_multi(db))
+
+
+@router.post(
+    "/by-products",
+    response_model=Dict[UUID, Optional[List[schemas.Offer]]])
+def read_offers_by_products(
+    *,
+    db: Session = Depends(deps.get_db),
+    batch_in: schemas.BatchGet,
+) -> Dict[UUID, Optional[List[schemas.Offer]]]:
+    """
+    Retrieve offers of multiple products at once, keyed by product ID, at most `API_MAX_RECORDS_LIMIT` offers per
+    product, the cheapest first. Products that do not exist are returned as `null`.
     """
-    return crud.offer.get_multi(db, skip=skip, limit=limit)
+    offers = crud.offer.get_multi_by_products(db=db, product_ids=batch_in.ids)
+    return {id: offers.get(id) for id in batch_in.ids}
+
+
+@router.post(
+    "/ingest",
+    response_model=schemas.OffersIngestResult)
+def ingest_offers(
+    *,
+    db: Session = Depends(deps.get_db),
+    ingest_in: schemas.OffersIngest,
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> schemas.OffersIngestResult:
+    """
+    Apply offer changes pushed by a publisher - offers to create or update and ids of offers to remove - for many
+    products at once.
+
+    The products are not downloaded from the offer service again for `OFFER_INGEST_SYNC_DELAY_SECONDS`.
+    Products that do not exist are skipped and returned in `unknown_product_ids`. Changes of offers that belong to
+    another product are skipped as well, and an offer both upserted and removed is removed.
+    """
+    product_ids = list(dict.fromkeys(delta.product_id for delta in ingest_in.products))
+    known_product_ids = set(crud.product.get_existing_ids(db, ids=product_ids))
+    # an offer sent more than once is stored as sent last, a single upsert cannot change a row twice
+    upserts: Dict[UUID, dict] = {}
+    removals: List[Tuple[UUID, UUID]] = []
+    for delta in ingest_in.products:
+        if delta.product_id not in known_product_ids:
+            continue
+        for offer_in in delta.upserts:
+            upserts[offer_in.id] = {**offer_in.model_dump(), "product_id": delta.product_id}
+        removals.extend((delta.product_id, offer_id) for offer_id in delta.removals)
+    # both would be recorded in offer history with the same time, the offer is gone at the end of the push anyway
+    removed = set(removals)
+    upserts = {offer_id: offer for offer_id, offer in upserts.items() if (offer["product_id"], offer_id) not in removed}
+
+    # the same statements as the offer download, so the changes are recorded in offer history as well - but offers
+    # are not moved between products, a push changes offers of the products it is sent for only
+    changed_count = crud.offer.bulk_create_or_update(
+        db, objects=list(upserts.values()), commit=False, move_between_products=False) if upserts else 0
+    removed_count = crud.offer.remove_multiple_by_product_and_id(db, ids=removals, commit=False) if removals else 0
+    applied_product_ids = [product_id for product_id in product_ids if product_id in known_product_ids]
+    if applied_product_ids:
+        crud.product_offer_stats.refresh_multi(db, product_ids=applied_product_ids)
+        crud.product_sync_state.record_pushed(db, product_ids=applied_product_ids)
+    db.commit()
+    metrics.OFFERS_UPSERTED.labels("ingest").inc(changed_count)
+    metrics.OFFERS_DELETED.labels("ingest").inc(removed_count)
+    return schemas.OffersIngestResult(
+        products_count=len(applied_product_ids),
+        changed_count=changed_count,
+        removed_count=removed_count,
+        unknown_product_ids=[product_id for product_id in product_ids if product_id not in known_product_ids])
+
 
 @router.get(
     "/{id}",
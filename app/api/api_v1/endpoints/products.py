@@ -1,17 +1,30 @@
+import json
 import logging
-from typing import List
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Union
 from uuid import UUID
 
 import httpx
 from app import crud, models, schemas
 from app.api import deps
+from app.api.export import NDJSON_MEDIA_TYPE, ndjson_response
 from app.api.offer_api_auth import auth_token
+from app.api.offer_api_registration import REGISTRATION_ERRORS, is_registered, is_retryable, register_products
+from app.api.pagination import decode_cursor, set_next_cursor
+from app.core import offer_service_client
 from app.core.celery_app import celery_app
+from app.core.circuit_breaker import CircuitOpen, offer_service_circuit_breaker
 from app.core.config import settings
-from fastapi import APIRouter, Depends, HTTPException, status
+from app.core.offer_downloads import send_offer_downloads
+from app.core.rate_limit import RateLimitExceeded, offer_service_rate_limiter
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from tenacity import after_log, before_log, retry, retry_if_result, stop_after_attempt, wait_fixed
+from tenacity import (RetryCallState, after_log, before_log, retry, retry_if_result, stop_after_attempt,
+                      wait_fixed)
 
 router = APIRouter()
 
@@ -25,21 +38,52 @@ logger = logging.getLogger(__name__)
     response_model=List[schemas.Product]
 )
 def read_products(
+    response: Response,
     db: Session = Depends(deps.get_db),
     skip: int = 0,
-    limit: int = settings.API_MAX_RECORDS_LIMIT
+    limit: int = settings.API_MAX_RECORDS_LIMIT,
+    cursor: Optional[str] = None,
 ) -> List[schemas.Product]:
     """
     Retrieves a list of products from the database.
+
+    Passing `cursor` (empty for the first page) switches from offset to keyset pagination ordered by product id.
+    The cursor of the next page is returned in the `X-Next-Cursor` response header.
+    """
+    if cursor is None:
+        return crud.product.get_multi(db=db, skip=skip, limit=limit)
+    products = crud.product.get_multi_keyset(db=db, after=decode_cursor(cursor, UUID), limit=limit)
+    set_next_cursor(response, products, limit, key=lambda product: (product.id,))
+    return products
+
+
+@router.post(
+    "/batch-get",
+    response_model=Dict[UUID, Optional[schemas.Product]]
+)
+def read_products_batch(
+    *,
+    db: Session = Depends(deps.get_db),
+    batch_in: schemas.BatchGet,
+) -> Dict[UUID, Optional[schemas.Product]]:
     """
-    return crud.product.get_multi(db=db, skip=skip, limit=limit)
+    Retrieve multiple products by their IDs at once. Products that do not exist are returned as `null`.
+    """
+    products = {product.id: product for product in crud.product.get_multi_by_ids(db=db, ids=batch_in.ids)}
+    return {id: products.get(id) for id in batch_in.ids}
+
 
+def _should_retry_registration(value: httpx.Response) -> bool:
+    if value.status_code != 401:
+        return False
+    # the rejected token is dropped, so the retry gets a new one - unless another process has refreshed it already
+    auth_token.invalidate(value.request.headers["Bearer"])
+    return True
 
-def _should_retry_registration(value):
-    return (
-        value == httpx.HTTPStatusError
-        and value.response.status_code == 401
-        and auth_token.refresh_access_token())
+
+def _use_current_token(retry_state: RetryCallState) -> None:
+    # tenacity calls the function again with the same keyword arguments dict
+    retry_state.kwargs["auth_token"] = auth_token()
 
 
 @retry(
@@ -47,6 +91,9 @@ def _should_retry_registration(value):
     stop=stop_after_attempt(2),
     wait=wait_fixed(1),
     before=before_log(logger, logging.INFO),
+    before_sleep=_use_current_token,
+    # a second 401 is returned to the endpoint, which reports it
+    retry_error_callback=lambda retry_state: retry_state.outcome.result(),
     after=after_log(logger, logging.WARN),
 )
 def register_product_in_offer_service(
@@ -54,14 +101,18 @@ def register_product_in_offer_service(
         auth_token: str = Depends(auth_token)
 ) -> httpx.Response:
     try:
-        with httpx.Client() as client:
+        with offer_service_circuit_breaker.protect() as call:
+            offer_service_rate_limiter.acquire()
             headers = {"Bearer": auth_token}
-            product_register_response = client.post(f"{settings.OFFER_SERVICE_BASE_URL}api/v1/products/register",
-                                                    headers=headers,
-                                                    json=jsonable_encoder(product_in))
-            return product_register_response
+            product_register_response = offer_service_client.get_client().post(
+                f"{settings.OFFER_SERVICE_BASE_URL}api/v1/products/register",
+                headers=headers,
+                json=jsonable_encoder(product_in))
+            return call.check(product_register_response)
     except httpx.RequestError as exception:
         raise HTTPException(status_code=400, detail=str(exception))
+    except (RateLimitExceeded, CircuitOpen) as exception:
+        raise HTTPException(status_code=503, detail=str(exception))
 
 
 @router.post(
@@ -119,6 +170,142 @@ def create_product(
     return product
 
 
+@router.post(
+    "/deferred",
+    response_model=schemas.Product,
+    status_code=status.HTTP_202_ACCEPTED)
+def create_product_deferred(
+    product_in: schemas.ProductCreate,
+    db: Session = Depends(deps.get_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> schemas.Product:
+    """
+    Create a new product without waiting for its registration in the offer service.
+
+    The product is registered, and its offers downloaded, by a background task. If the offer service refuses to
+    register it, the product is removed again.
+    """
+    if crud.product.exists(db, id=product_in.id):
+        raise HTTPException(status_code=409, detail="Product already registered")
+    try:
+        product = crud.product_registration_outbox.create_with_product(db=db, obj_in=product_in)
+    except IntegrityError:
+        # created concurrently by another request
+        raise HTTPException(status_code=409, detail="Product already registered")
+    # the periodic drain picks the product up even if this task gets lost
+    celery_app.send_task("app.celery.worker.drain_product_registration_outbox")
+    return product
+
+
+def _parse_bulk_product(parse) -> Union[schemas.ProductCreate, str]:
+    # an invalid product is reported in its item of the report, it does not fail the whole import
+    try:
+        return parse()
+    except ValidationError as exception:
+        return "; ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" if error["loc"] else error["msg"]
+            for error in exception.errors())
+
+
+async def read_bulk_products_in(request: Request) -> List[Union[schemas.ProductCreate, str]]:
+    """
+    Products of a bulk import, read from a JSON array or, for `application/x-ndjson`, from one JSON object per line.
+    Invalid products are returned as the description of their errors.
+    """
+    body = await request.body()
+    ndjson = request.headers.get("content-type", "").split(";")[0].strip() == NDJSON_MEDIA_TYPE
+    if ndjson:
+        items = [line for line in body.splitlines() if line.strip()]
+    else:
+        try:
+            items = json.loads(body)
+        except ValueError as exception:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON: {exception}")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of products")
+    # an oversized import is refused before any of its products is validated
+    if len(items) > settings.API_MAX_BULK_SIZE:
+        raise HTTPException(
+            status_code=422, detail=f"At most {settings.API_MAX_BULK_SIZE} products can be imported at once")
+    if ndjson:
+        return [_parse_bulk_product(lambda line=line: schemas.ProductCreate.model_validate_json(line))
+                for line in items]
+    return [_parse_bulk_product(lambda item=item: schemas.ProductCreate.model_validate(item)) for item in items]
+
+
+@router.post(
+    "/bulk",
+    response_model=schemas.ProductBulkReport,
+    openapi_extra={"requestBody": {"required": True, "content": {
+        "application/json": {"schema": {"type": "array", "items": {"$ref": "#/components/schemas/ProductCreate"}}},
+        NDJSON_MEDIA_TYPE: {"schema": {"type": "string"}},
+    }}})
+def create_products_bulk(
+    *,
+    db: Session = Depends(deps.get_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+    products_in: List[Union[schemas.ProductCreate, str]] = Depends(read_bulk_products_in),
+    token: str = Depends(auth_token),
+) -> schemas.ProductBulkReport:
+    """
+    Create many products at once, from a JSON array or from newline-delimited JSON (`application/x-ndjson`).
+
+    Products are registered in the offer service concurrently and the registered ones are stored with one insert.
+    The report has the status of every product, in the order they were sent. Products that `failed` can be sent
+    again.
+    """
+    statuses: Dict[UUID, schemas.ProductBulkItem] = {}
+    new_products_in: Dict[UUID, schemas.ProductCreate] = {}
+    items = []
+    for index, product_in in enumerate(products_in):
+        if isinstance(product_in, str):
+            items.append(schemas.ProductBulkItem(index=index, status=schemas.ProductBulkStatus.invalid,
+                                                 detail=product_in))
+        elif product_in.id in statuses:
+            items.append(schemas.ProductBulkItem(index=index, id=product_in.id,
+                                                 status=schemas.ProductBulkStatus.duplicate))
+        else:
+            # the status is filled in below
+            statuses[product_in.id] = schemas.ProductBulkItem(
+                index=index, id=product_in.id, status=schemas.ProductBulkStatus.created)
+            items.append(statuses[product_in.id])
+            new_products_in[product_in.id] = product_in
+    for product_id in crud.product.get_existing_ids(db, ids=list(new_products_in)):
+        statuses[product_id].status = schemas.ProductBulkStatus.exists
+        del new_products_in[product_id]
+    # the database connection is not held while the offer service is called
+    db.rollback()
+
+    responses = offer_service_client.run_async(
+        register_products(list(new_products_in.values()), token)) if new_products_in else []
+    registered = []
+    for product_in, response in zip(new_products_in.values(), responses):
+        item = statuses[product_in.id]
+        if isinstance(response, REGISTRATION_ERRORS):
+            item.status, item.detail = schemas.ProductBulkStatus.failed, str(response) or repr(response)
+        elif isinstance(response, BaseException):
+            raise response
+        elif is_registered(response, product_in.id):
+            registered.append(product_in)
+        else:
+            if is_retryable(response):
+                item.status = schemas.ProductBulkStatus.failed
+            else:
+                item.status = schemas.ProductBulkStatus.rejected
+            item.detail = f"Offer service responded with {response.status_code}"
+    if any(response.status_code == 401 for response in responses if isinstance(response, httpx.Response)):
+        auth_token.invalidate(token)
+
+    created_ids = set(crud.product.create_multi(db, objs_in=registered))
+    for product_in in registered:
+        if product_in.id not in created_ids:
+            # created concurrently by another request
+            statuses[product_in.id].status = schemas.ProductBulkStatus.exists
+    # the first offer downloads are sent in batches, not as a task per product
+    send_offer_downloads([str(product_in.id) for product_in in registered if product_in.id in created_ids])
+    return schemas.ProductBulkReport(created_count=len(created_ids), items=items)
+
+
 @router.put(
     "/{id}",
     response_model=schemas.Product,
@@ -165,19 +352,104 @@ def read_product(
 )
 def read_product_offers(
     *,
+    response: Response,
     db: Session = Depends(deps.get_db),
     id: UUID,
+    skip: int = 0,
+    limit: int = settings.API_MAX_RECORDS_LIMIT,
+    cursor: Optional[str] = None,
 ) -> List[schemas.Offer]:
     """
     Retrieve a list of offers for a specific product.
+
+    Passing `cursor` (empty for the first page) switches from offset to keyset pagination ordered by price and id.
+    The cursor of the next page is returned in the `X-Next-Cursor` response header.
     """
     product = crud.product.get(db=db, id=id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    offers = crud.offer.get_multi_by_product(db=db, product_id=product.id)
+    if cursor is None:
+        return crud.offer.get_multi_by_product(db=db, product_id=product.id, skip=skip, limit=limit)
+    offers = crud.offer.get_multi_by_product_keyset(
+        db=db, product_id=product.id, after=decode_cursor(cursor, int, UUID), limit=limit)
+    set_next_cursor(response, offers, limit, key=lambda offer: (offer.price, offer.id))
     return offers
 
 
+@router.get(
+    "/{id}/stats",
+    response_model=schemas.ProductOfferStats,
+    responses={404: {"model": schemas.NotFoundResponse}}
+)
+def read_product_stats(
+    *,
+    db: Session = Depends(deps.get_db),
+    id: UUID,
+) -> schemas.ProductOfferStats:
+    """
+    Retrieve offer price and stock statistics of a specific product, as computed during the last offer download.
+    """
+    stats = crud.product_offer_stats.get(db=db, id=id)
+    if stats:
+        return stats
+    if not crud.product.exists(db=db, id=id):
+        raise HTTPException(status_code=404, detail="Product not found")
+    # offers of the product were not downloaded yet
+    return schemas.ProductOfferStats()
+
+
+def _with_timezone(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+@router.get(
+    "/{id}/price-history",
+    response_model=List[schemas.PriceHistoryBucket],
+    responses={404: {"model": schemas.NotFoundResponse}}
+)
+def read_product_price_history(
+    *,
+    db: Session = Depends(deps.get_db),
+    id: UUID,
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    bucket: schemas.PriceHistoryBucketSize = schemas.PriceHistoryBucketSize.day,
+) -> List[schemas.PriceHistoryBucket]:
+    """
+    Retrieve offer price changes of a specific product aggregated to time buckets.
+
+    The range defaults to the last `PRICE_HISTORY_DEFAULT_DAYS` days, times without timezone are in UTC.
+    """
+    if not crud.product.exists(db=db, id=id):
+        raise HTTPException(status_code=404, detail="Product not found")
+    to = _with_timezone(to) if to else datetime.now(timezone.utc)
+    from_ = _with_timezone(from_) if from_ else to - timedelta(days=settings.PRICE_HISTORY_DEFAULT_DAYS)
+    if from_ >= to:
+        raise HTTPException(status_code=400, detail="The 'from' time must be before the 'to' time")
+    return crud.offer_history.get_price_buckets(db=db, product_id=id, start=from_, end=to, bucket=bucket)
+
+
+@router.get(
+    "/{id}/offers/export",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {NDJSON_MEDIA_TYPE: {}}},
+        404: {"model": schemas.NotFoundResponse},
+    }
+)
+def export_product_offers(
+    *,
+    db: Session = Depends(deps.get_db),
+    id: UUID,
+) -> StreamingResponse:
+    """
+    Stream all offers of a specific product as newline-delimited JSON, one offer per line.
+    """
+    if not crud.product.exists(db=db, id=id):
+        raise HTTPException(status_code=404, detail="Product not found")
+    return ndjson_response(crud.offer.stream_multi(db, product_id=id))
+
+
 @router.delete(
     "/{id}",
     response_model=schemas.Product,
@@ -1,10 +1,11 @@
-from typing import Any, List
+from typing import Any, List, Optional
 
 from app import crud, models, schemas
 from app.api import deps
+from app.api.pagination import decode_cursor, set_next_cursor
 from app.core.config import settings
 from app.utils import send_new_account_email
-from fastapi import APIRouter, Body, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, HTTPException, Response
 from fastapi.encoders import jsonable_encoder
 from pydantic.networks import EmailStr
 from sqlalchemy.orm import Session
@@ -14,15 +15,22 @@ router = APIRouter()
 
 @router.get("/", response_model=List[schemas.User])
 def read_users(
+    response: Response,
     db: Session = Depends(deps.get_db),
     skip: int = 0,
     limit: int = settings.API_MAX_RECORDS_LIMIT,
+    cursor: Optional[str] = None,
     current_user: models.User = Depends(deps.get_current_active_superuser),
 ) -> Any:
     """
     Retrieve users.
+
+    Passing `cursor` (empty for the first page) switches to keyset pagination, see `X-Next-Cursor` response header.
     """
-    users = crud.user.get_multi(db, skip=skip, limit=limit)
+    if cursor is None:
+        return crud.user.get_multi(db, skip=skip, limit=limit)
+    users = crud.user.get_multi_keyset(db, after=decode_cursor(cursor, int), limit=limit)
+    set_next_cursor(response, users, limit, key=lambda user: (user.id,))
     return users
 
 
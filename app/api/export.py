@@ -0,0 +1,22 @@
+import json
+from typing import Iterable, Iterator, Sequence
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy.engine import Row
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _ndjson_lines(partitions: Iterable[Sequence[Row]]) -> Iterator[str]:
+    # one chunk per fetched partition keeps the number of sends low without buffering the whole result
+    for rows in partitions:
+        yield "".join(json.dumps(row._asdict(), default=str) + "\n" for row in rows)
+
+
+def ndjson_response(partitions: Iterable[Sequence[Row]]) -> StreamingResponse:
+    """
+    Stream rows as newline-delimited JSON.
+
+    The response is cancelled by Starlette when the client disconnects, so the rest of the rows is never fetched.
+    """
+    return StreamingResponse(_ndjson_lines(partitions), media_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,60 @@
+import time
+
+from app.core import metrics
+from app.core.query_profiler import log_if_slow, profile_queries
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+router = APIRouter()
+
+
+def _route(scope: Scope) -> str:
+    # the path template, not the path, so requests of all products are one time series
+    for route in scope["app"].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Record duration and database queries of every request, see `app.core.query_profiler`.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        with profile_queries() as queries:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                seconds = time.perf_counter() - start
+                route = _route(scope)
+                metrics.HTTP_REQUEST_DURATION.labels(scope["method"], route, str(status)).observe(seconds)
+                metrics.HTTP_REQUEST_QUERIES.labels(scope["method"], route).observe(queries.count)
+                metrics.HTTP_REQUEST_DB_DURATION.labels(scope["method"], route).observe(queries.seconds)
+                log_if_slow(f"{scope['method']} {scope['path']} ({status})", seconds, queries)
+
+
+@router.get("/metrics", include_in_schema=False)
+def read_metrics() -> Response:
+    """
+    Metrics in the Prometheus text format.
+    """
+    return Response(metrics.generate_metrics(include_shared=True), media_type=CONTENT_TYPE_LATEST)
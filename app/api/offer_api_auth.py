@@ -1,43 +1,153 @@
-from typing import Iterator
+import threading
+import time
+from typing import Iterator, Optional, Tuple
 
 import httpx
+from app.core import offer_service_client
+from app.core.circuit_breaker import CircuitOpen, offer_service_circuit_breaker
 from app.core.config import settings
+from app.core.rate_limit import RateLimitExceeded, offer_service_rate_limiter
 from app.core.redis import get_redis_pool
 from fastapi.exceptions import HTTPException
 from redis import Redis
+from redis.exceptions import LockError
 
 
 class OfferServiceAuthorization:
-    def __init__(self, client_secret: str, token_url: str, redis_pool: Iterator[Redis]) -> None:
+    """
+    Access token of the offer service, shared by all processes through Redis.
+
+    The token is cached in the process until `refresh_margin` seconds before it expires. Then a single process
+    refreshes it under a Redis lock, the others keep using the old token meanwhile or, if there is none, wait for the
+    new one instead of requesting their own.
+    """
+
+    def __init__(
+        self,
+        client_secret: str,
+        token_url: str,
+        redis_pool: Iterator[Redis],
+        key: str = "offer_service_access_token",
+        expire_seconds: Optional[int] = settings.OFFER_SERVICE_REFRESH_TOKEN_EXPIRE_SECONDS,
+        refresh_margin: float = settings.OFFER_SERVICE_TOKEN_REFRESH_MARGIN_SECONDS,
+        lock_timeout: float = settings.OFFER_SERVICE_TOKEN_REFRESH_LOCK_TIMEOUT_SECONDS,
+    ) -> None:
         self.client_secret = client_secret
         self.token_url = token_url
         self.redis_pool = redis_pool
+        self.key = key
+        self.lock_key = f"{key}:refresh_lock"
+        self.expire_seconds = expire_seconds
+        self.refresh_margin = refresh_margin
+        self.lock_timeout = lock_timeout
+        self._token: Optional[str] = None
+        self._refresh_at = 0.0
+        # threads of the process wait for each other, processes for the Redis lock
+        self._lock = threading.Lock()
 
-    def __call__(self, ) -> None:
-        with self.redis_pool as redis:
-            token = redis.get('offer_service_access_token')
-            if token is None:
-                token = self.refresh_access_token(redis)
-        return token
+    def __call__(self, ) -> str:
+        token = self._cached_token()
+        if token is not None:
+            return token
+        with self._lock:
+            token = self._cached_token()
+            if token is not None:
+                return token
+            with self.redis_pool as redis:
+                return self._get_or_refresh(redis)
+
+    def refresh(self) -> str:
+        """
+        Refresh the token even if it is still valid, other processes get the new token from Redis.
+        """
+        with self._lock, self.redis_pool as redis:
+            lock = redis.lock(self.lock_key, timeout=self.lock_timeout)
+            if not lock.acquire(blocking_timeout=self.lock_timeout):
+                raise HTTPException(status_code=503, detail="Offer service access token refresh timed out")
+            try:
+                return self.refresh_access_token(redis)
+            finally:
+                _release(lock)
 
-    def refresh_access_token(self, redis: Redis) -> None:
+    def invalidate(self, token: str) -> None:
+        """
+        Forget a token the offer service rejected, the next call gets a new one.
+        """
+        with self._lock, self.redis_pool as redis:
+            if self._token == token:
+                self._token = None
+            # a token refreshed by another process in the meantime is kept
+            if redis.get(self.key) == token:
+                redis.delete(self.key)
+
+    def refresh_access_token(self, redis: Redis) -> str:
         headers = {'Bearer': self.client_secret, 'accept': 'application/json'}
         try:
-            with httpx.Client() as client:
-                response = client.post(self.token_url, headers=headers)
+            with offer_service_circuit_breaker.protect():
+                offer_service_rate_limiter.acquire()
+                response = offer_service_client.get_client().post(self.token_url, headers=headers)
                 response.raise_for_status()
-                token_string = response.json().get("access_token")
-                redis.set(
-                    'offer_service_access_token',
-                    token_string,
-                    ex=settings.OFFER_SERVICE_REFRESH_TOKEN_EXPIRE_SECONDS)
-                return token_string
+                token_string = response.json()["access_token"]
+                redis.set(self.key, token_string, ex=self.expire_seconds)
         except KeyError:
             raise HTTPException(status_code=400, detail="access token field not received in response")
         except httpx.RequestError as exception:
             raise HTTPException(status_code=400, detail=str(exception))
         except httpx.HTTPStatusError as exception:
             raise HTTPException(status_code=exception.response.status_code, detail=str(exception))
+        except (RateLimitExceeded, CircuitOpen) as exception:
+            raise HTTPException(status_code=503, detail=str(exception))
+        self._cache(token_string, -1 if self.expire_seconds is None else self.expire_seconds * 1000)
+        return token_string
+
+    def _get_or_refresh(self, redis: Redis) -> str:
+        token, ttl = self._read(redis)
+        if token is not None and not self._is_expiring(ttl):
+            self._cache(token, ttl)
+            return token
+        lock = redis.lock(self.lock_key, timeout=self.lock_timeout)
+        # a still valid token is refreshed only if no other process is refreshing it already
+        if not lock.acquire(blocking=token is None, blocking_timeout=self.lock_timeout):
+            if token is not None:
+                return token
+            raise HTTPException(status_code=503, detail="Offer service access token refresh timed out")
+        try:
+            # the process holding the lock before could have refreshed the token already
+            token, ttl = self._read(redis)
+            if token is None or self._is_expiring(ttl):
+                return self.refresh_access_token(redis)
+        finally:
+            _release(lock)
+        self._cache(token, ttl)
+        return token
+
+    def _read(self, redis: Redis) -> Tuple[Optional[str], int]:
+        pipeline = redis.pipeline(transaction=False)
+        pipeline.get(self.key)
+        pipeline.pttl(self.key)
+        token, ttl = pipeline.execute()
+        return token, ttl
+
+    def _is_expiring(self, ttl: int) -> bool:
+        # negative ttl means the key does not expire
+        return 0 <= ttl <= self.refresh_margin * 1000
+
+    def _cached_token(self) -> Optional[str]:
+        if self._token is not None and time.monotonic() < self._refresh_at:
+            return self._token
+        return None
+
+    def _cache(self, token: str, ttl: int) -> None:
+        self._token = token
+        self._refresh_at = float("inf") if ttl < 0 else time.monotonic() + ttl / 1000 - self.refresh_margin
+
+
+def _release(lock) -> None:
+    try:
+        lock.release()
+    except LockError:
+        # the lock expired during a slow refresh and may be held by another process already
+        pass
 
 
 auth_token = OfferServiceAuthorization(
@@ -0,0 +1,57 @@
+import asyncio
+from typing import List, Sequence, Union
+from uuid import UUID
+
+import httpx
+from app.core import offer_service_client
+from app.core.circuit_breaker import CircuitOpen, offer_service_circuit_breaker
+from app.core.config import settings
+from app.core.rate_limit import RateLimitExceeded, offer_service_rate_limiter
+from app.schemas.product import ProductCreate
+from fastapi.encoders import jsonable_encoder
+
+# failures of a registration attempt that may succeed when repeated
+REGISTRATION_ERRORS = (httpx.HTTPError, RateLimitExceeded, CircuitOpen)
+
+
+async def _register_product(
+    client: httpx.AsyncClient, semaphore: asyncio.Semaphore, headers: dict, product_in: ProductCreate
+) -> httpx.Response:
+    async with semaphore, offer_service_circuit_breaker.protect_async() as call:
+        await offer_service_rate_limiter.acquire_async()
+        response = await client.post(
+            f"{settings.OFFER_SERVICE_BASE_URL}api/v1/products/register",
+            headers=headers,
+            json=jsonable_encoder(product_in))
+        return call.check(response)
+
+
+async def register_products(
+    products_in: Sequence[ProductCreate], token: str
+) -> List[Union[httpx.Response, Exception]]:
+    """
+    Register products in the offer service concurrently, at most `OFFER_SERVICE_MAX_CONCURRENCY` at a time.
+
+    Run it with `offer_service_client.run_async`. Returns the response, or the exception raised, for every product.
+    """
+    semaphore = asyncio.Semaphore(settings.OFFER_SERVICE_MAX_CONCURRENCY)
+    headers = {"Bearer": token}
+    client = offer_service_client.get_async_client()
+    return await asyncio.gather(
+        *(_register_product(client, semaphore, headers, product_in) for product_in in products_in),
+        return_exceptions=True)
+
+
+def is_registered(response: httpx.Response, product_id: UUID) -> bool:
+    # 409 means the product was registered before, e.g. by an attempt whose response got lost
+    if response.status_code == 409:
+        return True
+    try:
+        return response.status_code == 201 and response.json()["id"] == str(product_id)
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def is_retryable(response: httpx.Response) -> bool:
+    # an expired token, rate limiting or an error of the offer service, not a refusal of the product
+    return response.status_code in {401, 429} or response.status_code >= 500
@@ -0,0 +1,45 @@
+import base64
+import binascii
+import json
+from typing import Any, Callable, Optional, Sequence, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException, Response
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """
+    Encode keyset values of the last returned row into an opaque, url safe cursor.
+    """
+    payload = json.dumps([str(value) if isinstance(value, UUID) else value for value in values],
+                         separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types: Callable[[Any], Any]) -> Optional[Tuple[Any, ...]]:
+    """
+    Decode a cursor created by `encode_cursor`, converting its values by `types`.
+
+    Empty cursor means "start from the first page" and decodes to `None`.
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(cursor)
+        return tuple(value_type(value) for value_type, value in zip(types, values))
+    except (binascii.Error, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def set_next_cursor(
+    response: Response, items: Sequence[Any], limit: int, key: Callable[[Any], Sequence[Any]]
+) -> None:
+    """
+    Add cursor of the next page to the response headers. Nothing is added for the last page.
+    """
+    if items and len(items) >= limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(key(items[-1]))
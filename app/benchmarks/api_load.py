@@ -0,0 +1,268 @@
+"""
+Measure latency and throughput of API endpoints under concurrent load.
+
+Run against the configured database and Redis with
+`python -m app.benchmarks.api_load [--products 1000] [--offers-per-product 10] [--concurrency 1 10 50]
+[--requests 500] [--latency 0.05] [--error-rate 0] [--endpoints ...] [--output results.json]`.
+
+Temporary products with their offers are inserted, and the API is started by uvicorn in a subprocess. For every
+endpoint and concurrency level, `--requests` requests are sent by that many concurrent clients, after a round of
+warm-up requests that is not measured. `POST /products/` registers the products in an offer service stub running in
+this process. The stub answers after `--latency` seconds and fails `--error-rate` of the calls with 503.
+Rate limits and the circuit breaker are relaxed for the API. Offer download tasks it sends go to a queue of their
+own, which is purged afterwards. The products are deleted afterwards, together with their offers and the products
+created by the benchmark.
+
+The results are written as JSON to stdout, or to `--output`, latencies in milliseconds. Run the benchmark on two
+commits with the same arguments to compare them.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+from app.benchmarks.offer_service_stub import OfferServiceStub
+from app.core.celery_app import celery_app
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.offer import Offer
+from app.models.product import Product
+from app.models.product_offer_stats import ProductOfferStats
+from app.models.product_sync_state import ProductSyncState
+from sqlalchemy import delete, insert
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUEUE = "api-load-benchmark"
+SEED_BATCH_SIZE = 10000
+ENDPOINTS = ("GET /products/", "GET /offers/", "GET /products/{id}/offers", "POST /products/")
+
+# method, URL relative to the API root and keyword arguments of `httpx.AsyncClient.request`
+Request = Tuple[str, str, dict]
+
+
+def _seed(products: int, offers_per_product: int) -> List[str]:
+    product_ids = [str(uuid.uuid4()) for _ in range(products)]
+    with SessionLocal() as db:
+        for i in range(0, len(product_ids), SEED_BATCH_SIZE):
+            db.execute(insert(Product), [
+                {"id": product_id, "name": f"benchmark {product_id}", "description": "API load benchmark"}
+                for product_id in product_ids[i:i + SEED_BATCH_SIZE]])
+        offers = (
+            {"id": str(uuid.uuid4()), "price": random.randint(100, 10000), "items_in_stock": random.randint(0, 100),
+             "product_id": product_id}
+            for product_id in product_ids for _ in range(offers_per_product))
+        while batch := [offer for _, offer in zip(range(SEED_BATCH_SIZE), offers)]:
+            db.execute(insert(Offer), batch)
+        db.commit()
+    return product_ids
+
+
+def _delete(product_ids: List[str]) -> None:
+    with SessionLocal() as db:
+        for i in range(0, len(product_ids), SEED_BATCH_SIZE):
+            batch = product_ids[i:i + SEED_BATCH_SIZE]
+            for model in (ProductSyncState, ProductOfferStats, Offer):
+                db.execute(delete(model).where(model.product_id.in_(batch)))
+            db.execute(delete(Product).where(Product.id.in_(batch)))
+        db.commit()
+    with celery_app.connection_for_write() as connection:
+        connection.default_channel.queue_purge(QUEUE)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(port: int) -> None:
+    """
+    Run the API the way the benchmark starts it, with offer download tasks sent to the benchmark queue.
+    """
+    import uvicorn
+    from app.main import app
+
+    celery_app.conf.task_routes = {"*": {"queue": QUEUE}}
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def _start_api(offer_service: OfferServiceStub) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    env = dict(
+        os.environ,
+        OFFER_SERVICE_BASE_URL=offer_service.base_url,
+        OFFER_SERVICE_RATE_LIMIT_PER_SECOND="1000000",
+        OFFER_SERVICE_RATE_LIMIT_BURST="1000000",
+        OFFER_SERVICE_BREAKER_FAILURE_THRESHOLD="1000000",
+    )
+    api = subprocess.Popen([sys.executable, "-m", "app.benchmarks.api_load", "--serve", str(port)], env=env)
+    base_url = f"http://127.0.0.1:{port}{settings.API_V1_STR}/"
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            httpx.get(f"{base_url}openapi.json").raise_for_status()
+            return api, base_url
+        except httpx.HTTPError:
+            if api.poll() is not None or time.monotonic() > deadline:
+                api.terminate()
+                raise RuntimeError("The API did not start")
+            time.sleep(0.2)
+
+
+def _login(base_url: str) -> Dict[str, str]:
+    response = httpx.post(f"{base_url}login/access-token", data={
+        "username": settings.FIRST_SUPERUSER, "password": settings.FIRST_SUPERUSER_PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def _endpoints(product_ids: List[str], created_ids: List[str]) -> Dict[str, Callable[[], Request]]:
+    def create_product() -> Request:
+        product_id = str(uuid.uuid4())
+        created_ids.append(product_id)
+        return "POST", "products/", {"json": {"id": product_id, "name": "Benchmark", "description": "API load"}}
+
+    return dict(zip(ENDPOINTS, (
+        lambda: ("GET", "products/", {}),
+        lambda: ("GET", "offers/", {}),
+        lambda: ("GET", f"products/{random.choice(product_ids)}/offers", {}),
+        create_product,
+    )))
+
+
+def _percentile(quantiles: List[float], percent: int) -> float:
+    return round(quantiles[percent - 1] * 1000, 2)
+
+
+async def _load(
+    client: httpx.AsyncClient, next_request: Callable[[], Request], concurrency: int, requests: int
+) -> Dict[str, object]:
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    # shared by the clients, every request is sent once
+    remaining = iter(range(requests))
+
+    async def send() -> None:
+        for _ in remaining:
+            method, url, kwargs = next_request()
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                status = str(response.status_code)
+            except httpx.HTTPError as exception:
+                status = type(exception).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "seconds": round(seconds, 3),
+        "requests_per_second": round(len(latencies) / seconds, 2),
+        "p50_ms": _percentile(quantiles, 50),
+        "p95_ms": _percentile(quantiles, 95),
+        "p99_ms": _percentile(quantiles, 99),
+        "statuses": dict(statuses),
+    }
+
+
+async def _run_endpoint(
+    base_url: str, headers: Dict[str, str], next_request: Callable[[], Request], concurrency: int, requests: int
+) -> Dict[str, object]:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=60) as client:
+        # opens the connections and fills the caches of the API
+        await _load(client, next_request, concurrency, max(concurrency, 2))
+        return await _load(client, next_request, concurrency, requests)
+
+
+def run(
+    product_ids: List[str], created_ids: List[str], endpoints: List[str], concurrency_levels: List[int],
+    requests: int, latency: float, error_rate: float
+) -> List[Dict[str, object]]:
+    offer_service = OfferServiceStub(latency, error_rate).start()
+    api, base_url = _start_api(offer_service)
+    results = []
+    try:
+        headers = _login(base_url)
+        requests_by_endpoint = _endpoints(product_ids, created_ids)
+        for endpoint in endpoints:
+            for concurrency in concurrency_levels:
+                offer_service.max_in_flight = 0
+                result = asyncio.run(
+                    _run_endpoint(base_url, headers, requests_by_endpoint[endpoint], concurrency, requests))
+                results.append({"endpoint": endpoint, "concurrency": concurrency, "requests": requests, **result,
+                                "max_offer_service_calls_in_flight": offer_service.max_in_flight})
+                logger.info(json.dumps(results[-1]))
+    finally:
+        api.terminate()
+        api.wait()
+        offer_service.shutdown()
+    return results
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--offers-per-product", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per endpoint and concurrency")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the offer service takes to answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of offer service calls failing")
+    parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS), choices=ENDPOINTS)
+    parser.add_argument("--output", help="file to write the results to instead of stdout")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve)
+        return
+    if args.products < 1 or args.requests < 2:
+        parser.error("--products must be at least 1 and --requests at least 2")
+
+    product_ids = _seed(args.products, args.offers_per_product)
+    created_ids: List[str] = []
+    try:
+        results = run(product_ids, created_ids, args.endpoints, args.concurrency, args.requests, args.latency,
+                      args.error_rate)
+    finally:
+        _delete(product_ids + created_ids)
+    report = json.dumps({
+        "commit": _commit(),
+        "products": args.products,
+        "offers_per_product": args.offers_per_product,
+        "offer_service_latency": args.latency,
+        "offer_service_error_rate": args.error_rate,
+        "results": results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Measure how long the periodic offer download round takes to send tasks for many due products.
+
+Run against the configured database and Redis with `python -m app.benchmarks.fan_out [--products 100000] [--rounds 3]`.
+Temporary products with their sync state are inserted, all of them due. Each round runs `do_download_product_offers`,
+its tasks go to a queue of their own, which is purged after the round together with the in-flight markers of the
+products. The database must not hold due products of its own, the round would send them as well. The products are
+deleted afterwards.
+"""
+import argparse
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from app import crud
+from app.celery.worker_tasks import do_download_product_offers
+from app.core.celery_app import celery_app
+from app.core.config import settings
+from app.core.offer_downloads import DOWNLOAD_OFFERS_FOR_PRODUCTS_TASK, redis_pool, release_products
+from app.db.session import SessionLocal
+from app.models.product import Product
+from app.models.product_sync_state import ProductSyncState
+from sqlalchemy import delete, insert
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUEUE = "fan-out-benchmark"
+SEED_BATCH_SIZE = 10000
+
+
+def _seed(products: int) -> List[str]:
+    product_ids = [str(uuid.uuid4()) for _ in range(products)]
+    with SessionLocal() as db:
+        for i in range(0, len(product_ids), SEED_BATCH_SIZE):
+            batch = product_ids[i:i + SEED_BATCH_SIZE]
+            db.execute(insert(Product), [
+                {"id": product_id, "name": f"benchmark {product_id}", "description": "fan-out benchmark"}
+                for product_id in batch])
+            crud.product_sync_state.create_for_products(db, product_ids=batch)
+        db.commit()
+    return product_ids
+
+
+def _delete(product_ids: List[str]) -> None:
+    with SessionLocal() as db:
+        for i in range(0, len(product_ids), SEED_BATCH_SIZE):
+            batch = product_ids[i:i + SEED_BATCH_SIZE]
+            db.execute(delete(ProductSyncState).where(ProductSyncState.product_id.in_(batch)))
+            db.execute(delete(Product).where(Product.id.in_(batch)))
+        db.commit()
+
+
+def _reset(product_ids: List[str]) -> None:
+    with redis_pool as redis:
+        for i in range(0, len(product_ids), SEED_BATCH_SIZE):
+            release_products(redis, product_ids[i:i + SEED_BATCH_SIZE])
+        redis.delete(QUEUE)
+
+
+def run(product_ids: List[str], rounds: int) -> List[Dict[str, object]]:
+    results = []
+    for _ in range(rounds):
+        with SessionLocal() as db:
+            start = time.perf_counter()
+            result = do_download_product_offers(db)
+            results.append({"seconds": round(time.perf_counter() - start, 3), "result": result})
+        with redis_pool as redis:
+            results[-1]["tasks"] = redis.llen(QUEUE)
+        _reset(product_ids)
+        logger.info(json.dumps(results[-1]))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    with SessionLocal() as db:
+        if crud.product_sync_state.count_due(db, due_at=datetime.now(timezone.utc)):
+            parser.error("the database holds due products, the round would send tasks for them")
+
+    celery_app.conf.task_routes = {**celery_app.conf.task_routes, DOWNLOAD_OFFERS_FOR_PRODUCTS_TASK: QUEUE}
+    # every product is sent, regardless of the queue depth limit
+    settings.OFFER_DOWNLOAD_MAX_QUEUE_DEPTH = args.products
+    product_ids = _seed(args.products)
+    try:
+        results = run(product_ids, args.rounds)
+    finally:
+        _reset(product_ids)
+        _delete(product_ids)
+    print(json.dumps({"products": args.products, "rounds": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Local stand-in for the offer service, run by the benchmarks in a thread of their own process.
+
+It hands out an access token, registers every product and returns three offers derived from the product id. Calls
+other than the token request take `latency` seconds and fail with 503 at `error_rate`. Requests in flight are counted.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+
+class OfferServiceStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float, error_rate: float = 0.0) -> None:
+        super().__init__(("127.0.0.1", 0), _OfferServiceHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def start(self) -> "OfferServiceStub":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _OfferServiceHandler(BaseHTTPRequestHandler):
+    # keeps connections alive, as the offer service does
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        # the body is read even if it is not used, the connection is reused for the next request
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.endswith("/auth"):
+            self._send_json(201, {"access_token": "benchmark"})
+            return
+        with self._call():
+            if random.random() < self.server.error_rate:
+                self._send_json(503, {"detail": "Service unavailable"})
+            else:
+                self._send_json(201, {"id": json.loads(body)["id"]})
+
+    def do_GET(self) -> None:
+        with self._call():
+            if random.random() < self.server.error_rate:
+                self._send_json(503, {"detail": "Service unavailable"})
+                return
+            product_id = uuid.UUID(self.path.split("/")[-2])
+            self._send_json(200, [
+                {"id": str(uuid.uuid5(product_id, str(i))), "price": 100 + i, "items_in_stock": i} for i in range(3)])
+
+    @contextmanager
+    def _call(self) -> Iterator[None]:
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        try:
+            time.sleep(self.server.latency)
+            yield
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    def _send_json(self, status: int, data) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
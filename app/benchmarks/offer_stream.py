@@ -0,0 +1,96 @@
+"""
+Compare peak memory of storing one product's offers parsed by `Response.json()` and parsed from the streamed body.
+
+Run against the configured database with `python -m app.benchmarks.offer_stream [--offers 1000000]`.
+Every mode runs in its own process, peak RSS only grows during the life of a process. The offer service is replaced
+by a transport that generates the payload while it is being read, so the benchmark does not hold it either.
+A temporary product is created for every run and deleted afterwards, together with its offers and offer history.
+"""
+import argparse
+import json
+import logging
+import resource
+import subprocess
+import sys
+import time
+import uuid
+from typing import Dict, Iterator
+
+import httpx
+from app.celery.worker_tasks import _store_product_offers, _store_streamed_product_offers
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.offer import Offer
+from app.models.offer_history import OfferHistory
+from app.models.product import Product
+from app.models.product_sync_state import ProductSyncState
+from sqlalchemy import delete
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODES = ("json", "stream")
+
+
+def _payload(size: int) -> Iterator[bytes]:
+    yield b"["
+    for i in range(size):
+        offer = {"id": str(uuid.UUID(int=i + 1)), "price": i, "items_in_stock": i % 100}
+        yield (json.dumps(offer) + ("," if i < size - 1 else "")).encode()
+    yield b"]"
+
+
+def _client(size: int) -> httpx.Client:
+    return httpx.Client(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=_payload(size))))
+
+
+def _peak_rss_mb() -> float:
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(mode: str, size: int) -> Dict[str, float]:
+    results = {"baseline_rss_mb": _peak_rss_mb()}
+    with SessionLocal() as db, _client(size) as client:
+        product_id = str(uuid.uuid4())
+        db.add(Product(id=product_id, name=f"benchmark {product_id}", description="offer stream benchmark"))
+        db.commit()
+        try:
+            start = time.perf_counter()
+            with client.stream("GET", "http://offers.invalid/") as response:
+                if mode == "json":
+                    response.read()
+                    _store_product_offers(db, product_id, response.json(), None)
+                else:
+                    _store_streamed_product_offers(
+                        db, product_id, response.iter_text(settings.OFFER_DOWNLOAD_CHUNK_SIZE_BYTES), None)
+                db.commit()
+            results["seconds"] = time.perf_counter() - start
+            results["peak_rss_mb"] = _peak_rss_mb()
+        finally:
+            db.rollback()
+            db.execute(delete(ProductSyncState).where(ProductSyncState.product_id == product_id))
+            db.execute(delete(Offer).where(Offer.product_id == product_id))
+            db.execute(delete(Product).where(Product.id == product_id))
+            db.execute(delete(OfferHistory).where(OfferHistory.product_id == product_id))
+            db.commit()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--offers", type=int, default=1000000)
+    parser.add_argument("--mode", choices=MODES, help="run a single mode in this process")
+    args = parser.parse_args()
+    if args.mode is not None:
+        print(json.dumps(run(args.mode, args.offers)))
+        return
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, "-m", __spec__.name, "--mode", mode, "--offers", str(args.offers)],
+            check=True, capture_output=True, text=True).stdout
+        logger.info(json.dumps({"mode": mode, "offers": args.offers, **json.loads(output.splitlines()[-1])}))
+
+
+if __name__ == "__main__":
+    main()
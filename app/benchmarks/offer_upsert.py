@@ -0,0 +1,72 @@
+"""
+Compare the `INSERT ... VALUES` and the COPY + staging table paths of `CRUDOffer.replace_product_offers`.
+
+Run against the configured database with `python -m app.benchmarks.offer_upsert [--sizes 1000 10000 50000]`.
+A temporary product is created for every run and deleted afterwards, together with its offers and offer history.
+"""
+import argparse
+import json
+import logging
+import time
+import uuid
+from typing import Dict, List
+
+from app import crud
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.offer import Offer
+from app.models.offer_history import OfferHistory
+from app.models.product import Product
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _random_offers(size: int) -> List[dict]:
+    return [{"id": str(uuid.uuid4()), "price": i, "items_in_stock": i % 100} for i in range(size)]
+
+
+def _time_replace(db: Session, product_id: str, offers: List[dict], copy: bool) -> float:
+    # the threshold decides the path, so it is moved below or above the payload size
+    settings.OFFER_COPY_THRESHOLD = 0 if copy else len(offers)
+    start = time.perf_counter()
+    crud.offer.replace_product_offers(db, product_id=product_id, objects=offers)
+    return time.perf_counter() - start
+
+
+def run(size: int) -> Dict[str, float]:
+    results = {}
+    threshold = settings.OFFER_COPY_THRESHOLD
+    with SessionLocal() as db:
+        for path, copy in (("values", False), ("copy", True)):
+            product_id = str(uuid.uuid4())
+            db.add(Product(id=product_id, name=f"benchmark {product_id}", description="offer upsert benchmark"))
+            db.commit()
+            offers = _random_offers(size)
+            try:
+                # inserting new offers, then updating all of them
+                results[f"{path}_insert_seconds"] = _time_replace(db, product_id, offers, copy)
+                offers = [{**offer, "price": offer["price"] + 1} for offer in offers]
+                results[f"{path}_update_seconds"] = _time_replace(db, product_id, offers, copy)
+            finally:
+                settings.OFFER_COPY_THRESHOLD = threshold
+                db.rollback()
+                db.execute(delete(Offer).where(Offer.product_id == product_id))
+                db.execute(delete(Product).where(Product.id == product_id))
+                db.execute(delete(OfferHistory).where(OfferHistory.product_id == product_id))
+                db.commit()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    args = parser.parse_args()
+    for size in args.sizes:
+        logger.info(json.dumps({"offers": size, **run(size)}))
+
+
+if __name__ == "__main__":
+    main()
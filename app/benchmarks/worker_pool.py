@@ -0,0 +1,119 @@
+"""
+Compare offer download throughput of Celery worker pools.
+
+Run against the configured database and Redis with
+`python -m app.benchmarks.worker_pool [--products 2000] [--latency 0.2] [--pools prefork:1 threads:20]`.
+
+For every pool a worker is started that consumes a dedicated queue, and `download_offers_for_products` tasks for all
+the temporary products are sent to it. The offer service is replaced by a local HTTP server that answers after
+`--latency` seconds and counts requests in flight. Rate limits and the circuit breaker are relaxed for the worker, so
+only the pool limits the concurrency. Run it against a development Redis, a worker without a token stores the one of
+the stub there. The products are deleted afterwards, together with their offers, offer history and sync state.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import uuid
+from typing import Dict, List
+
+from app.benchmarks.offer_service_stub import OfferServiceStub
+from app.core.celery_app import celery_app
+from app.core.offer_downloads import DOWNLOAD_OFFERS_FOR_PRODUCTS_TASK
+from app.db.session import SessionLocal
+from app.models.offer import Offer
+from app.models.offer_history import OfferHistory
+from app.models.product import Product
+from app.models.product_offer_stats import ProductOfferStats
+from app.models.product_sync_state import ProductSyncState
+from sqlalchemy import delete, insert
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUEUE = "offer-download-benchmark"
+
+
+def _create_products(size: int) -> List[str]:
+    product_ids = [str(uuid.uuid4()) for _ in range(size)]
+    with SessionLocal() as db:
+        db.execute(insert(Product), [
+            {"id": product_id, "name": f"benchmark {product_id}", "description": "worker pool benchmark"}
+            for product_id in product_ids])
+        db.commit()
+    return product_ids
+
+
+def _delete_downloaded(product_ids: List[str], delete_products: bool = False) -> None:
+    with SessionLocal() as db:
+        for model in (ProductSyncState, ProductOfferStats, Offer, OfferHistory):
+            db.execute(delete(model).where(model.product_id.in_(product_ids)))
+        if delete_products:
+            db.execute(delete(Product).where(Product.id.in_(product_ids)))
+        db.commit()
+
+
+def _start_worker(pool: str, concurrency: int, offer_service: OfferServiceStub) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        OFFER_SERVICE_BASE_URL=offer_service.base_url,
+        OFFER_SERVICE_RATE_LIMIT_PER_SECOND="1000000",
+        OFFER_SERVICE_RATE_LIMIT_BURST="1000000",
+        OFFER_SERVICE_BREAKER_FAILURE_THRESHOLD="1000000",
+    )
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "celery", "-A", "app.celery.worker", "worker", "-l", "warning", "-Q", QUEUE,
+         "--pool", pool, "--concurrency", str(concurrency), "--without-gossip", "--without-mingle",
+         "--without-heartbeat", "-n", f"benchmark-{pool}@%h"],
+        env=env)
+    # the worker is ready once it answers a task
+    celery_app.send_task("app.celery.worker.test_celery", args=["ready"], queue=QUEUE).get(timeout=60)
+    return worker
+
+
+def run(pool: str, concurrency: int, product_ids: List[str], batch_size: int, latency: float) -> Dict[str, float]:
+    offer_service = OfferServiceStub(latency).start()
+    worker = _start_worker(pool, concurrency, offer_service)
+    try:
+        start = time.perf_counter()
+        results = [
+            celery_app.send_task(DOWNLOAD_OFFERS_FOR_PRODUCTS_TASK, args=[product_ids[i:i + batch_size]], queue=QUEUE)
+            for i in range(0, len(product_ids), batch_size)]
+        for result in results:
+            result.get(timeout=600)
+        seconds = time.perf_counter() - start
+    finally:
+        worker.terminate()
+        worker.wait()
+        offer_service.shutdown()
+        _delete_downloaded(product_ids)
+    return {
+        "seconds": seconds,
+        "products_per_second": len(product_ids) / seconds,
+        "max_requests_in_flight": offer_service.max_in_flight,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds the offer service takes to answer")
+    parser.add_argument("--pools", nargs="+", default=["prefork:1", "threads:20"], help="pool:concurrency")
+    args = parser.parse_args()
+    product_ids = _create_products(args.products)
+    try:
+        for pool_spec in args.pools:
+            pool, concurrency = pool_spec.split(":")
+            results = run(pool, int(concurrency), product_ids, args.batch_size, args.latency)
+            logger.info(json.dumps({"pool": pool, "concurrency": int(concurrency), "products": args.products,
+                                    "latency": args.latency, **results}))
+    finally:
+        _delete_downloaded(product_ids, delete_products=True)
+
+
+if __name__ == "__main__":
+    main()
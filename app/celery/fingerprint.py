@@ -0,0 +1,36 @@
+import hashlib
+from typing import Iterable
+
+_MODULUS = 2 ** 256
+
+
+class OffersFingerprint:
+    """
+    Order independent hash of an offers payload.
+
+    Every offer is normalized and hashed on its own and the hashes are summed, so the fingerprint neither depends on
+    the order the offer service returns the offers in nor needs the whole payload in memory at once.
+    """
+
+    def __init__(self) -> None:
+        self._count = 0
+        self._sum = 0
+
+    def update(self, offer: dict) -> None:
+        normalized = f"{str(offer['id']).lower()}:{int(offer['price'])}:{int(offer['items_in_stock'])}"
+        self._sum = (self._sum + int.from_bytes(hashlib.sha256(normalized.encode()).digest(), "big")) % _MODULUS
+        self._count += 1
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def hexdigest(self) -> str:
+        return hashlib.sha256(f"{self._count}:{self._sum:064x}".encode()).hexdigest()
+
+
+def offers_fingerprint(offers: Iterable[dict]) -> str:
+    fingerprint = OffersFingerprint()
+    for offer in offers:
+        fingerprint.update(offer)
+    return fingerprint.hexdigest()
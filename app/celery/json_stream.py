@@ -0,0 +1,70 @@
+import json
+from typing import Any, Iterable, Iterator
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+_NUMBER_CHARS = frozenset("0123456789+-.eE")
+
+
+def iter_json_array(chunks: Iterable[str]) -> Iterator[Any]:
+    """
+    Yield items of a JSON array read from text chunks, e.g. `httpx.Response.iter_text()`.
+
+    Only the unparsed rest of the text is kept, so memory does not grow with the size of the array, only with the size
+    of its largest item. Raises `ValueError` if the text is not a JSON array.
+    """
+    chunks = iter(chunks)
+    buffer = ""
+    position = 0
+    exhausted = False
+
+    def read() -> bool:
+        nonlocal buffer, position, exhausted
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            return False
+        buffer = buffer[position:] + chunk
+        position = 0
+        return True
+
+    def next_char() -> str:
+        # skips whitespace, returns empty string at the end of the text
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not read():
+                return ""
+
+    if next_char() != "[":
+        raise ValueError("Expected a JSON array")
+    position += 1
+    if next_char() == "]":
+        position += 1
+    else:
+        while True:
+            next_char()
+            while True:
+                try:
+                    item, end = _decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # the item continues in the next chunk
+                    if exhausted or not read():
+                        raise
+                    continue
+                # a number at the end of the buffer may continue in the next chunk, it is decoded again then
+                if exhausted or not _NUMBER_CHARS.issuperset(buffer[end:]) or not read():
+                    break
+            position = end
+            yield item
+            separator = next_char()
+            position += 1
+            if separator == "]":
+                break
+            if separator != ",":
+                raise ValueError(f"Expected ',' or ']' in JSON array, got {separator!r}")
+    if next_char() != "":
+        raise ValueError("Unexpected data after JSON array")
@@ -1,10 +1,70 @@
+import time
+from contextvars import Token
+from typing import Dict, List, Tuple
+
 import httpx
+from app.core import metrics, offer_service_client
 from app.core.celery_app import celery_app
 from app.core.config import settings
+from app.core.query_profiler import QueryProfile, log_if_slow, start_profile, stop_profile
 from app.db.session import SessionLocal
+from celery.signals import (task_postrun, task_prerun, worker_init, worker_process_init, worker_process_shutdown,
+                            worker_shutdown)
 
 from .worker_tasks import (do_download_offers_for_product,
-                           do_download_product_offers)
+                           do_download_offers_for_products,
+                           do_download_product_offers,
+                           do_drain_product_registration_outbox,
+                           do_maintain_offer_history_partitions,
+                           do_refresh_offer_service_token)
+
+
+@worker_process_init.connect
+def reset_offer_service_client(**kwargs):
+    # clients inherited from the parent process are not used by the forked child
+    offer_service_client.reset_after_fork()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_offer_service_client(**kwargs):
+    # pools without child processes, e.g. `threads`, only send `worker_shutdown`
+    offer_service_client.close()
+
+
+@worker_process_shutdown.connect
+def drop_process_metrics(**kwargs):
+    metrics.mark_process_dead()
+
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    # the main process serves metrics of the pool processes too, see `metrics.MULTIPROCESS`
+    metrics.start_metrics_server(settings.CELERY_METRICS_PORT)
+
+
+# start times and query profiles of running tasks by task id, tasks of the `threads` pool run concurrently in one
+# process - both signals are sent from the thread running the task, so its queries are recorded by its profile only
+_running_tasks: Dict[str, Tuple[float, QueryProfile, Token]] = {}
+
+
+@task_prerun.connect
+def start_task_profile(task_id: str, **kwargs):
+    _running_tasks[task_id] = (time.perf_counter(), *start_profile())
+
+
+@task_postrun.connect
+def record_task_profile(task_id: str, task, state: str, **kwargs):
+    running_task = _running_tasks.pop(task_id, None)
+    if running_task is None:
+        return
+    started_at, profile, token = running_task
+    stop_profile(token)
+    seconds = time.perf_counter() - started_at
+    metrics.CELERY_TASK_DURATION.labels(task.name, state or "UNKNOWN").observe(seconds)
+    metrics.CELERY_TASK_QUERIES.labels(task.name).observe(profile.count)
+    metrics.CELERY_TASK_DB_DURATION.labels(task.name).observe(profile.seconds)
+    log_if_slow(f"Task {task.name}[{task_id}]", seconds, profile)
 
 
 @celery_app.task(acks_late=True)
@@ -23,12 +83,36 @@ def download_offers_for_product(product_id: str) -> str:
         return do_download_offers_for_product(db, product_id)
 
 
+@celery_app.task(acks_late=True)
+def download_offers_for_products(product_ids: List[str]) -> str:
+    # failed products are not retried, they are downloaded again by the next periodic run
+    with SessionLocal() as db:
+        return do_download_offers_for_products(db, product_ids)
+
+
 @celery_app.task(acks_late=True)
 def download_product_offers() -> str:
     with SessionLocal() as db:
         return do_download_product_offers(db)
 
 
+@celery_app.task(acks_late=True)
+def maintain_offer_history_partitions() -> str:
+    with SessionLocal() as db:
+        return do_maintain_offer_history_partitions(db)
+
+
+@celery_app.task(acks_late=True)
+def drain_product_registration_outbox() -> str:
+    with SessionLocal() as db:
+        return do_drain_product_registration_outbox(db)
+
+
+@celery_app.task(acks_late=True)
+def refresh_offer_service_token() -> str:
+    return do_refresh_offer_service_token()
+
+
 @celery_app.on_after_finalize.connect
 def setup_periodic_tasks(sender, **kwargs):
     sender.add_periodic_task(
@@ -36,3 +120,20 @@ def setup_periodic_tasks(sender, **kwargs):
         download_product_offers.s(),
         name="Download new offers",
     )
+    sender.add_periodic_task(
+        settings.OFFER_HISTORY_MAINTENANCE_INTERVAL_SECONDS,
+        maintain_offer_history_partitions.s(),
+        name="Maintain offer history partitions",
+    )
+    # registrations are started by the API right away, this retries failed ones and picks up lost tasks
+    sender.add_periodic_task(
+        settings.OFFER_REGISTRATION_OUTBOX_INTERVAL_SECONDS,
+        drain_product_registration_outbox.s(),
+        name="Drain product registration outbox",
+    )
+    if settings.OFFER_SERVICE_REFRESH_TOKEN_EXPIRE_SECONDS is not None:
+        sender.add_periodic_task(
+            settings.OFFER_SERVICE_REFRESH_TOKEN_EXPIRE_SECONDS - settings.OFFER_SERVICE_TOKEN_REFRESH_MARGIN_SECONDS,
+            refresh_offer_service_token.s(),
+            name="Refresh offer service access token",
+        )
@@ -1,59 +1,319 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
 import httpx
 from app import crud
 from app.api.offer_api_auth import auth_token
+from app.api.offer_api_registration import REGISTRATION_ERRORS, is_registered, is_retryable, register_products
+from app.celery.fingerprint import OffersFingerprint, offers_fingerprint
+from app.celery.json_stream import iter_json_array
+from app.core import metrics, offer_service_client
 from app.core.celery_app import celery_app
+from app.core.circuit_breaker import HALF_OPEN, OPEN, CircuitOpen, offer_service_circuit_breaker
 from app.core.config import settings
+from app.core.offer_downloads import (DOWNLOAD_OFFERS_FOR_PRODUCTS_TASK, claim_products, redis_pool,
+                                      release_products, send_offer_downloads)
+from app.core.rate_limit import RateLimitExceeded, offer_service_rate_limiter
+from app.schemas.product import ProductCreate
 from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
+logger = logging.getLogger(__name__)
+
+DRAIN_PRODUCT_REGISTRATION_OUTBOX_TASK = "app.celery.worker.drain_product_registration_outbox"
+
+
+def _product_offers_url(product_id: str) -> str:
+    return f"{settings.OFFER_SERVICE_BASE_URL}api/v1/products/{product_id}/offers"
+
+
+def _record_offer_changes(changed_count: int, deleted_count: int) -> None:
+    # counted once written, a rollback of the transaction is not subtracted
+    metrics.OFFERS_UPSERTED.labels("download").inc(changed_count)
+    metrics.OFFERS_DELETED.labels("download").inc(deleted_count)
+
+
+def _store_product_offers(
+    db: Session, product_id: str, offers: List[dict], stored_fingerprint: Optional[str]
+) -> Optional[int]:
+    """
+    Store downloaded offers of a product, returns number of deleted offers. Changes are not committed.
+
+    Returns `None` without storing anything if the offers are the same as the stored ones.
+    """
+    fingerprint = offers_fingerprint(offers)
+    if fingerprint == stored_fingerprint:
+        return None
+
+    # offers, stats and deletions are committed together, so readers never see stats of a partial update
+    # This is based on assumption specified in the excersise description:
+    # "Once an offer sells out, it disappears and is replaced by another offer."
+    # delete removed offers - this could also be done in any other way,
+    # for example by setting 'is_available' flag or some other method
+    changed_count, deleted_count = crud.offer.replace_product_offers(
+        db, product_id=product_id, objects=offers, commit=False)
+    _record_offer_changes(changed_count, deleted_count)
+    crud.product_offer_stats.refresh(db, product_id=product_id)
+    crud.product_sync_state.set_fingerprint(db, product_id=product_id, fingerprint=fingerprint)
+    return deleted_count
 
-def _get_number_of_batches(number_of_products: int) -> str:
-    number_of_batches = 1
-    if number_of_products > settings.API_MAX_RECORDS_LIMIT:
-        number_of_batches = (
-            number_of_products // settings.API_MAX_RECORDS_LIMIT
-            + (1 if ((number_of_products % settings.API_MAX_RECORDS_LIMIT) > 0) else 0))
-    return number_of_batches
+
+def _store_streamed_product_offers(
+    db: Session, product_id: str, chunks: Iterable[str], stored_fingerprint: Optional[str]
+) -> Tuple[int, Optional[int]]:
+    """
+    Same as `_store_product_offers` for a JSON array of offers read in text chunks, also returns number of offers.
+    """
+    offers = iter_json_array(chunks)
+    # payloads small enough for one INSERT are kept in memory, unchanged ones then don't touch the database at all
+    first_offers = list(islice(offers, settings.OFFER_COPY_THRESHOLD + 1))
+    if len(first_offers) <= settings.OFFER_COPY_THRESHOLD:
+        return len(first_offers), _store_product_offers(db, product_id, first_offers, stored_fingerprint)
+
+    fingerprint = OffersFingerprint()
+
+    def fingerprinted(offers: Iterable[dict]) -> Iterator[dict]:
+        for offer in offers:
+            fingerprint.update(offer)
+            yield offer
+
+    # larger payloads are copied into the staging table as they are parsed, the fingerprint is known only at the end
+    crud.offer.stage_product_offers(db, product_id=product_id, objects=fingerprinted(chain(first_offers, offers)))
+    if fingerprint.hexdigest() == stored_fingerprint:
+        return fingerprint.count, None
+    changed_count, deleted_count = crud.offer.replace_product_offers_from_staging(
+        db, product_id=product_id, commit=False)
+    _record_offer_changes(changed_count, deleted_count)
+    crud.product_offer_stats.refresh(db, product_id=product_id)
+    crud.product_sync_state.set_fingerprint(db, product_id=product_id, fingerprint=fingerprint.hexdigest())
+    return fingerprint.count, deleted_count
 
 
 def do_download_offers_for_product(db: Session, product_id: str) -> str:
     try:
-        with httpx.Client() as client:
-            token = auth_token()
-            headers = {"Bearer": token}
-            offers_get_response = client.get(
-                f"{settings.OFFER_SERVICE_BASE_URL}api/v1/products/{product_id}/offers",
-                headers=headers,
-            )
-            offers_get_response.raise_for_status()
-            offers = offers_get_response.json()
-
-            if offers:
-                offers_values = list(map(lambda offer: {**offer, "product_id": product_id}, offers))
-                crud.offer.bulk_create_or_update(db=db, objects=offers_values)
-
-            # This is based on assumption specified in the excersise description:
-            # "Once an offer sells out, it disappears and is replaced by another offer."
-            # delete removed offers - this could also be done in any other way,
-            # for example by setting 'is_available' flag or some other method
-            offer_ids_to_delete = [
-                str(offer.id) for offer
-                in crud.offer.get_multi_by_product(db, product_id=product_id)
-                if str(offer.id) not in set(offer["id"] for offer in offers)
-            ]
-            crud.offer.remove_multiple_by_id(db, ids=offer_ids_to_delete)
-            return f"Created or updated {len(offers)} offers, deleted {len(offer_ids_to_delete)} offers."
-    except (httpx.HTTPError, KeyError, ValueError, HTTPException):
+        token = auth_token()
+        headers = {"Bearer": token}
+        with offer_service_circuit_breaker.protect():
+            offer_service_rate_limiter.acquire()
+            # the body is parsed as it arrives and offers are stored as they are parsed, so the worker never holds
+            # the whole payload of a product with a huge number of offers
+            with offer_service_client.get_client().stream(
+                "GET", _product_offers_url(product_id), headers=headers
+            ) as offers_get_response:
+                offers_get_response.raise_for_status()
+                stored_fingerprint = crud.product_sync_state.get_fingerprints(
+                    db, product_ids=[product_id]).get(product_id)
+                offers_count, deleted_count = _store_streamed_product_offers(
+                    db, product_id,
+                    offers_get_response.iter_text(settings.OFFER_DOWNLOAD_CHUNK_SIZE_BYTES), stored_fingerprint)
+
+        if deleted_count is None:
+            crud.product_sync_state.record_unchanged(db, product_ids=[product_id])
+            db.commit()
+            return "Offers unchanged, fingerprint hits 1, misses 0."
+        db.commit()
+        return (f"Created or updated {offers_count} offers, deleted {deleted_count} offers, "
+                "fingerprint hits 0, misses 1.")
+    except (httpx.HTTPError, KeyError, ValueError, HTTPException, RateLimitExceeded, CircuitOpen):
         raise Exception(f"Task download_offers_for_product({product_id}) failed")
 
 
+async def _fetch_product_offers(
+    client: httpx.AsyncClient, semaphore: asyncio.Semaphore, headers: dict, product_id: str
+) -> List[dict]:
+    async with semaphore, offer_service_circuit_breaker.protect_async():
+        # the limiter is shared by all processes, the semaphore only limits concurrency of this task
+        await offer_service_rate_limiter.acquire_async()
+        offers_get_response = await client.get(_product_offers_url(product_id), headers=headers)
+        offers_get_response.raise_for_status()
+        return offers_get_response.json()
+
+
+async def _fetch_offers_for_products(product_ids: List[str], token: str) -> Dict[str, Union[List[dict], Exception]]:
+    semaphore = asyncio.Semaphore(settings.OFFER_SERVICE_MAX_CONCURRENCY)
+    headers = {"Bearer": token}
+    client = offer_service_client.get_async_client()
+    results = await asyncio.gather(
+        *(_fetch_product_offers(client, semaphore, headers, product_id) for product_id in product_ids),
+        return_exceptions=True)
+    return dict(zip(product_ids, results))
+
+
+def do_download_offers_for_products(db: Session, product_ids: List[str]) -> str:
+    try:
+        return _download_offers_for_products(db, product_ids)
+    finally:
+        # the products can be enqueued by the next round again
+        with redis_pool as redis:
+            release_products(redis, product_ids)
+
+
+def _download_offers_for_products(db: Session, product_ids: List[str]) -> str:
+    try:
+        token = auth_token()
+    except HTTPException:
+        raise Exception(f"Task download_offers_for_products({len(product_ids)} products) failed")
+
+    # offers of all products are fetched concurrently, then written in one transaction
+    # the loop and its client outlive the task, so the next batch reuses the connections
+    results = offer_service_client.run_async(_fetch_offers_for_products(product_ids, token))
+
+    stored_fingerprints = crud.product_sync_state.get_fingerprints(db, product_ids=product_ids)
+    created_or_updated_count = deleted_count = failed_count = 0
+    unchanged_product_ids = []
+    for product_id, offers in results.items():
+        if isinstance(offers, (httpx.HTTPError, ValueError, RateLimitExceeded, CircuitOpen)):
+            logger.warning(f"Download of offers for product {product_id} failed: {offers!r}")
+            failed_count += 1
+            continue
+        if isinstance(offers, BaseException):
+            raise offers
+        try:
+            # a savepoint per product, so one invalid payload or concurrently deleted product does not fail the batch
+            with db.begin_nested():
+                product_deleted_count = _store_product_offers(
+                    db, product_id, offers, stored_fingerprints.get(product_id))
+        except (KeyError, TypeError, ValueError, IntegrityError) as exception:
+            logger.warning(f"Storing offers for product {product_id} failed: {exception!r}")
+            failed_count += 1
+            continue
+        if product_deleted_count is None:
+            unchanged_product_ids.append(product_id)
+            continue
+        created_or_updated_count += len(offers)
+        deleted_count += product_deleted_count
+    # failed products keep their schedule, so they are due again in the next round
+    if unchanged_product_ids:
+        crud.product_sync_state.record_unchanged(db, product_ids=unchanged_product_ids)
+    db.commit()
+    fingerprint_hits = len(unchanged_product_ids)
+    fingerprint_misses = len(product_ids) - failed_count - fingerprint_hits
+    return (
+        f"Downloaded offers for {len(product_ids) - failed_count} product(s), {failed_count} failed. "
+        f"Created or updated {created_or_updated_count} offers, deleted {deleted_count} offers, "
+        f"fingerprint hits {fingerprint_hits}, misses {fingerprint_misses}.")
+
+
 def do_download_product_offers(db: Session) -> str:
-    number_of_products = crud.product.get_number_of_products(db=db)
-    number_of_batches = _get_number_of_batches(number_of_products)
-
-    for i in range(number_of_batches):
-        product_only_ids_result = crud.product.get_multi_id(db=db, skip=i * settings.API_MAX_RECORDS_LIMIT,
-                                                            limit=settings.API_MAX_RECORDS_LIMIT)
-        for product in product_only_ids_result:
-            celery_app.send_task("app.celery.worker.download_offers_for_product", args=[str(product.id)])
-    return f"Send tasks to update offers for {number_of_products} product(s)."
+    # the round is paused while the offer service is down, its tasks would only fail
+    breaker_state = offer_service_circuit_breaker.state()
+    if breaker_state == OPEN:
+        logger.warning("Offer service circuit breaker is open, offer download round paused.")
+        return "Offer service circuit breaker is open, no tasks sent."
+    number_of_products = deduplicated_count = skipped_count = 0
+    due_at = datetime.now(timezone.utc)
+    # all tasks are published over one broker connection, instead of acquiring one from the pool for every task
+    with redis_pool as redis, celery_app.producer_or_acquire() as producer:
+        # backpressure - while tasks of previous rounds are still queued, only as many tasks are sent as fit under
+        # the queue depth limit, the rest of the products waits for the next round
+        queue = celery_app.conf.task_routes[DOWNLOAD_OFFERS_FOR_PRODUCTS_TASK]
+        tasks_budget = settings.OFFER_DOWNLOAD_MAX_QUEUE_DEPTH - redis.llen(queue)
+        if breaker_state == HALF_OPEN:
+            # a single task probes whether the offer service is back
+            tasks_budget = min(tasks_budget, 1)
+        batch_size = settings.OFFER_DOWNLOAD_BATCH_SIZE
+        read_count = 0
+        # only due products are sent, the most overdue first - products whose offers do not change are synced less
+        # and less often, see `crud.product_sync_state`
+        pages = crud.product_sync_state.stream_due_product_ids(db=db, due_at=due_at) if tasks_budget > 0 else ()
+        for due_product_ids in pages:
+            # only as many products are claimed as the remaining tasks can take
+            due_product_ids = due_product_ids[:tasks_budget * batch_size]
+            read_count += len(due_product_ids)
+            # products with a download still pending are not enqueued again
+            claimed_product_ids = claim_products(redis, due_product_ids)
+            deduplicated_count += len(due_product_ids) - len(claimed_product_ids)
+            for i in range(0, len(claimed_product_ids), batch_size):
+                # one task downloads offers of the whole batch concurrently
+                # `argsrepr` spares celery from building a repr of all the ids, which costs more than publishing
+                batch = claimed_product_ids[i:i + batch_size]
+                celery_app.send_task(DOWNLOAD_OFFERS_FOR_PRODUCTS_TASK, args=[batch],
+                                     argsrepr=f"[<{len(batch)} product ids>]", producer=producer)
+                tasks_budget -= 1
+            number_of_products += len(claimed_product_ids)
+            if tasks_budget <= 0:
+                break
+        if tasks_budget <= 0:
+            skipped_count = max(crud.product_sync_state.count_due(db=db, due_at=due_at) - read_count, 0)
+    if skipped_count:
+        logger.warning(f"Offer download queue is full, skipped {skipped_count} product(s).")
+    return (f"Send tasks to update offers for {number_of_products} product(s), "
+            f"{deduplicated_count} deduplicated, {skipped_count} skipped.")
+
+
+def do_drain_product_registration_outbox(db: Session) -> str:
+    registered_count = rejected_count = retried_count = 0
+    batch_size = settings.OFFER_REGISTRATION_BATCH_SIZE
+    while True:
+        # the batch is claimed and committed before the offer service is called, no transaction or connection is held
+        # during the registrations - the outcome is stored in a short transaction of its own
+        products = crud.product_registration_outbox.claim_due(db, limit=batch_size)
+        if not products:
+            break
+        try:
+            token = auth_token()
+        except HTTPException:
+            raise Exception("Task drain_product_registration_outbox failed")
+        responses = offer_service_client.run_async(register_products(
+            [ProductCreate(id=product.product_id, name=product.name, description=product.description)
+             for product in products],
+            token))
+
+        registered, rejected_product_ids, errors = [], [], {}
+        for product, response in zip(products, responses):
+            if isinstance(response, REGISTRATION_ERRORS):
+                errors[product.id] = repr(response)
+            elif isinstance(response, BaseException):
+                raise response
+            elif is_registered(response, product.product_id):
+                registered.append(product)
+            elif is_retryable(response):
+                errors[product.id] = f"Offer service responded with {response.status_code}"
+            else:
+                logger.warning(f"Offer service refused to register product {product.product_id}: "
+                               f"{response.status_code} {response.text}")
+                rejected_product_ids.append(product.product_id)
+        if any(response.status_code == 401 for response in responses if isinstance(response, httpx.Response)):
+            auth_token.invalidate(token)
+
+        crud.product_registration_outbox.remove_multiple_by_id(db, ids=[product.id for product in registered])
+        crud.product_sync_state.create_for_products(
+            db, product_ids=[product.product_id for product in registered])
+        crud.product_registration_outbox.record_failures(db, errors=errors)
+        # products the offer service refused are removed, as `create_product` does not create them either
+        crud.product.remove_multiple_by_id(db, ids=rejected_product_ids, commit=False)
+        db.commit()
+
+        # the first offer download of registered products is not left to the periodic round
+        registered_product_ids = [str(product.product_id) for product in registered]
+        send_offer_downloads(registered_product_ids)
+        registered_count += len(registered_product_ids)
+        rejected_count += len(rejected_product_ids)
+        retried_count += len(errors)
+        if len(products) < batch_size:
+            break
+    return (f"Registered {registered_count} product(s), {rejected_count} rejected, "
+            f"{retried_count} to be retried.")
+
+
+def do_refresh_offer_service_token() -> str:
+    try:
+        # refreshed ahead of time, so tasks and requests don't wait for the token when it expires
+        auth_token.refresh()
+    except HTTPException:
+        raise Exception("Task refresh_offer_service_token failed")
+    return "Offer service access token refreshed."
+
+
+def do_maintain_offer_history_partitions(db: Session) -> str:
+    # partitions are UTC days
+    today = datetime.now(timezone.utc).date()
+    created_days = crud.offer_history.create_partitions(
+        db=db, start=today, days=settings.OFFER_HISTORY_PRECREATE_DAYS)
+    dropped_days = crud.offer_history.drop_partitions_before(
+        db=db, before=today - timedelta(days=settings.OFFER_HISTORY_RETENTION_DAYS))
+    return f"Created {len(created_days)} and dropped {len(dropped_days)} offer history partition(s)."
@@ -9,4 +9,8 @@ celery_app.conf.task_routes = {
     "app.celery.worker.test_celery": "main-queue",
     "app.celery.worker.download_product_offers": "main-queue",
     "app.celery.worker.download_offers_for_product": "main-queue",
+    "app.celery.worker.download_offers_for_products": "main-queue",
+    "app.celery.worker.maintain_offer_history_partitions": "main-queue",
+    "app.celery.worker.refresh_offer_service_token": "main-queue",
+    "app.celery.worker.drain_product_registration_outbox": "main-queue",
 }
@@ -0,0 +1,160 @@
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator
+
+import httpx
+from app.core.config import settings
+from app.core.redis import get_redis_pool
+from redis import Redis
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# Decides whether a call may go through. The breaker is open while the `open` key exists. After it expires the
+# breaker is half-open until a call succeeds - a single trial call is let through at a time, others are rejected.
+BEFORE_CALL_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    return "reject"
+end
+if redis.call("EXISTS", KEYS[2]) == 0 then
+    return "call"
+end
+if redis.call("SET", KEYS[3], "1", "NX", "PX", ARGV[1]) then
+    return "trial"
+end
+return "reject"
+"""
+
+# Counts failures in a fixed window and opens the breaker when there are too many of them. Any failure while
+# the breaker is half-open opens it again.
+RECORD_FAILURE_SCRIPT = """
+if redis.call("EXISTS", KEYS[2]) == 1 then
+    redis.call("SET", KEYS[1], "1", "PX", ARGV[3])
+    redis.call("DEL", KEYS[3])
+    return 1
+end
+local failures = redis.call("INCR", KEYS[4])
+if failures == 1 then
+    redis.call("PEXPIRE", KEYS[4], ARGV[2])
+end
+if failures >= tonumber(ARGV[1]) then
+    redis.call("SET", KEYS[1], "1", "PX", ARGV[3])
+    redis.call("SET", KEYS[2], "1")
+    redis.call("DEL", KEYS[4])
+    return 1
+end
+return 0
+"""
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class BreakerCall:
+    def __init__(self, trial: bool) -> None:
+        self.trial = trial
+        self.failed = False
+        # calls that did not reach the service, e.g. because of the rate limiter, neither open nor close the breaker
+        self.completed = True
+
+    def check(self, response: httpx.Response) -> httpx.Response:
+        """
+        Count the call as failed if the service responded with a server error, for calls that don't raise on it.
+        """
+        if response.status_code >= 500:
+            self.failed = True
+        return response
+
+
+def _record_exception(call: BreakerCall, exception: BaseException) -> None:
+    # the service is up if it responded, unless it responded with a server error
+    if isinstance(exception, httpx.HTTPStatusError):
+        call.failed = call.failed or exception.response.status_code >= 500
+    elif isinstance(exception, httpx.TransportError):
+        call.failed = True
+    elif not call.failed:
+        call.completed = False
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker shared by all processes through Redis.
+
+    `failure_threshold` failures within `failure_window` seconds open the breaker, calls then fail fast with
+    `CircuitOpen` for `reset_timeout` seconds. Then the breaker is half-open and lets a single trial call through,
+    its success closes the breaker and its failure opens it again.
+    """
+
+    def __init__(
+        self, name: str, failure_threshold: int, failure_window: float, reset_timeout: float, redis: Redis
+    ) -> None:
+        self.name = name
+        self.keys = [f"circuit_breaker:{name}:{key}" for key in ("open", "tripped", "trial", "failures")]
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.reset_timeout = reset_timeout
+        self.redis = redis
+        self.before_call_script = redis.register_script(BEFORE_CALL_SCRIPT)
+        self.record_failure_script = redis.register_script(RECORD_FAILURE_SCRIPT)
+
+    def state(self) -> str:
+        is_open, is_tripped = self.redis.exists(self.keys[0]), self.redis.exists(self.keys[1])
+        if is_open:
+            return OPEN
+        return HALF_OPEN if is_tripped else CLOSED
+
+    def before_call(self) -> BreakerCall:
+        decision = self.before_call_script(keys=self.keys[:3], args=[int(self.reset_timeout * 1000)])
+        if decision == "reject":
+            raise CircuitOpen(f"Circuit breaker {self.name} is open")
+        return BreakerCall(trial=decision == "trial")
+
+    def after_call(self, call: BreakerCall) -> None:
+        if call.failed:
+            self.record_failure_script(
+                keys=self.keys,
+                args=[self.failure_threshold, int(self.failure_window * 1000), int(self.reset_timeout * 1000)])
+        elif call.trial and call.completed:
+            # successes are recorded only for trials, so calls through a closed breaker cost a single Redis call
+            self.redis.delete(*self.keys[1:])
+        elif call.trial:
+            self.redis.delete(self.keys[2])
+
+    @contextmanager
+    def protect(self) -> Iterator[BreakerCall]:
+        """
+        Guard the call in the block, raises `CircuitOpen` without running the block while the breaker is open.
+        """
+        call = self.before_call()
+        try:
+            yield call
+        except BaseException as exception:
+            _record_exception(call, exception)
+            raise
+        finally:
+            self.after_call(call)
+
+    @asynccontextmanager
+    async def protect_async(self) -> AsyncIterator[BreakerCall]:
+        """
+        Same as `protect`, the Redis calls run in a thread so they don't block the event loop.
+        """
+        call = await asyncio.to_thread(self.before_call)
+        try:
+            yield call
+        except BaseException as exception:
+            _record_exception(call, exception)
+            raise
+        finally:
+            await asyncio.to_thread(self.after_call, call)
+
+
+offer_service_circuit_breaker = CircuitBreaker(
+    name="offer_service",
+    failure_threshold=settings.OFFER_SERVICE_BREAKER_FAILURE_THRESHOLD,
+    failure_window=settings.OFFER_SERVICE_BREAKER_FAILURE_WINDOW_SECONDS,
+    reset_timeout=settings.OFFER_SERVICE_BREAKER_RESET_TIMEOUT_SECONDS,
+    redis=get_redis_pool(host=settings.REDIS_SERVER, password=settings.REDIS_PASSWORD),
+)
@@ -36,6 +36,9 @@ class Settings(BaseSettings):
     POSTGRES_DB_TESTING: str
     SQLALCHEMY_DATABASE_URI: Optional[PostgresDsn] = None
     SQLALCHEMY_TESTING_DATABASE_URI: Optional[PostgresDsn] = None
+    # connections of one process, the threads worker pool needs one per concurrently writing task
+    SQLALCHEMY_POOL_SIZE: int = 10
+    SQLALCHEMY_MAX_OVERFLOW: int = 10
 
 
     @classmethod
@@ -101,10 +104,56 @@ class Settings(BaseSettings):
     OFFER_SERVICE_BASE_URL: AnyHttpUrl
     DOWNLOAD_NEW_OFFERS_TASK_INTERVAL_SECONDS: Optional[int] = 30
     OFFER_SERVICE_REFRESH_TOKEN_EXPIRE_SECONDS: Optional[int] = 5*60
+    OFFER_SERVICE_TOKEN_REFRESH_MARGIN_SECONDS: int = 30
+    OFFER_SERVICE_TOKEN_REFRESH_LOCK_TIMEOUT_SECONDS: float = 60
+    OFFER_SERVICE_MAX_CONCURRENCY: int = 10
+    # shared by all tasks of a worker process, so up to worker concurrency times OFFER_SERVICE_MAX_CONCURRENCY
+    OFFER_SERVICE_MAX_CONNECTIONS: int = 200
+    OFFER_SERVICE_CONNECT_TIMEOUT_SECONDS: float = 5
+    OFFER_SERVICE_READ_TIMEOUT_SECONDS: float = 30
+    OFFER_SERVICE_RATE_LIMIT_PER_SECOND: float = 50
+    OFFER_SERVICE_RATE_LIMIT_BURST: int = 100
+    OFFER_SERVICE_RATE_LIMIT_MAX_WAIT_SECONDS: float = 30
+    OFFER_SERVICE_BREAKER_FAILURE_THRESHOLD: int = 5
+    OFFER_SERVICE_BREAKER_FAILURE_WINDOW_SECONDS: float = 30
+    OFFER_SERVICE_BREAKER_RESET_TIMEOUT_SECONDS: float = 30
+    OFFER_DOWNLOAD_BATCH_SIZE: int = 100
+    # due products the periodic offer download round reads and claims at once, sent in tasks of the batch size
+    OFFER_DOWNLOAD_ROUND_PAGE_SIZE: int = 10000
+    OFFER_REGISTRATION_BATCH_SIZE: int = 50
+    OFFER_REGISTRATION_OUTBOX_INTERVAL_SECONDS: int = 10
+    OFFER_REGISTRATION_RETRY_MIN_SECONDS: int = 10
+    OFFER_REGISTRATION_RETRY_MAX_SECONDS: int = 60*60
+    # outbox rows claimed by a drain are not due for others for this long, it has to cover the rate limiter waits and
+    # timeouts of registering a whole batch - rows of a drain that died are attempted again once it ends
+    OFFER_REGISTRATION_LEASE_SECONDS: int = 10*60
+    OFFER_DOWNLOAD_CHUNK_SIZE_BYTES: int = 64*1024
+    OFFER_DOWNLOAD_MIN_INTERVAL_SECONDS: int = 30
+    OFFER_DOWNLOAD_MAX_INTERVAL_SECONDS: int = 60*60
+    OFFER_DOWNLOAD_IN_FLIGHT_TTL_SECONDS: int = 5*60
+    OFFER_DOWNLOAD_MAX_QUEUE_DEPTH: int = 1000
+    # products with pushed offers are downloaded again only after this, to reconcile missed pushes
+    OFFER_INGEST_SYNC_DELAY_SECONDS: int = 60*60
+    # requests and tasks taking at least this long are logged with their database queries, not logged if not set
+    QUERY_PROFILE_LOG_THRESHOLD_SECONDS: Optional[float] = None
+    # port the Celery worker serves Prometheus metrics on
+    CELERY_METRICS_PORT: int = 9540
     REDIS_SERVER: str
     REDIS_PASSWORD: str
 
     API_MAX_RECORDS_LIMIT: Optional[int] = 100
+    API_MAX_BATCH_SIZE: int = 100
+    # products of one POST /products/bulk request, they are registered while the request waits - with the default
+    # offer service rate limit 500 products take about 10 seconds
+    API_MAX_BULK_SIZE: int = 500
+    # products of one POST /offers/ingest request
+    API_MAX_INGEST_PRODUCTS: int = 1000
+    OFFER_EXPORT_BATCH_SIZE: int = 1000
+    OFFER_COPY_THRESHOLD: int = 100
+    OFFER_HISTORY_RETENTION_DAYS: int = 365
+    OFFER_HISTORY_PRECREATE_DAYS: int = 7
+    OFFER_HISTORY_MAINTENANCE_INTERVAL_SECONDS: int = 60 * 60
+    PRICE_HISTORY_DEFAULT_DAYS: int = 30
 
     model_config = SettingsConfigDict(case_sensitive=True)
 
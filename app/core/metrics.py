@@ -0,0 +1,196 @@
+import logging
+import os
+import re
+import time
+
+import httpx
+from app.core.circuit_breaker import CLOSED, HALF_OPEN, OPEN, offer_service_circuit_breaker
+from app.core.rate_limit import offer_service_rate_limiter
+from prometheus_client import (REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+                               multiprocess, start_http_server)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+# Set for servers and workers running several processes, e.g. the prefork Celery pool. Every process then writes its
+# metrics to files in this directory and they are summed up when scraped.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+TASK_DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Duration of API requests", ["method", "route", "status"])
+HTTP_REQUEST_QUERIES = Histogram(
+    "http_request_queries", "Database queries per API request", ["method", "route"], buckets=QUERY_COUNT_BUCKETS)
+HTTP_REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds", "Time API requests spent running database queries", ["method", "route"])
+DB_POOL_SIZE = Gauge("db_pool_size", "Configured size of the database connection pool", multiprocess_mode="livesum")
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Database connections currently in use", multiprocess_mode="livesum")
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow", "Database connections open over the pool size", multiprocess_mode="livesum")
+DB_POOL_CHECKOUT_DURATION = Histogram(
+    "db_pool_checkout_duration_seconds",
+    "Time to get a database connection from the pool, including the wait for one",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+CELERY_TASK_DURATION = Histogram(
+    "celery_task_duration_seconds", "Duration of Celery tasks", ["task", "state"], buckets=TASK_DURATION_BUCKETS)
+CELERY_TASK_QUERIES = Histogram(
+    "celery_task_queries", "Database queries per Celery task", ["task"], buckets=QUERY_COUNT_BUCKETS)
+CELERY_TASK_DB_DURATION = Histogram(
+    "celery_task_db_duration_seconds", "Time Celery tasks spent running database queries", ["task"],
+    buckets=TASK_DURATION_BUCKETS)
+OFFERS_UPSERTED = Counter("offers_upserted", "Offers created or updated", ["source"])
+OFFERS_DELETED = Counter("offers_deleted", "Offers removed", ["source"])
+OFFER_SERVICE_REQUEST_DURATION = Histogram(
+    "offer_service_request_duration_seconds", "Time to the response headers of offer service calls",
+    ["endpoint", "status"])
+
+_ID_PATTERN = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    `QueuePool` exporting its state and how long getting a connection takes, see `create_engine(poolclass=...)`.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._update_gauges()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_DURATION.observe(time.perf_counter() - start)
+            self._update_gauges()
+
+    def _do_return_conn(self, record) -> None:
+        try:
+            super()._do_return_conn(record)
+        finally:
+            self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        DB_POOL_SIZE.set(self.size())
+        DB_POOL_CHECKED_OUT.set(self.checkedout())
+        # negative while the pool has fewer connections than its size
+        DB_POOL_OVERFLOW.set(max(self.overflow(), 0))
+
+
+def _offer_service_endpoint(request: httpx.Request) -> str:
+    # product ids would make a time series of every product
+    return _ID_PATTERN.sub("{id}", request.url.path)
+
+
+class InstrumentedTransport(httpx.BaseTransport):
+    """
+    Transport recording the latency of offer service calls into `OFFER_SERVICE_REQUEST_DURATION`.
+    """
+
+    def __init__(self, transport: httpx.BaseTransport) -> None:
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = self.transport.handle_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            OFFER_SERVICE_REQUEST_DURATION.labels(_offer_service_endpoint(request), status).observe(
+                time.perf_counter() - start)
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class InstrumentedAsyncTransport(httpx.AsyncBaseTransport):
+    """
+    Same as `InstrumentedTransport` for async clients.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport) -> None:
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = await self.transport.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            OFFER_SERVICE_REQUEST_DURATION.labels(_offer_service_endpoint(request), status).observe(
+                time.perf_counter() - start)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class OfferServiceCollector:
+    """
+    Throttling by the rate limiter and state of the circuit breaker of the offer service. Both are kept in Redis and
+    shared by all processes, so they are exported by the API only, to be counted once.
+    """
+
+    def collect(self):
+        limiter_metrics = offer_service_rate_limiter.get_metrics()
+        yield CounterMetricFamily(
+            "offer_service_rate_limit_throttled_calls", "Offer service calls that waited for the rate limiter",
+            value=limiter_metrics["throttled_calls"])
+        yield CounterMetricFamily(
+            "offer_service_rate_limit_throttled_seconds", "Time offer service calls waited for the rate limiter",
+            value=limiter_metrics["throttled_seconds"])
+        state = offer_service_circuit_breaker.state()
+        breaker_state = GaugeMetricFamily(
+            "offer_service_circuit_breaker_state", "1 for the current state of the offer service circuit breaker",
+            labels=["state"])
+        for name in (CLOSED, HALF_OPEN, OPEN):
+            breaker_state.add_metric([name], 1 if name == state else 0)
+        yield breaker_state
+
+
+def _registry() -> CollectorRegistry:
+    if not MULTIPROCESS:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+_shared_registry = CollectorRegistry()
+_shared_registry.register(OfferServiceCollector())
+
+
+def generate_metrics(include_shared: bool = False) -> bytes:
+    """
+    Metrics in the Prometheus text format, of all processes in the multiprocess mode.
+    """
+    output = generate_latest(_registry())
+    if include_shared:
+        output += generate_latest(_shared_registry)
+    return output
+
+
+def start_metrics_server(port: int) -> None:
+    """
+    Serve metrics on `port` from a background thread, e.g. of a Celery worker.
+    """
+    try:
+        start_http_server(port, registry=_registry())
+    except OSError as exception:
+        # another worker on the same host serves them already
+        logger.warning(f"Metrics server could not be started on port {port}: {exception!r}")
+
+
+def mark_process_dead() -> None:
+    """
+    Drop the live gauges of the exiting process in the multiprocess mode.
+    """
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
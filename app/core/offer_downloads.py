@@ -0,0 +1,54 @@
+from typing import List
+
+from app.core.celery_app import celery_app
+from app.core.config import settings
+from app.core.redis import get_redis_pool
+from redis import Redis
+
+redis_pool = get_redis_pool(host=settings.REDIS_SERVER, password=settings.REDIS_PASSWORD)
+IN_FLIGHT_KEY_PREFIX = "offer_download_in_flight:"
+DOWNLOAD_OFFERS_FOR_PRODUCTS_TASK = "app.celery.worker.download_offers_for_products"
+
+
+# claims a whole page of products with one command - a pipeline with a SET per product spends most of its time
+# building the commands and parsing their replies
+_CLAIM_SCRIPT = """
+local claimed = {}
+for i, key in ipairs(KEYS) do
+    claimed[i] = redis.call('SET', key, 1, 'NX', 'EX', ARGV[1]) and 1 or 0
+end
+return claimed
+"""
+
+
+def claim_products(redis: Redis, product_ids: List[str]) -> List[str]:
+    """
+    Mark products as having a download enqueued, returns the products that were not marked already.
+    """
+    # the marker expires, so products of a lost task are not skipped forever
+    claimed = redis.register_script(_CLAIM_SCRIPT)(
+        keys=[f"{IN_FLIGHT_KEY_PREFIX}{product_id}" for product_id in product_ids],
+        args=[settings.OFFER_DOWNLOAD_IN_FLIGHT_TTL_SECONDS])
+    return [product_id for product_id, is_claimed in zip(product_ids, claimed) if is_claimed]
+
+
+def release_products(redis: Redis, product_ids: List[str]) -> None:
+    if product_ids:
+        redis.delete(*(f"{IN_FLIGHT_KEY_PREFIX}{product_id}" for product_id in product_ids))
+
+
+def send_offer_downloads(product_ids: List[str]) -> int:
+    """
+    Send `download_offers_for_products` tasks for products, in batches of `OFFER_DOWNLOAD_BATCH_SIZE`.
+
+    Products with a download pending already are skipped. Returns the number of products sent.
+    """
+    with redis_pool as redis:
+        claimed_product_ids = claim_products(redis, product_ids)
+    if claimed_product_ids:
+        with celery_app.producer_or_acquire() as producer:
+            for i in range(0, len(claimed_product_ids), settings.OFFER_DOWNLOAD_BATCH_SIZE):
+                batch = claimed_product_ids[i:i + settings.OFFER_DOWNLOAD_BATCH_SIZE]
+                celery_app.send_task(DOWNLOAD_OFFERS_FOR_PRODUCTS_TASK, args=[batch],
+                                     argsrepr=f"[<{len(batch)} product ids>]", producer=producer)
+    return len(claimed_product_ids)
@@ -0,0 +1,114 @@
+import asyncio
+import importlib.util
+import os
+import threading
+from typing import Awaitable, Optional, TypeVar
+
+import httpx
+from app.core.config import settings
+from app.core.metrics import InstrumentedAsyncTransport, InstrumentedTransport
+
+T = TypeVar("T")
+
+# HTTP/2 multiplexes concurrent requests over one connection, it needs the optional `h2` package (httpx[http2])
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+_lock = threading.Lock()
+_pid: Optional[int] = None
+_client: Optional[httpx.Client] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        settings.OFFER_SERVICE_READ_TIMEOUT_SECONDS, connect=settings.OFFER_SERVICE_CONNECT_TIMEOUT_SECONDS)
+
+
+def _transport_options() -> dict:
+    # options of the connection pool go to the transport, the client ignores them when given one
+    return dict(
+        http2=HTTP2,
+        limits=httpx.Limits(
+            max_connections=settings.OFFER_SERVICE_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OFFER_SERVICE_MAX_CONNECTIONS),
+    )
+
+
+def _check_pid() -> None:
+    # connections inherited from the parent process share their sockets with it, they are dropped without being
+    # closed, closing them would close them for the parent too
+    global _pid, _client, _loop, _loop_thread, _async_client
+    if _pid != os.getpid():
+        _pid, _client, _loop, _loop_thread, _async_client = os.getpid(), None, None, None, None
+
+
+def get_client() -> httpx.Client:
+    """
+    Client of the offer service shared by all threads of the process, its connections are kept alive between calls.
+    """
+    with _lock:
+        _check_pid()
+        global _client
+        if _client is None:
+            _client = httpx.Client(
+                transport=InstrumentedTransport(httpx.HTTPTransport(**_transport_options())), timeout=_timeout())
+        return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Async client of the offer service for coroutines run by `run_async`.
+    """
+    with _lock:
+        _check_pid()
+        global _async_client
+        if _async_client is None:
+            _async_client = httpx.AsyncClient(
+                transport=InstrumentedAsyncTransport(httpx.AsyncHTTPTransport(**_transport_options())),
+                timeout=_timeout())
+        return _async_client
+
+
+def run_async(coroutine: Awaitable[T]) -> T:
+    """
+    Run the coroutine in the event loop of the process and wait for its result.
+
+    The loop runs in its own thread for the whole life of the process, so the async client bound to it keeps its
+    connections between calls. Coroutines of all threads calling this, e.g. tasks of the `threads` Celery pool, run
+    in the loop concurrently.
+    """
+    with _lock:
+        _check_pid()
+        global _loop, _loop_thread
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="offer-service-loop", daemon=True)
+            _loop_thread.start()
+        loop = _loop
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+
+def reset_after_fork() -> None:
+    with _lock:
+        _check_pid()
+
+
+def close() -> None:
+    """
+    Close the clients of the process and their connections.
+    """
+    global _client, _loop, _loop_thread, _async_client
+    with _lock:
+        _check_pid()
+        client, loop, loop_thread, async_client = _client, _loop, _loop_thread, _async_client
+        _client, _loop, _loop_thread, _async_client = None, None, None, None
+    if client is not None:
+        client.close()
+    if loop is not None:
+        if async_client is not None:
+            asyncio.run_coroutine_threadsafe(async_client.aclose(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join()
+        loop.close()
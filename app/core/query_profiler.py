@@ -0,0 +1,126 @@
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Iterator, List, Tuple
+
+from app.core.config import settings
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# statements are shortened to this in reports, long VALUES lists do not help to recognize them
+STATEMENT_REPORT_LENGTH = 200
+
+
+class QueryProfile:
+    """
+    Statements run during a unit of work, e.g. a request or a task, and the time spent in the database.
+
+    Statements are counted by their text without parameters, so the same statement run again and again - typically
+    a query per item of a list, the N+1 problem - shows up as a duplicate.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter = Counter()
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    def duplicates(self) -> List[Tuple[str, int]]:
+        """
+        Statements run more than once, the most frequent first.
+        """
+        return [(statement, count) for statement, count in self.statements.most_common() if count > 1]
+
+    def report(self) -> str:
+        lines = [f"{self.count} queries in {self.seconds * 1000:.1f} ms"]
+        for statement, count in self.statements.most_common():
+            statement = " ".join(statement.split())
+            if len(statement) > STATEMENT_REPORT_LENGTH:
+                statement = statement[:STATEMENT_REPORT_LENGTH] + "..."
+            lines.append(f"{count:>5}x {statement}")
+        return "\n".join(lines)
+
+
+_profiles: ContextVar[Tuple[QueryProfile, ...]] = ContextVar("query_profiles", default=())
+
+
+def start_profile() -> Tuple[QueryProfile, Token]:
+    """
+    Start profiling statements of the current context, pass the token to `stop_profile`. Profiles can be nested,
+    a statement is recorded by all of them.
+    """
+    profile = QueryProfile()
+    return profile, _profiles.set(_profiles.get() + (profile,))
+
+
+def stop_profile(token: Token) -> None:
+    _profiles.reset(token)
+
+
+@contextmanager
+def profile_queries() -> Iterator[QueryProfile]:
+    """
+    Profile statements run in the block, including threads the block hands its context to - e.g. sync endpoints
+    FastAPI runs in its thread pool.
+    """
+    profile, token = start_profile()
+    try:
+        yield profile
+    finally:
+        stop_profile(token)
+
+
+@contextmanager
+def profile_engine(engine: Engine) -> Iterator[QueryProfile]:
+    """
+    Profile all statements run on the engine during the block, by any thread and in any context. Meant for tests,
+    where the application runs in threads of the test client.
+    """
+    profile = QueryProfile()
+
+    def record(conn, cursor, statement, parameters, context, executemany) -> None:
+        profile.record(statement, _elapsed(context))
+
+    event.listen(engine, "after_cursor_execute", record)
+    try:
+        yield profile
+    finally:
+        event.remove(engine, "after_cursor_execute", record)
+
+
+def log_if_slow(name: str, seconds: float, profile: QueryProfile) -> None:
+    """
+    Log the statements of a request or task that took at least `QUERY_PROFILE_LOG_THRESHOLD_SECONDS`.
+    """
+    threshold = settings.QUERY_PROFILE_LOG_THRESHOLD_SECONDS
+    if threshold is not None and seconds >= threshold:
+        logger.warning(f"{name} took {seconds * 1000:.1f} ms, {profile.report()}")
+
+
+def _elapsed(context) -> float:
+    # statements run while connecting have no execution context
+    started_at = getattr(context, "_query_profiler_started_at", None)
+    return time.perf_counter() - started_at if started_at is not None else 0.0
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_timer(conn, cursor, statement, parameters, context, executemany) -> None:
+    if context is not None:
+        context._query_profiler_started_at = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_statement(conn, cursor, statement, parameters, context, executemany) -> None:
+    profiles = _profiles.get()
+    if profiles:
+        seconds = _elapsed(context)
+        for profile in profiles:
+            profile.record(statement, seconds)
@@ -0,0 +1,130 @@
+import asyncio
+import time
+from typing import Dict
+
+from app.core.config import settings
+from app.core.redis import get_redis_pool
+from redis import Redis
+
+# Refills the bucket by the time passed since the last call and takes `requested` tokens. Tokens that are not there yet
+# are reserved - the bucket goes negative and the caller waits until they are due, so concurrent callers wait for
+# consecutive slots instead of all retrying at once. Returns number of seconds to wait, 0 if the tokens were there.
+# A wait longer than `max_wait` is returned without taking the tokens. Redis time is used, so the clocks of the calling
+# processes do not matter. The wait is returned as a string, Lua numbers are truncated to integers.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local max_wait = tonumber(ARGV[4])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local wait = math.max(0, (requested - tokens) / rate)
+if wait <= max_wait then
+    tokens = tokens - requested
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated_at", tostring(now))
+-- the bucket is kept until it is full again, reservations would be lost with it
+redis.call("PEXPIRE", KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter shared by all processes through Redis.
+
+    `rate` tokens per second are added to the bucket, up to `burst` tokens. Every call takes a token, reserving it if
+    the bucket is empty and waiting until it is due. If that would take more than `max_wait` seconds,
+    `RateLimitExceeded` is raised right away.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, max_wait: float, redis: Redis) -> None:
+        self.key = f"rate_limit:{name}"
+        self.metrics_key = f"rate_limit:{name}:metrics"
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.redis = redis
+        self.script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+        # throttling of this process, `get_metrics` returns the totals of all processes
+        self.throttled_calls = 0
+        self.throttled_seconds = 0.0
+
+    def reserve(self, tokens: int = 1) -> float:
+        """
+        Take tokens, reserving them if they are not there yet. Returns number of seconds until they are due, 0 if they
+        were there. Nothing is taken if the wait would be longer than `max_wait`.
+        """
+        return float(self.script(keys=[self.key], args=[self.rate, self.burst, tokens, self.max_wait]))
+
+    def acquire(self, tokens: int = 1) -> float:
+        """
+        Take tokens, waiting for them if needed. Returns number of seconds spent waiting.
+        """
+        start = time.monotonic()
+        wait = self.reserve(tokens)
+        if wait == 0:
+            return 0.0
+        try:
+            self._check_wait(wait)
+            time.sleep(wait)
+        finally:
+            throttled_seconds = self._record_throttling(start)
+        return throttled_seconds
+
+    async def acquire_async(self, tokens: int = 1) -> float:
+        """
+        Take tokens, waiting for them without blocking the event loop. Returns number of seconds spent waiting.
+        """
+        # the Redis call runs in a thread, the client is synchronous and shared by all event loops of the process
+        start = time.monotonic()
+        wait = await asyncio.to_thread(self.reserve, tokens)
+        if wait == 0:
+            return 0.0
+        try:
+            self._check_wait(wait)
+            await asyncio.sleep(wait)
+        finally:
+            throttled_seconds = self._record_throttling(start)
+        return throttled_seconds
+
+    def get_metrics(self) -> Dict[str, float]:
+        metrics = self.redis.hgetall(self.metrics_key)
+        return {
+            "throttled_calls": int(metrics.get("throttled_calls", 0)),
+            "throttled_seconds": float(metrics.get("throttled_seconds", 0)),
+        }
+
+    def _check_wait(self, wait: float) -> None:
+        # the script did not reserve the tokens then
+        if wait > self.max_wait:
+            raise RateLimitExceeded(
+                f"Rate limit {self.key} exceeded, the call would wait more than {self.max_wait} seconds")
+
+    def _record_throttling(self, start: float) -> float:
+        # only throttled calls are recorded, so a call that gets its token right away costs a single Redis call
+        throttled_seconds = time.monotonic() - start
+        self.throttled_calls += 1
+        self.throttled_seconds += throttled_seconds
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.hincrby(self.metrics_key, "throttled_calls", 1)
+        pipeline.hincrbyfloat(self.metrics_key, "throttled_seconds", throttled_seconds)
+        pipeline.execute()
+        return throttled_seconds
+
+
+offer_service_rate_limiter = TokenBucket(
+    name="offer_service",
+    rate=settings.OFFER_SERVICE_RATE_LIMIT_PER_SECOND,
+    burst=settings.OFFER_SERVICE_RATE_LIMIT_BURST,
+    max_wait=settings.OFFER_SERVICE_RATE_LIMIT_MAX_WAIT_SECONDS,
+    redis=get_redis_pool(host=settings.REDIS_SERVER, password=settings.REDIS_PASSWORD),
+)
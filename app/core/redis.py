@@ -8,6 +8,9 @@ def get_redis_pool(host: str, password: str) -> Iterator[redis.Redis]:
         session = redis.from_url(
             f"redis://{host}:6379?decode_responses=True&encoding=utf-8&health_check_interval=2",
             password=password)
+        # the client is shared by threads of the process, leaving a `with` block must not disconnect connections
+        # other threads are using
+        session.auto_close_connection_pool = False
         return session
     finally:
         session.close()
@@ -1,3 +1,7 @@
 from .crud_offer import offer
+from .crud_offer_history import offer_history
 from .crud_product import product
+from .crud_product_offer_stats import product_offer_stats
+from .crud_product_registration_outbox import product_registration_outbox
+from .crud_product_sync_state import product_sync_state
 from .crud_user import user
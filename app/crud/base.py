@@ -1,10 +1,12 @@
-from typing import Any, Dict, Generic, List, Optional, Type, TypeVar, Union
+from typing import Any, Dict, Generic, List, Optional, Sequence, Tuple, Type, TypeVar, Union
 from uuid import UUID
 
 from app.core.config import settings
 from app.db.base_class import Base
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
+from sqlalchemy import ColumnElement, all_, any_, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import Session
 
 ModelType = TypeVar("ModelType", bound=Base)
@@ -12,6 +14,21 @@ CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
 UpdateSchemaType = TypeVar("UpdateSchemaType", bound=BaseModel)
 
 
+def equals_any(column: Any, values: Sequence[Any]) -> ColumnElement[bool]:
+    """
+    `column = ANY(:values)` - values are sent as one array parameter instead of a parameter per value as with `IN`,
+    so the statement stays the same for any number of values.
+    """
+    return column == any_(literal(list(values), ARRAY(column.type)))
+
+
+def not_equals_all(column: Any, values: Sequence[Any]) -> ColumnElement[bool]:
+    """
+    `column <> ALL(:values)` - negation of `equals_any`, true for any value when `values` is empty.
+    """
+    return column != all_(literal(list(values), ARRAY(column.type)))
+
+
 class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     def __init__(self, model: Type[ModelType]):
         """
@@ -27,6 +44,9 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     def get(self, db: Session, id: Any) -> Optional[ModelType]:
         return db.query(self.model).filter(self.model.id == id).first()
 
+    def get_multi_by_ids(self, db: Session, *, ids: Sequence[Any]) -> List[ModelType]:
+        return db.query(self.model).filter(equals_any(self.model.id, ids)).all()
+
     def get_multi(
         self, db: Session, *, skip: int = 0, limit: int = settings.API_MAX_RECORDS_LIMIT
     ) -> List[ModelType]:
@@ -37,6 +57,25 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     ) -> List[UUID]:
         return db.query(self.model.id).offset(skip).limit(limit).all()
 
+    def get_multi_keyset(
+        self, db: Session, *, after: Optional[Tuple[Any]] = None, limit: int = settings.API_MAX_RECORDS_LIMIT
+    ) -> List[ModelType]:
+        # keyset pagination - the page is found by primary key index lookup instead of skipping `offset` rows,
+        # so every page costs the same and rows do not shift between pages on concurrent writes
+        query = db.query(self.model)
+        if after is not None:
+            query = query.filter(self.model.id > after[0])
+        return query.order_by(self.model.id.asc()).limit(limit).all()
+
+    def get_multi_id_keyset(
+        self, db: Session, *, after: Optional[Tuple[Any]] = None, limit: int = settings.API_MAX_RECORDS_LIMIT
+    ) -> List[UUID]:
+        # plain ids instead of ORM rows, this is used to iterate over all rows of large tables
+        statement = select(self.model.id)
+        if after is not None:
+            statement = statement.filter(self.model.id > after[0])
+        return db.scalars(statement.order_by(self.model.id.asc()).limit(limit)).all()
+
     def count(self, db: Session) -> int:
         return db.query(self.model).count()
 
@@ -1,13 +1,93 @@
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 from uuid import UUID
 
+import psycopg2
+
 from app.core.config import settings
 from app.models.offer import Offer
+from app.models.offer_history import OfferHistory
+from app.models.product import Product
 from app.schemas.offer import OfferCreate, OfferUpdate
-from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy.orm import Session
+from sqlalchemy import (CTE, Column, ColumnElement, Integer, MetaData, Table, Uuid, and_, delete, exists, literal,
+                        or_, select, text, true, tuple_)
+from sqlalchemy.dialects.postgresql import Insert, insert
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session, aliased
+
+from .base import CRUDBase, equals_any, not_equals_all
+
+# Temporary table the large offer payloads are copied into before being merged into `offer`. It lives in its own
+# metadata, so it is neither created by `create_all` nor seen by alembic.
+offer_staging = Table(
+    "offer_staging",
+    MetaData(),
+    Column("id", Uuid),
+    Column("price", Integer),
+    Column("items_in_stock", Integer),
+    Column("product_id", Uuid),
+)
+
+
+class _CopyRows:
+    """
+    File-like object `copy_expert` reads COPY text rows from, rows are formatted as they are read.
+    """
+
+    def __init__(self, objects: Iterable[dict]) -> None:
+        self._objects = iter(objects)
+        self._buffer = ""
+        self.error: Optional[Exception] = None
 
-from .base import CRUDBase
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            # values are parsed, so nothing in a row needs escaping and invalid values fail as with INSERT
+            try:
+                # objects may be produced while they are read, e.g. parsed from a response, and fail as well -
+                # with a network error as much as with an invalid value
+                obj = next(self._objects, None)
+                if obj is None:
+                    break
+                self._buffer += (
+                    f"{UUID(str(obj['id']))}\t{int(obj['price'])}\t{int(obj['items_in_stock'])}\t"
+                    f"{UUID(str(obj['product_id']))}\n")
+            except Exception as e:
+                # psycopg2 turns errors of `read` into QueryCanceled, the original one is raised after the COPY
+                self.error = e
+                raise
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+def _copy_to_staging(db: Session, objects: Iterable[dict]) -> None:
+    # the staging table is dropped at commit, it is only truncated when reused within one transaction
+    db.execute(text("CREATE TEMPORARY TABLE IF NOT EXISTS offer_staging "
+                    "(id uuid, price integer, items_in_stock integer, product_id uuid) ON COMMIT DROP"))
+    db.execute(text("TRUNCATE offer_staging"))
+    rows = _CopyRows(objects)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert("COPY offer_staging (id, price, items_in_stock, product_id) FROM STDIN", rows)
+    except psycopg2.Error:
+        if rows.error is not None:
+            raise rows.error
+        raise
+    finally:
+        cursor.close()
+
+
+def _insert_history(changed_offers: CTE, items_in_stock: Optional[int] = None) -> Insert:
+    # The data modifying CTE and the history insert run as one statement, so changes are recorded without
+    # another round trip and without sending the changed offers back to the client.
+    return insert(OfferHistory).from_select(
+        ["offer_id", "product_id", "price", "items_in_stock"],
+        select(
+            changed_offers.c.id,
+            changed_offers.c.product_id,
+            changed_offers.c.price,
+            changed_offers.c.items_in_stock if items_in_stock is None else literal(items_in_stock)),
+    ).add_cte(changed_offers)
 
 
 class CRUDOffer(CRUDBase[Offer, OfferCreate, OfferUpdate]):
@@ -23,23 +103,182 @@ class CRUDOffer(CRUDBase[Offer, OfferCreate, OfferUpdate]):
             .all()
         )
 
-    def bulk_create_or_update(self, db: Session, *, objects: List[OfferCreate]) -> None:
+    def get_multi_by_product_keyset(
+        self,
+        db: Session,
+        *,
+        product_id: str,
+        after: Optional[Tuple[int, UUID]] = None,
+        limit: int = settings.API_MAX_RECORDS_LIMIT
+    ) -> List[Offer]:
+        # offers are ordered by price, id is added to the key to make the order total
+        query = db.query(self.model).filter(Offer.product_id == str(product_id))
+        if after is not None:
+            query = query.filter(tuple_(Offer.price, Offer.id) > tuple_(*after))
+        return query.order_by(Offer.price.asc(), Offer.id.asc()).limit(limit).all()
+
+    def get_multi_by_products(
+        self, db: Session, *, product_ids: Sequence[UUID], limit: int = settings.API_MAX_RECORDS_LIMIT
+    ) -> Dict[UUID, List[Offer]]:
+        """
+        Offers of products keyed by product id, the `limit` cheapest per product. Products that do not exist are left
+        out, products without offers get an empty list.
+        """
+        # one query - the products are outer joined with a lateral subquery, which reads at most `limit` offers of
+        # every product from the (product_id, price, id) index
+        product_offers = aliased(Offer, (
+            select(Offer)
+            .where(Offer.product_id == Product.id)
+            .order_by(Offer.price, Offer.id)
+            .limit(limit)
+            .lateral()))
+        rows = db.execute(
+            select(Product.id, product_offers)
+            .outerjoin(product_offers, true())
+            .where(equals_any(Product.id, product_ids))
+            .order_by(Product.id, product_offers.price, product_offers.id))
+        offers: Dict[UUID, List[Offer]] = {}
+        for product_id, offer in rows:
+            offers.setdefault(product_id, [])
+            if offer is not None:
+                offers[product_id].append(offer)
+        return offers
+
+    def stream_multi(
+        self, db: Session, *, product_id: Optional[str] = None, batch_size: int = settings.OFFER_EXPORT_BATCH_SIZE
+    ) -> Iterator[Sequence[Row]]:
+        # plain rows instead of ORM objects - nothing is kept in the session identity map, and `yield_per` makes
+        # psycopg2 use a server side cursor, so only `batch_size` rows are held in memory at any time
+        statement = select(Offer.id, Offer.price, Offer.items_in_stock, Offer.product_id)
+        if product_id is not None:
+            statement = statement.filter(Offer.product_id == str(product_id))
+        return db.execute(statement.execution_options(yield_per=batch_size)).partitions()
+
+    def bulk_create_or_update(
+        self, db: Session, *, objects: List[OfferCreate], commit: bool = True, move_between_products: bool = True
+    ) -> int:
+        """
+        Create or update offers and record the changes in offer history. Returns number of changed offers.
+
+        With `move_between_products` false, offers that belong to another product than the one they are sent for
+        are left unchanged.
+        """
         # this is postgres specific, but should be way faster for large datasets than doing it in SQLAlchemy ORM
         # database agnostic way
-        statement = insert(Offer).values(objects)
+        if len(objects) > settings.OFFER_COPY_THRESHOLD:
+            # a VALUES list this long means a huge statement to compile and hold in memory, and hits the limit of
+            # parameters per statement - the rows are streamed by COPY and merged from the staging table instead
+            _copy_to_staging(db, objects)
+            changed_count = self._merge_staging(db, move_between_products)
+        else:
+            changed_count = self._upsert(db, insert(Offer).values(objects), move_between_products)
+        if commit:
+            db.commit()
+        return changed_count
+
+    def _merge_staging(self, db: Session, move_between_products: bool = True) -> int:
+        return self._upsert(db, insert(Offer).from_select(
+            ["id", "price", "items_in_stock", "product_id"],
+            select(offer_staging.c.id, offer_staging.c.price, offer_staging.c.items_in_stock,
+                   offer_staging.c.product_id)), move_between_products)
+
+    def _upsert(self, db: Session, statement: Insert, move_between_products: bool = True) -> int:
+        # unchanged offers are neither rewritten nor recorded in history
+        changed = or_(
+            Offer.price != statement.excluded.price,
+            Offer.items_in_stock != statement.excluded.items_in_stock,
+            Offer.product_id != statement.excluded.product_id)
+        if not move_between_products:
+            changed = and_(Offer.product_id == statement.excluded.product_id, changed)
         statement = statement.on_conflict_do_update(
             index_elements=[Offer.id],
             set_=dict(
                 id=statement.excluded.id,
                 price=statement.excluded.price,
                 items_in_stock=statement.excluded.items_in_stock,
-                product_id=statement.excluded.product_id))
-        db.execute(statement)
-        db.commit()
+                product_id=statement.excluded.product_id),
+            where=changed)
+        changed_offers = statement.returning(
+            Offer.id, Offer.product_id, Offer.price, Offer.items_in_stock).cte("changed_offers")
+        return db.execute(_insert_history(changed_offers)).rowcount
+
+    def remove_multiple_by_id(self, db: Session, *, ids: List[UUID], commit: bool = True) -> int:
+        """
+        Remove offers, they are recorded in offer history as sold out. Returns number of removed offers.
+        """
+        removed_offers = (
+            delete(Offer)
+            .where(Offer.id.in_(ids))
+            .returning(Offer.id, Offer.product_id, Offer.price, Offer.items_in_stock)
+            .cte("removed_offers"))
+        removed_count = db.execute(_insert_history(removed_offers, items_in_stock=0)).rowcount
+        if commit:
+            db.commit()
+        return removed_count
+
+    def remove_multiple_by_product_and_id(
+        self, db: Session, *, ids: Sequence[Tuple[UUID, UUID]], commit: bool = True
+    ) -> int:
+        """
+        Same as `remove_multiple_by_id` for `(product_id, offer_id)` pairs, offers of other products are not removed.
+        """
+        removed_offers = (
+            delete(Offer)
+            .where(tuple_(Offer.product_id, Offer.id).in_(ids))
+            .returning(Offer.id, Offer.product_id, Offer.price, Offer.items_in_stock)
+            .cte("removed_offers"))
+        removed_count = db.execute(_insert_history(removed_offers, items_in_stock=0)).rowcount
+        if commit:
+            db.commit()
+        return removed_count
+
+    def replace_product_offers(
+        self, db: Session, *, product_id: str, objects: List[dict], commit: bool = True
+    ) -> Tuple[int, int]:
+        """
+        Make `objects` the only offers of the product - offers are created or updated and offers of the product
+        missing in `objects` are removed, all changes are recorded in offer history.
+        Returns number of changed and number of removed offers.
+        """
+        if len(objects) > settings.OFFER_COPY_THRESHOLD:
+            self.stage_product_offers(db, product_id=product_id, objects=objects)
+            return self.replace_product_offers_from_staging(db, product_id=product_id, commit=commit)
+        objects = [{**obj, "product_id": product_id} for obj in objects]
+        changed_count = self.bulk_create_or_update(db=db, objects=objects, commit=False) if objects else 0
+        removed_count = self._remove_missing(
+            db, product_id=product_id, is_missing=not_equals_all(Offer.id, [obj["id"] for obj in objects]))
+        if commit:
+            db.commit()
+        return changed_count, removed_count
+
+    def stage_product_offers(self, db: Session, *, product_id: str, objects: Iterable[dict]) -> None:
+        """
+        Copy offers of the product into the staging table. `objects` are consumed while they are being copied, so
+        they can be streamed without holding them all in memory.
+        """
+        _copy_to_staging(db, ({**obj, "product_id": product_id} for obj in objects))
+
+    def replace_product_offers_from_staging(
+        self, db: Session, *, product_id: str, commit: bool = True
+    ) -> Tuple[int, int]:
+        """
+        Same as `replace_product_offers` for offers copied by `stage_product_offers`.
+        """
+        changed_count = self._merge_staging(db)
+        removed_count = self._remove_missing(
+            db, product_id=product_id, is_missing=~exists().where(offer_staging.c.id == Offer.id))
+        if commit:
+            db.commit()
+        return changed_count, removed_count
 
-    def remove_multiple_by_id(self, db: Session, *, ids: List[UUID]) -> None:
-        db.query(self.model).filter(self.model.id.in_(ids)).delete(synchronize_session="fetch")
-        db.commit()
+    def _remove_missing(self, db: Session, *, product_id: str, is_missing: ColumnElement[bool]) -> int:
+        # missing offers are found by the database in the same statement that removes them
+        removed_offers = (
+            delete(Offer)
+            .where(Offer.product_id == str(product_id), is_missing)
+            .returning(Offer.id, Offer.product_id, Offer.price, Offer.items_in_stock)
+            .cte("removed_offers"))
+        return db.execute(_insert_history(removed_offers, items_in_stock=0)).rowcount
 
 
 offer = CRUDOffer(Offer)
@@ -0,0 +1,99 @@
+from datetime import date, datetime, time, timedelta, timezone
+from typing import List, Optional
+
+from app.models.offer_history import OfferHistory
+from app.schemas.offer_history import OfferHistoryCreate, OfferHistoryUpdate, PriceHistoryBucketSize
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from .base import CRUDBase
+
+PARTITION_PREFIX = "offer_history_"
+DEFAULT_PARTITION = f"{PARTITION_PREFIX}default"
+
+
+def _day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+class CRUDOfferHistory(CRUDBase[OfferHistory, OfferHistoryCreate, OfferHistoryUpdate]):
+    def get_price_buckets(
+        self, db: Session, *, product_id: str, start: datetime, end: datetime, bucket: PriceHistoryBucketSize
+    ) -> List[Row]:
+        # the time range prunes partitions, so the query cost does not grow with the overall history length
+        # buckets are UTC hours and days, like the partitions, whatever the time zone of the session
+        bucket_start = func.date_trunc(bucket.value, OfferHistory.recorded_at, "UTC").label("bucket")
+        return db.execute(
+            select(
+                bucket_start,
+                func.min(OfferHistory.price).label("min_price"),
+                func.max(OfferHistory.price).label("max_price"),
+                func.avg(OfferHistory.price).label("avg_price"),
+                func.count().label("changes_count"),
+            )
+            .where(
+                OfferHistory.product_id == str(product_id),
+                OfferHistory.recorded_at >= start,
+                OfferHistory.recorded_at < end)
+            .group_by(bucket_start)
+            .order_by(bucket_start)
+        ).all()
+
+    def get_partition_days(self, db: Session) -> List[date]:
+        partitions = db.execute(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = CAST(:parent AS regclass)"
+        ), {"parent": OfferHistory.__tablename__}).scalars()
+        return sorted(
+            datetime.strptime(name[len(PARTITION_PREFIX):], "%Y%m%d").date()
+            for name in partitions if name != DEFAULT_PARTITION)
+
+    def create_partitions(self, db: Session, *, start: date, days: int) -> List[date]:
+        """
+        Create missing daily partitions for `days` days from `start`. Returns days of created partitions.
+        """
+        existing_days = set(self.get_partition_days(db))
+        created_days = []
+        for day in (start + timedelta(days=offset) for offset in range(days)):
+            if day in existing_days:
+                continue
+            partition = f"{PARTITION_PREFIX}{day:%Y%m%d}"
+            bounds = {"day_start": _day_start(day), "day_end": _day_start(day + timedelta(days=1))}
+            # Rows of the day may already be in the default partition, which would make `PARTITION OF` fail.
+            # The partition is created detached, the rows are moved into it and then it is attached.
+            db.execute(text(f"CREATE TABLE {partition} (LIKE {OfferHistory.__tablename__} INCLUDING DEFAULTS)"))
+            db.execute(text(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+                f"WHERE recorded_at >= :day_start AND recorded_at < :day_end RETURNING *) "
+                f"INSERT INTO {partition} SELECT * FROM moved"
+            ), bounds)
+            # bounds are literals in DDL, they cannot be sent as parameters
+            db.execute(text(
+                f"ALTER TABLE {OfferHistory.__tablename__} ATTACH PARTITION {partition} "
+                f"FOR VALUES FROM ('{bounds['day_start'].isoformat()}') TO ('{bounds['day_end'].isoformat()}')"))
+            created_days.append(day)
+        db.commit()
+        return created_days
+
+    def drop_partitions_before(self, db: Session, *, before: date, since: Optional[date] = None) -> List[date]:
+        """
+        Drop daily partitions of days before `before`, and of days from `since` on if it is given. Returns days of
+        dropped partitions.
+        """
+        dropped_days = [
+            day for day in self.get_partition_days(db) if day < before and (since is None or day >= since)]
+        for day in dropped_days:
+            db.execute(text(f"DROP TABLE {PARTITION_PREFIX}{day:%Y%m%d}"))
+        if since is None:
+            db.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE recorded_at < :before"),
+                       {"before": _day_start(before)})
+        else:
+            db.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE recorded_at >= :since AND recorded_at < :before"),
+                       {"since": _day_start(since), "before": _day_start(before)})
+        db.commit()
+        return dropped_days
+
+
+offer_history = CRUDOfferHistory(OfferHistory)
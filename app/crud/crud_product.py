@@ -1,13 +1,57 @@
+from typing import List, Sequence
+from uuid import UUID
+
 from app.models.product import Product
 from app.schemas.product import ProductCreate, ProductUpdate
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
-from .base import CRUDBase
+from .base import CRUDBase, equals_any
+from .crud_product_sync_state import product_sync_state
 
 
 class CRUDProduct(CRUDBase[Product, ProductCreate, ProductUpdate]):
+    def create(self, db: Session, *, obj_in: ProductCreate) -> Product:
+        # the product is due for its first offer download right away, the periodic round finds it by its sync state
+        product = self.model(**jsonable_encoder(obj_in))
+        db.add(product)
+        db.flush()
+        product_sync_state.create_for_products(db, product_ids=[product.id])
+        db.commit()
+        db.refresh(product)
+        return product
+
     def get_number_of_products(self, db: Session) -> int:
         return db.query(self.model).count()
 
+    def get_existing_ids(self, db: Session, *, ids: Sequence[UUID]) -> List[UUID]:
+        return db.scalars(select(self.model.id).where(equals_any(self.model.id, ids))).all() if ids else []
+
+    def create_multi(self, db: Session, *, objs_in: Sequence[ProductCreate]) -> List[UUID]:
+        """
+        Create products with one multi-row insert, returns ids of the created ones.
+
+        Products that exist already, e.g. created concurrently, are skipped.
+        """
+        if not objs_in:
+            return []
+        created_ids = db.scalars(
+            insert(self.model).on_conflict_do_nothing(index_elements=[self.model.id]).returning(self.model.id),
+            [obj_in.model_dump() for obj_in in objs_in]).all()
+        product_sync_state.create_for_products(db, product_ids=created_ids)
+        db.commit()
+        return created_ids
+
+    def remove_multiple_by_id(self, db: Session, *, ids: Sequence[UUID], commit: bool = True) -> int:
+        """
+        Remove products that have no offers yet, their offers are not removed as with `remove`.
+        """
+        removed_count = db.execute(delete(self.model).where(equals_any(self.model.id, ids))).rowcount if ids else 0
+        if commit:
+            db.commit()
+        return removed_count
+
 
 product = CRUDProduct(Product)
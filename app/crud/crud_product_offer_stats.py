@@ -0,0 +1,67 @@
+from typing import Any, Optional, Sequence
+from uuid import UUID
+
+from app.models.offer import Offer
+from app.models.product import Product
+from app.models.product_offer_stats import ProductOfferStats
+from app.schemas.product_offer_stats import ProductOfferStatsCreate, ProductOfferStatsUpdate
+from sqlalchemy import Select, Uuid, func, literal, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from .base import CRUDBase, equals_any
+
+
+class CRUDProductOfferStats(CRUDBase[ProductOfferStats, ProductOfferStatsCreate, ProductOfferStatsUpdate]):
+    def get(self, db: Session, id: Any) -> Optional[ProductOfferStats]:
+        return db.get(self.model, id)
+
+    def refresh(self, db: Session, *, product_id: str) -> None:
+        # Recomputed from the stored offers by a single statement. It does not commit, so it can be run in the same
+        # transaction as the offer changes and the stats can never disagree with the offers.
+        self._upsert(db, select(
+            literal(product_id, Uuid),
+            func.count(Offer.id),
+            func.min(Offer.price),
+            func.max(Offer.price),
+            func.avg(Offer.price),
+            func.coalesce(func.sum(Offer.items_in_stock), 0),
+            func.now(),
+        ).where(Offer.product_id == str(product_id)))
+
+    def refresh_multi(self, db: Session, *, product_ids: Sequence[UUID]) -> None:
+        """
+        Same as `refresh` for many products at once.
+        """
+        aggregates = select(
+            Product.id,
+            func.count(Offer.id),
+            func.min(Offer.price),
+            func.max(Offer.price),
+            func.avg(Offer.price),
+            func.coalesce(func.sum(Offer.items_in_stock), 0),
+            func.now(),
+        )
+        # the outer join keeps products without offers, their stats are reset
+        self._upsert(db, aggregates
+                     .outerjoin(Offer, Offer.product_id == Product.id)
+                     .where(equals_any(Product.id, product_ids))
+                     .group_by(Product.id))
+
+    def _upsert(self, db: Session, aggregates: Select) -> None:
+        statement = insert(ProductOfferStats).from_select(
+            ["product_id", "offers_count", "min_price", "max_price", "avg_price", "items_in_stock", "updated_at"],
+            aggregates)
+        statement = statement.on_conflict_do_update(
+            index_elements=[ProductOfferStats.product_id],
+            set_=dict(
+                offers_count=statement.excluded.offers_count,
+                min_price=statement.excluded.min_price,
+                max_price=statement.excluded.max_price,
+                avg_price=statement.excluded.avg_price,
+                items_in_stock=statement.excluded.items_in_stock,
+                updated_at=statement.excluded.updated_at))
+        db.execute(statement)
+
+
+product_offer_stats = CRUDProductOfferStats(ProductOfferStats)
@@ -0,0 +1,89 @@
+from datetime import timedelta
+from typing import Dict, List, Optional, Sequence
+
+from app.core.config import settings
+from app.models.product import Product
+from app.models.product_registration_outbox import ProductRegistrationOutbox
+from app.schemas.product import ProductCreate
+from app.schemas.product_registration_outbox import ProductRegistrationOutboxCreate, ProductRegistrationOutboxUpdate
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import bindparam, delete, func, literal, select, update
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from .base import CRUDBase, equals_any
+
+
+class CRUDProductRegistrationOutbox(
+    CRUDBase[ProductRegistrationOutbox, ProductRegistrationOutboxCreate, ProductRegistrationOutboxUpdate]
+):
+    def create_with_product(self, db: Session, *, obj_in: ProductCreate) -> Product:
+        """
+        Create the product together with its outbox row, both or neither of them are stored.
+
+        The product gets its sync state only once it is registered, it is not downloaded before.
+        """
+        product = Product(**jsonable_encoder(obj_in))
+        db.add(product)
+        db.add(self.model(product_id=product.id))
+        db.commit()
+        db.refresh(product)
+        return product
+
+    def claim_due(self, db: Session, *, limit: Optional[int] = None) -> List[Row]:
+        """
+        Claim up to `limit` (`OFFER_REGISTRATION_BATCH_SIZE` by default) outbox rows due for a registration attempt,
+        together with their products, the oldest first.
+
+        The rows are leased for `OFFER_REGISTRATION_LEASE_SECONDS` - they are not due for other drains until the lease
+        ends, or until they are removed or rescheduled. The claim is committed, so no transaction is held open while
+        the products are registered. Rows locked by another claim in progress are skipped.
+        """
+        due = (
+            select(self.model.id, self.model.next_attempt_at)
+            # `now()` is the start of the transaction, rows created since then would be left out
+            .where(self.model.next_attempt_at <= func.statement_timestamp())
+            .order_by(self.model.next_attempt_at, self.model.id)
+            .limit(settings.OFFER_REGISTRATION_BATCH_SIZE if limit is None else limit)
+            .with_for_update(skip_locked=True)
+            .cte("due"))
+        claimed = (
+            update(self.model)
+            .where(self.model.id == due.c.id, Product.id == self.model.product_id)
+            .values(next_attempt_at=func.statement_timestamp()
+                    + literal(timedelta(seconds=1)) * settings.OFFER_REGISTRATION_LEASE_SECONDS)
+            .returning(self.model.id, self.model.attempts, Product.id.label("product_id"), Product.name,
+                       Product.description, due.c.next_attempt_at.label("due_at"))
+            .cte("claimed"))
+        rows = db.execute(
+            select(claimed.c.id, claimed.c.attempts, claimed.c.product_id, claimed.c.name, claimed.c.description)
+            .order_by(claimed.c.due_at, claimed.c.id)).all()
+        db.commit()
+        return rows
+
+    def remove_multiple_by_id(self, db: Session, *, ids: Sequence[int]) -> None:
+        # does not commit, rows are removed together with the rest of the attempt outcome
+        if ids:
+            db.execute(delete(self.model).where(equals_any(self.model.id, ids)))
+
+    def record_failures(self, db: Session, *, errors: Dict[int, str]) -> None:
+        """
+        Schedule another attempt for outbox rows that failed. The retry interval doubles with every attempt, between
+        the minimal and the maximal retry interval.
+        """
+        if not errors:
+            return
+        interval = func.least(
+            settings.OFFER_REGISTRATION_RETRY_MIN_SECONDS * func.power(2, self.model.attempts),
+            settings.OFFER_REGISTRATION_RETRY_MAX_SECONDS)
+        statement = (
+            update(self.model.__table__)
+            .where(self.model.__table__.c.id == bindparam("outbox_id"))
+            .values(attempts=self.model.attempts + 1,
+                    next_attempt_at=func.now() + literal(timedelta(seconds=1)) * interval,
+                    last_error=bindparam("error")))
+        db.connection().execute(
+            statement, [{"outbox_id": outbox_id, "error": error} for outbox_id, error in errors.items()])
+
+
+product_registration_outbox = CRUDProductRegistrationOutbox(ProductRegistrationOutbox)
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, Optional, Sequence
+from uuid import UUID
+
+from app.core.config import settings
+from app.models.product_sync_state import ProductSyncState
+from app.schemas.product_sync_state import ProductSyncStateCreate, ProductSyncStateUpdate
+from sqlalchemy import String, cast, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from .base import CRUDBase, equals_any
+
+
+def _next_sync_at(interval_seconds: Any) -> Any:
+    return func.now() + literal(timedelta(seconds=1)) * interval_seconds
+
+
+class CRUDProductSyncState(CRUDBase[ProductSyncState, ProductSyncStateCreate, ProductSyncStateUpdate]):
+    def get(self, db: Session, id: Any) -> Optional[ProductSyncState]:
+        return db.get(self.model, id)
+
+    def get_fingerprints(self, db: Session, *, product_ids: Sequence[UUID]) -> Dict[str, Optional[str]]:
+        rows = db.execute(
+            select(ProductSyncState.product_id, ProductSyncState.offers_fingerprint)
+            .where(equals_any(ProductSyncState.product_id, product_ids)))
+        return {str(product_id): fingerprint for product_id, fingerprint in rows}
+
+    def set_fingerprint(self, db: Session, *, product_id: str, fingerprint: Optional[str]) -> None:
+        """
+        Record a sync that changed the offers. The product is synced again after the minimal interval.
+        """
+        # does not commit, the fingerprint has to be stored in the same transaction as the offers it describes
+        interval = settings.OFFER_DOWNLOAD_MIN_INTERVAL_SECONDS
+        statement = insert(ProductSyncState).values(
+            product_id=product_id,
+            offers_fingerprint=fingerprint,
+            synced_at=func.now(),
+            next_sync_at=_next_sync_at(interval),
+            sync_interval_seconds=interval,
+            syncs_count=1,
+            changes_count=1)
+        statement = statement.on_conflict_do_update(
+            index_elements=[ProductSyncState.product_id],
+            set_=dict(offers_fingerprint=statement.excluded.offers_fingerprint,
+                      synced_at=statement.excluded.synced_at,
+                      next_sync_at=statement.excluded.next_sync_at,
+                      sync_interval_seconds=statement.excluded.sync_interval_seconds,
+                      syncs_count=ProductSyncState.syncs_count + 1,
+                      changes_count=ProductSyncState.changes_count + 1))
+        db.execute(statement)
+
+    def record_unchanged(self, db: Session, *, product_ids: Sequence[str]) -> None:
+        """
+        Record syncs that found the offers unchanged. The sync interval of the products doubles, up to the maximum.
+        """
+        interval = func.least(
+            func.greatest(ProductSyncState.sync_interval_seconds * 2, settings.OFFER_DOWNLOAD_MIN_INTERVAL_SECONDS),
+            settings.OFFER_DOWNLOAD_MAX_INTERVAL_SECONDS)
+        db.execute(
+            update(ProductSyncState)
+            .where(equals_any(ProductSyncState.product_id, product_ids))
+            .values(synced_at=func.now(),
+                    next_sync_at=_next_sync_at(interval),
+                    sync_interval_seconds=interval,
+                    syncs_count=ProductSyncState.syncs_count + 1))
+
+    def record_pushed(self, db: Session, *, product_ids: Sequence[UUID]) -> None:
+        """
+        Record offers pushed for products, they are not synced again for `OFFER_INGEST_SYNC_DELAY_SECONDS`.
+        """
+        # the fingerprint describes downloaded offers, which the pushed ones have replaced - without it the next
+        # sync stores the downloaded offers even if they did not change since then
+        interval = settings.OFFER_DOWNLOAD_MIN_INTERVAL_SECONDS
+        statement = insert(ProductSyncState).values([
+            dict(product_id=product_id,
+                 offers_fingerprint=None,
+                 synced_at=func.now(),
+                 next_sync_at=_next_sync_at(settings.OFFER_INGEST_SYNC_DELAY_SECONDS),
+                 sync_interval_seconds=interval,
+                 changes_count=1)
+            for product_id in product_ids])
+        statement = statement.on_conflict_do_update(
+            index_elements=[ProductSyncState.product_id],
+            set_=dict(offers_fingerprint=statement.excluded.offers_fingerprint,
+                      synced_at=statement.excluded.synced_at,
+                      next_sync_at=statement.excluded.next_sync_at,
+                      changes_count=ProductSyncState.changes_count + 1))
+        db.execute(statement)
+
+    def create_for_products(self, db: Session, *, product_ids: Sequence[UUID]) -> None:
+        """
+        Create sync state of new products, they are due right away. Products that have one already keep it.
+        """
+        # does not commit, the state is stored in the same transaction as the products
+        if product_ids:
+            db.execute(insert(ProductSyncState).values([{"product_id": product_id} for product_id in product_ids])
+                       .on_conflict_do_nothing(index_elements=[ProductSyncState.product_id]))
+
+    def stream_due_product_ids(
+        self, db: Session, *, due_at: datetime, batch_size: Optional[int] = None
+    ) -> Iterator[Sequence[str]]:
+        """
+        Ids of products due to be synced at `due_at`, the most overdue first, in batches of `batch_size`
+        (`OFFER_DOWNLOAD_ROUND_PAGE_SIZE` by default).
+        """
+        # ids are cast to text by the database, decoding them as UUIDs costs more than the query itself, and
+        # `yield_per` streams them through one server side cursor instead of a query per batch
+        statement = (
+            select(cast(ProductSyncState.product_id, String))
+            .where(ProductSyncState.next_sync_at <= due_at)
+            .order_by(ProductSyncState.next_sync_at, ProductSyncState.product_id)
+        )
+        return db.execute(statement.execution_options(
+            yield_per=settings.OFFER_DOWNLOAD_ROUND_PAGE_SIZE if batch_size is None else batch_size
+        )).scalars().partitions()
+
+    def count_due(self, db: Session, *, due_at: datetime) -> int:
+        return db.scalar(select(func.count()).where(ProductSyncState.next_sync_at <= due_at))
+
+
+product_sync_state = CRUDProductSyncState(ProductSyncState)
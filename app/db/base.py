@@ -4,3 +4,7 @@ from app.db.base_class import Base  # noqa
 from app.models.user import User  # noqa
 from app.models.product import Product  # noqa
 from app.models.offer import Offer  # noqa
+from app.models.product_offer_stats import ProductOfferStats  # noqa
+from app.models.offer_history import OfferHistory  # noqa
+from app.models.product_sync_state import ProductSyncState  # noqa
+from app.models.product_registration_outbox import ProductRegistrationOutbox  # noqa
@@ -1,11 +1,27 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
+from app.api import metrics as metrics_api
 from app.api.api_v1.api import api_router
+from app.api.pagination import NEXT_CURSOR_HEADER
+from app.core import metrics, offer_service_client
 from app.core.config import settings
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # every server worker process gets its own client, its connections are closed when the process stops
+    offer_service_client.reset_after_fork()
+    yield
+    offer_service_client.close()
+    metrics.mark_process_dead()
+
+
 app = FastAPI(
-    title=settings.PROJECT_NAME, openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    title=settings.PROJECT_NAME, openapi_url=f"{settings.API_V1_STR}/openapi.json", lifespan=lifespan
 )
 
 # Set all CORS enabled origins
@@ -16,6 +32,10 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER],
     )
 
+app.add_middleware(metrics_api.MetricsMiddleware)
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
+app.include_router(metrics_api.router)
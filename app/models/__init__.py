@@ -1,3 +1,7 @@
 from .offer import Offer
+from .offer_history import OfferHistory
 from .product import Product
+from .product_offer_stats import ProductOfferStats
+from .product_registration_outbox import ProductRegistrationOutbox
+from .product_sync_state import ProductSyncState
 from .user import User
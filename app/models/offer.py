@@ -1,7 +1,7 @@
 from typing import TYPE_CHECKING
 
 from app.db.base_class import Base
-from sqlalchemy import Column, ForeignKey, Integer, Uuid
+from sqlalchemy import Column, ForeignKey, Index, Integer, Uuid
 from sqlalchemy.orm import relationship
 
 if TYPE_CHECKING:
@@ -9,8 +9,14 @@ if TYPE_CHECKING:
 
 
 class Offer(Base):
-    id = Column(Uuid, primary_key=True, index=True)
+    # Offers are read by product and ordered by price (and id for keyset pagination). The composite index serves
+    # both the filter and the order, and including items_in_stock allows index only scans.
+    __table_args__ = (
+        Index("ix_offer_product_id_price_id", "product_id", "price", "id", postgresql_include=["items_in_stock"]),
+    )
+
+    id = Column(Uuid, primary_key=True)
     price = Column(Integer, index=False, nullable=False)
     items_in_stock = Column(Integer, index=False, nullable=False)
-    product_id = Column(Uuid, ForeignKey("product.id"), index=True, nullable=False)
+    product_id = Column(Uuid, ForeignKey("product.id"), nullable=False)
     product = relationship("Product", back_populates="offers")
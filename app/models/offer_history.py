@@ -0,0 +1,31 @@
+from app.db.base_class import Base
+from sqlalchemy import DDL, Column, DateTime, Index, Integer, Uuid, event, func
+
+
+class OfferHistory(Base):
+    """
+    Append-only log of offer price and stock changes.
+
+    The table is range partitioned by day of `recorded_at`, so old data are removed by dropping whole partitions.
+    Daily partitions are maintained by `crud.offer_history`, rows without their partition go to the default one.
+    """
+    __tablename__ = "offer_history"
+    __table_args__ = (
+        Index("ix_offer_history_recorded_at", "recorded_at", postgresql_using="brin"),
+        Index("ix_offer_history_product_id_recorded_at", "product_id", "recorded_at"),
+        {"postgresql_partition_by": "RANGE (recorded_at)"},
+    )
+
+    offer_id = Column(Uuid, primary_key=True)
+    recorded_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
+    # no foreign key - history outlives offers and products
+    product_id = Column(Uuid, nullable=False)
+    price = Column(Integer, nullable=False)
+    items_in_stock = Column(Integer, nullable=False)
+
+
+event.listen(
+    OfferHistory.__table__,
+    "after_create",
+    DDL("CREATE TABLE offer_history_default PARTITION OF offer_history DEFAULT"),
+)
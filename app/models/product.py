@@ -7,10 +7,13 @@ from app.db.base_class import Base
 
 if TYPE_CHECKING:
     from .offer import Offer # noqa: F401
+    from .product_offer_stats import ProductOfferStats  # noqa: F401
 
 
 class Product(Base):
-    id = Column(Uuid, primary_key=True, index=True)
+    id = Column(Uuid, primary_key=True)
     name = Column(String, index=True, nullable=False)
-    description = Column(String, index=True, nullable=False)
+    description = Column(String, nullable=False)
     offers = relationship("Offer", back_populates="product", order_by="Offer.id", cascade="all, delete, delete-orphan")
+    offer_stats = relationship("ProductOfferStats", back_populates="product", uselist=False, lazy="selectin",
+                               cascade="all, delete-orphan", passive_deletes=True)
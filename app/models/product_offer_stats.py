@@ -0,0 +1,21 @@
+from typing import TYPE_CHECKING
+
+from app.db.base_class import Base
+from sqlalchemy import BigInteger, Column, DateTime, Float, ForeignKey, Integer, Uuid, func
+from sqlalchemy.orm import relationship
+
+if TYPE_CHECKING:
+    from .product import Product  # noqa: F401
+
+
+class ProductOfferStats(Base):
+    __tablename__ = "product_offer_stats"
+
+    product_id = Column(Uuid, ForeignKey("product.id", ondelete="CASCADE"), primary_key=True)
+    offers_count = Column(Integer, nullable=False)
+    min_price = Column(Integer, nullable=True)
+    max_price = Column(Integer, nullable=True)
+    avg_price = Column(Float, nullable=True)
+    items_in_stock = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    product = relationship("Product", back_populates="offer_stats")
@@ -0,0 +1,22 @@
+from app.db.base_class import Base
+from sqlalchemy import BigInteger, Column, DateTime, ForeignKey, Index, Integer, String, Uuid, func
+
+
+class ProductRegistrationOutbox(Base):
+    """
+    Products accepted by the API that are yet to be registered in the offer service.
+
+    Rows are written in the same transaction as their product and removed once the product is registered, see
+    `crud.product_registration_outbox`.
+    """
+    __tablename__ = "product_registration_outbox"
+    __table_args__ = (
+        Index("ix_product_registration_outbox_next_attempt_at_id", "next_attempt_at", "id"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    product_id = Column(Uuid, ForeignKey("product.id", ondelete="CASCADE"), nullable=False, unique=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    attempts = Column(Integer, server_default="0", nullable=False)
+    last_error = Column(String, nullable=True)
@@ -0,0 +1,20 @@
+from app.db.base_class import Base
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String, Uuid, func
+
+
+class ProductSyncState(Base):
+    __tablename__ = "product_sync_state"
+    __table_args__ = (
+        # due products are found, and iterated over, by this index only
+        Index("ix_product_sync_state_next_sync_at_product_id", "next_sync_at", "product_id"),
+    )
+
+    product_id = Column(Uuid, ForeignKey("product.id", ondelete="CASCADE"), primary_key=True)
+    # hash of the offers downloaded by the last sync, see `app.celery.fingerprint`
+    offers_fingerprint = Column(String(64), nullable=True)
+    synced_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    next_sync_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # 0 until the product is synced for the first time
+    sync_interval_seconds = Column(Integer, server_default="0", nullable=False)
+    syncs_count = Column(Integer, server_default="0", nullable=False)
+    changes_count = Column(Integer, server_default="0", nullable=False)
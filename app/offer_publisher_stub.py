@@ -0,0 +1,91 @@
+"""
+Stand-in for an upstream publisher that pushes offer changes to `POST /offers/ingest`.
+
+Run against a running API with
+`python -m app.offer_publisher_stub [--api-url http://localhost/api/v1/] [--products 100] [--interval 1] [--rounds 0]`.
+It logs in as the first superuser and picks up to `--products` products. Every `--interval` seconds it pushes one
+request with new offers, price and stock changes and removals for a random part of them. `--rounds 0` pushes until
+interrupted.
+"""
+import argparse
+import logging
+import random
+import time
+import uuid
+from typing import Dict, List
+
+import httpx
+from app.core.config import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _login(client: httpx.Client) -> None:
+    response = client.post("login/access-token", data={
+        "username": settings.FIRST_SUPERUSER, "password": settings.FIRST_SUPERUSER_PASSWORD})
+    response.raise_for_status()
+    client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+
+def _read_product_ids(client: httpx.Client, limit: int) -> List[str]:
+    product_ids: List[str] = []
+    cursor = ""
+    while len(product_ids) < limit:
+        response = client.get("products/", params={"cursor": cursor, "limit": settings.API_MAX_RECORDS_LIMIT})
+        response.raise_for_status()
+        product_ids.extend(product["id"] for product in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    return product_ids[:limit]
+
+
+def _delta(product_id: str, offers: Dict[str, dict]) -> dict:
+    # offers pushed before are updated or removed, new ones keep the number of offers about the same
+    upserts, removals = [], []
+    for offer_id in random.sample(list(offers), k=min(len(offers), 3)):
+        if random.random() < 0.3:
+            removals.append(offer_id)
+            del offers[offer_id]
+        else:
+            upserts.append(offers[offer_id])
+    for _ in range(len(removals) + (1 if len(offers) < 5 else 0)):
+        offer_id = str(uuid.uuid4())
+        offers[offer_id] = {"id": offer_id}
+        upserts.append(offers[offer_id])
+    for offer in upserts:
+        offer.update(price=random.randint(100, 10000), items_in_stock=random.randint(0, 100))
+    return {"product_id": product_id, "upserts": [dict(offer) for offer in upserts], "removals": removals}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--api-url", default=f"http://localhost{settings.API_V1_STR}/")
+    parser.add_argument("--products", type=int, default=100)
+    parser.add_argument("--changed-share", type=float, default=0.1, help="share of the products changed per push")
+    parser.add_argument("--interval", type=float, default=1, help="seconds between pushes")
+    parser.add_argument("--rounds", type=int, default=0)
+    args = parser.parse_args()
+    with httpx.Client(base_url=args.api_url, timeout=30) as client:
+        _login(client)
+        product_ids = _read_product_ids(client, args.products)
+        if not product_ids:
+            logger.error("There are no products to publish offers for.")
+            return
+        offers: Dict[str, Dict[str, dict]] = {product_id: {} for product_id in product_ids}
+        rounds = 0
+        while not args.rounds or rounds < args.rounds:
+            changed = random.sample(product_ids, k=max(1, int(len(product_ids) * args.changed_share)))
+            start = time.perf_counter()
+            response = client.post("offers/ingest", json={
+                "products": [_delta(product_id, offers[product_id]) for product_id in changed]})
+            response.raise_for_status()
+            logger.info(f"Pushed changes of {len(changed)} product(s) in {time.perf_counter() - start:.3f}s: "
+                        f"{response.json()}")
+            rounds += 1
+            time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
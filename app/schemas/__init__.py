@@ -1,7 +1,12 @@
+from .batch import BatchGet
 from .msg import Msg
-from .offer import Offer, OfferInDB
-from .product import (Product, ProductCreate, ProductDelete, ProductInDB,
-                      ProductUpdate)
+from .offer import (Offer, OfferInDB, OfferIngestItem, OffersIngest,
+                    OffersIngestResult, ProductOffersDelta)
+from .offer_history import PriceHistoryBucket, PriceHistoryBucketSize
+from .product import (Product, ProductBulkItem, ProductBulkReport,
+                      ProductBulkStatus, ProductCreate, ProductDelete,
+                      ProductInDB, ProductUpdate)
+from .product_offer_stats import ProductOfferStats
 from .token import Token, TokenPayload
 from .user import User, UserCreate, UserInDB, UserUpdate
 from .responses import NotFoundResponse
@@ -0,0 +1,10 @@
+from typing import List
+from uuid import UUID
+
+from app.core.config import settings
+from pydantic import BaseModel, Field
+
+
+# Properties to receive on batch retrieval
+class BatchGet(BaseModel):
+    ids: List[UUID] = Field(min_length=1, max_length=settings.API_MAX_BATCH_SIZE)
@@ -1,7 +1,8 @@
-from typing import Optional
+from typing import List, Optional
 from uuid import UUID
 
-from pydantic import BaseModel, ConfigDict
+from app.core.config import settings
+from pydantic import BaseModel, ConfigDict, Field
 
 
 # Shared properties
@@ -39,3 +40,29 @@ class Offer(OfferBase):
 # Properties stored in DB
 class OfferInDB(OfferInDBBase):
     pass
+
+
+# Offer pushed to POST /offers/ingest, its product is the one of the delta it is sent in
+class OfferIngestItem(BaseModel):
+    id: UUID
+    price: int
+    items_in_stock: int
+
+
+# Offer changes of one product, removals are applied after upserts
+class ProductOffersDelta(BaseModel):
+    product_id: UUID
+    upserts: List[OfferIngestItem] = []
+    removals: List[UUID] = []
+
+
+class OffersIngest(BaseModel):
+    products: List[ProductOffersDelta] = Field(min_length=1, max_length=settings.API_MAX_INGEST_PRODUCTS)
+
+
+class OffersIngestResult(BaseModel):
+    products_count: int
+    changed_count: int
+    removed_count: int
+    # products that do not exist are skipped
+    unknown_product_ids: List[UUID]
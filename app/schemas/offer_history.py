@@ -0,0 +1,34 @@
+from datetime import datetime
+from enum import Enum
+from uuid import UUID
+
+from pydantic import BaseModel, ConfigDict
+
+
+class PriceHistoryBucketSize(str, Enum):
+    hour = "hour"
+    day = "day"
+    week = "week"
+    month = "month"
+
+
+# History is written by the database only, these exist to satisfy CRUD typing
+class OfferHistoryCreate(BaseModel):
+    offer_id: UUID
+    product_id: UUID
+    price: int
+    items_in_stock: int
+
+
+class OfferHistoryUpdate(BaseModel):
+    pass
+
+
+# Properties to return to client
+class PriceHistoryBucket(BaseModel):
+    bucket: datetime
+    min_price: int
+    max_price: int
+    avg_price: float
+    changes_count: int
+    model_config = ConfigDict(from_attributes=True)
@@ -1,8 +1,11 @@
-from typing import Optional
+from enum import Enum
+from typing import List, Optional
 from uuid import UUID
 
 from pydantic import BaseModel, ConfigDict
 
+from .product_offer_stats import ProductOfferStats
+
 
 # Shared properties
 class ProductBase(BaseModel):
@@ -37,9 +40,35 @@ class ProductInDBBase(ProductBase):
 
 # Properties to return to client
 class Product(ProductInDBBase):
-    pass
+    # filled in once offers of the product are downloaded
+    offer_stats: Optional[ProductOfferStats] = None
 
 
 # Properties stored in DB
 class ProductInDB(ProductInDBBase):
     pass
+
+
+class ProductBulkStatus(str, Enum):
+    created = "created"
+    # already stored locally, or listed earlier in the same request
+    exists = "exists"
+    duplicate = "duplicate"
+    invalid = "invalid"
+    # refused by the offer service
+    rejected = "rejected"
+    # the offer service could not be reached or failed, the product can be sent again
+    failed = "failed"
+
+
+# Status of one product of a bulk import, in the order the products were sent
+class ProductBulkItem(BaseModel):
+    index: int
+    id: Optional[UUID] = None
+    status: ProductBulkStatus
+    detail: Optional[str] = None
+
+
+class ProductBulkReport(BaseModel):
+    created_count: int
+    items: List[ProductBulkItem]
@@ -0,0 +1,28 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict
+
+
+# Shared properties
+class ProductOfferStatsBase(BaseModel):
+    offers_count: int = 0
+    min_price: Optional[int] = None
+    max_price: Optional[int] = None
+    avg_price: Optional[float] = None
+    items_in_stock: int = 0
+
+
+# Stats are computed by the database only, these exist to satisfy CRUD typing
+class ProductOfferStatsCreate(ProductOfferStatsBase):
+    pass
+
+
+class ProductOfferStatsUpdate(ProductOfferStatsBase):
+    pass
+
+
+# Properties to return to client
+class ProductOfferStats(ProductOfferStatsBase):
+    updated_at: Optional[datetime] = None
+    model_config = ConfigDict(from_attributes=True)
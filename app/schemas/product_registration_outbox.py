@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+
+
+# Outbox rows are written together with their products only, these exist to satisfy CRUD typing
+class ProductRegistrationOutboxCreate(BaseModel):
+    pass
+
+
+class ProductRegistrationOutboxUpdate(BaseModel):
+    pass
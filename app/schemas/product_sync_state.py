@@ -0,0 +1,17 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+# Shared properties
+class ProductSyncStateBase(BaseModel):
+    offers_fingerprint: Optional[str] = None
+
+
+# Sync state is written by the offer download only, these exist to satisfy CRUD typing
+class ProductSyncStateCreate(ProductSyncStateBase):
+    pass
+
+
+class ProductSyncStateUpdate(ProductSyncStateBase):
+    pass
@@ -1,6 +1,12 @@
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+
+from app import crud
 from app.core.config import settings
 from app.tests.utils.offer import create_random_offer
 from app.tests.utils.product import create_random_product
+from app.tests.utils.utils import random_uuid
 from fastapi.testclient import TestClient
 from sqlalchemy.orm import Session
 
@@ -41,3 +47,117 @@ def test_read_offer_should_return_not_found_if_there_is_not_matching_offer(
     assert response.status_code == 404
     content = response.json()
     assert content["detail"] == "Offer not found"
+
+
+def test_offers_should_be_exported_as_ndjson(
+    client: TestClient, db: Session, clear_db_products: None
+) -> None:
+    product = create_random_product(db=db)
+    offer1 = create_random_offer(db=db, product_id=product.id)
+    offer2 = create_random_offer(db=db, product_id=product.id)
+
+    response = client.get(f"{settings.API_V1_STR}/offers/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    exported_offers = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(offer["id"] for offer in exported_offers) == sorted([str(offer1.id), str(offer2.id)])
+    for offer in exported_offers:
+        assert offer["product_id"] == str(product.id)
+
+
+def test_offers_should_be_read_by_products(
+    client: TestClient, db: Session
+) -> None:
+    product = create_random_product(db=db)
+    product_without_offers = create_random_product(db=db)
+    offer = create_random_offer(db=db, product_id=product.id)
+    missing_id = "00000000-0000-0000-0000-000000000000"
+
+    response = client.post(f"{settings.API_V1_STR}/offers/by-products",
+                           json={"ids": [str(product.id), str(product_without_offers.id), missing_id]})
+    assert response.status_code == 200
+    content = response.json()
+    assert [item["id"] for item in content[str(product.id)]] == [str(offer.id)]
+    assert content[str(product_without_offers.id)] == []
+    assert content[missing_id] is None
+
+
+def test_offers_should_be_ingested(
+    client: TestClient, db: Session, normal_user_token_headers: Dict[str, str]
+) -> None:
+    product = create_random_product(db=db)
+    other_product = create_random_product(db=db)
+    updated_offer = create_random_offer(db=db, product_id=product.id, price=10)
+    removed_offer = create_random_offer(db=db, product_id=product.id)
+    other_offer = create_random_offer(db=db, product_id=other_product.id)
+    new_offer_id = str(random_uuid())
+    unknown_product_id = str(random_uuid())
+
+    data = {"products": [
+        {"product_id": str(product.id),
+         "upserts": [{"id": str(updated_offer.id), "price": 20, "items_in_stock": 1},
+                     {"id": new_offer_id, "price": 30, "items_in_stock": 2}],
+         # offers are only removed from the product they are sent for
+         "removals": [str(removed_offer.id), str(other_offer.id)]},
+        {"product_id": unknown_product_id, "upserts": [{"id": str(random_uuid()), "price": 1, "items_in_stock": 1}]},
+    ]}
+    response = client.post(f"{settings.API_V1_STR}/offers/ingest", json=data, headers=normal_user_token_headers)
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "products_count": 1, "changed_count": 2, "removed_count": 1, "unknown_product_ids": [unknown_product_id]}
+    db.expire_all()
+    offers = {str(offer.id): offer.price for offer in crud.offer.get_multi_by_product(db=db, product_id=product.id)}
+    assert offers == {str(updated_offer.id): 20, new_offer_id: 30}
+    assert crud.offer.get(db=db, id=other_offer.id)
+    assert crud.product_offer_stats.get(db=db, id=product.id).offers_count == 2
+    state = crud.product_sync_state.get(db=db, id=product.id)
+    assert state.offers_fingerprint is None
+    assert state.next_sync_at > (
+        datetime.now(timezone.utc) + timedelta(seconds=settings.OFFER_DOWNLOAD_MIN_INTERVAL_SECONDS))
+
+
+def test_offer_upserted_and_removed_in_one_push_should_be_removed(
+    client: TestClient, db: Session, normal_user_token_headers: Dict[str, str]
+) -> None:
+    product = create_random_product(db=db)
+    offer_id = create_random_offer(db=db, product_id=product.id, price=10).id
+
+    data = {"products": [
+        {"product_id": str(product.id),
+         "upserts": [{"id": str(offer_id), "price": 20, "items_in_stock": 0}],
+         "removals": [str(offer_id)]},
+    ]}
+    response = client.post(f"{settings.API_V1_STR}/offers/ingest", json=data, headers=normal_user_token_headers)
+
+    assert response.status_code == 200
+    assert response.json() == {"products_count": 1, "changed_count": 0, "removed_count": 1, "unknown_product_ids": []}
+    db.expire_all()
+    assert crud.offer.get(db=db, id=offer_id) is None
+    assert crud.product_offer_stats.get(db=db, id=product.id).offers_count == 0
+
+
+def test_offers_of_another_product_should_not_be_ingested(
+    client: TestClient, db: Session, normal_user_token_headers: Dict[str, str]
+) -> None:
+    product = create_random_product(db=db)
+    other_product = create_random_product(db=db)
+    other_offer = create_random_offer(db=db, product_id=other_product.id, price=10)
+
+    data = {"products": [
+        {"product_id": str(product.id), "upserts": [{"id": str(other_offer.id), "price": 20, "items_in_stock": 1}]},
+    ]}
+    response = client.post(f"{settings.API_V1_STR}/offers/ingest", json=data, headers=normal_user_token_headers)
+
+    assert response.status_code == 200
+    assert response.json()["changed_count"] == 0
+    db.expire_all()
+    offer = crud.offer.get(db=db, id=other_offer.id)
+    assert (offer.product_id, offer.price) == (other_product.id, 10)
+    assert crud.product_offer_stats.get(db=db, id=product.id).offers_count == 0
+
+
+def test_offers_should_not_be_ingested_for_unauthenticated_user(client: TestClient) -> None:
+    data = {"products": [{"product_id": str(random_uuid()), "removals": [str(random_uuid())]}]}
+    response = client.post(f"{settings.API_V1_STR}/offers/ingest", json=data)
+    assert response.status_code == 401
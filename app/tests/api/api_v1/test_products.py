@@ -1,11 +1,15 @@
+import json
+from datetime import datetime, timezone
 from typing import Dict
 
+import pytest
 from app import crud
+from app.api.api_v1.endpoints import products as products_endpoints
 from app.api.api_v1.endpoints.products import register_product_in_offer_service
 from app.core.celery_app import celery_app
 from app.core.config import settings
 from app.main import app
-from app.models import Offer, Product
+from app.models import Offer, OfferHistory, Product, ProductRegistrationOutbox
 from app.tests.conftest import get_mocked_celery
 from app.tests.utils.offer import create_random_offer
 from app.tests.utils.overrides import (
@@ -14,7 +18,9 @@ from app.tests.utils.overrides import (
     override_register_product_in_offer_service_returns_409,
     override_register_product_in_offer_service_returns_422)
 from app.tests.utils.product import create_random_product
+from app.tests.utils.utils import random_uuid
 from fastapi.testclient import TestClient
+from httpx import AsyncClient, Request, Response
 from sqlalchemy.orm import Session
 
 
@@ -34,6 +40,27 @@ def test_multiple_product_should_be_read(
     assert content[1]["description"] == product2.description
 
 
+def test_products_should_be_read_by_cursor(
+      client: TestClient, db: Session, clear_db_products: None) -> None:
+    product_ids = sorted(str(create_random_product(db=db).id) for _ in range(3))
+
+    response = client.get(f"{settings.API_V1_STR}/products/", params={"cursor": "", "limit": 2})
+    assert response.status_code == 200
+    assert [product["id"] for product in response.json()] == product_ids[:2]
+    next_cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get(f"{settings.API_V1_STR}/products/", params={"cursor": next_cursor, "limit": 2})
+    assert response.status_code == 200
+    assert [product["id"] for product in response.json()] == product_ids[2:]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_products_read_should_return_bad_request_for_invalid_cursor(client: TestClient) -> None:
+    response = client.get(f"{settings.API_V1_STR}/products/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
 def test_product_should_react_to_401_response_from_product_registration_service(
       client: TestClient, db: Session, normal_user_token_headers: Dict[str, str]) -> None:
     app.dependency_overrides[register_product_in_offer_service] = override_register_product_in_offer_service_returns_401
@@ -86,12 +113,13 @@ def test_product_should_react_to_422_response_from_product_registration_service(
 
 
 def test_product_should_be_created(
-      client: TestClient, normal_user_token_headers: Dict[str, str], monkeypatch) -> None:
+      client: TestClient, normal_user_token_headers: Dict[str, str], monkeypatch, assert_max_queries) -> None:
     app.dependency_overrides[register_product_in_offer_service] = override_register_product_in_offer_service_returns_201
     monkeypatch.setattr(celery_app, "send_task", get_mocked_celery)
 
     data = {"id": "3135dcd5-7add-4a27-b669-4f44b9aa9bdd", "name": "Bar", "description": "Dancers"}
-    response = client.post(f"{settings.API_V1_STR}/products/", json=data, headers=normal_user_token_headers)
+    with assert_max_queries(5):
+        response = client.post(f"{settings.API_V1_STR}/products/", json=data, headers=normal_user_token_headers)
 
     assert response.status_code == 201
     content = response.json()
@@ -113,6 +141,96 @@ def test_product_should_not_be_created_if_user_is_unauthorized(
     assert content["detail"] == "Not authenticated"
 
 
+def test_product_should_be_accepted_for_deferred_registration(
+      client: TestClient, db: Session, normal_user_token_headers: Dict[str, str], monkeypatch) -> None:
+    sent_tasks = []
+    monkeypatch.setattr(celery_app, "send_task", lambda name, *args, **kwargs: sent_tasks.append(name))
+
+    data = {"id": str(random_uuid()), "name": "Bar", "description": "Dancers"}
+    response = client.post(f"{settings.API_V1_STR}/products/deferred", json=data, headers=normal_user_token_headers)
+
+    assert response.status_code == 202
+    assert response.json()["id"] == data["id"]
+    assert crud.product.get(db, id=data["id"])
+    assert db.query(ProductRegistrationOutbox).filter(ProductRegistrationOutbox.product_id == data["id"]).one()
+    assert sent_tasks == ["app.celery.worker.drain_product_registration_outbox"]
+
+    response = client.post(f"{settings.API_V1_STR}/products/deferred", json=data, headers=normal_user_token_headers)
+    assert response.status_code == 409
+
+
+def test_products_should_be_created_in_bulk(
+      client: TestClient, db: Session, normal_user_token_headers: Dict[str, str], clear_in_flight_products: None,
+      monkeypatch) -> None:
+    existing_product = create_random_product(db)
+    products = [{"id": str(random_uuid()), "name": "Bar", "description": "Dancers"} for _ in range(4)]
+    statuses = dict(zip((product["id"] for product in products), (201, 409, 422, 503)))
+
+    async def mocked_post(self, url, *args, json, **kwargs):
+        return Response(statuses[json["id"]], json={"id": json["id"]}, request=Request("POST", url))
+
+    sent_tasks = []
+    monkeypatch.setattr(AsyncClient, "post", mocked_post)
+    monkeypatch.setattr(celery_app, "send_task", lambda *args, **kwargs: sent_tasks.append(kwargs["args"][0]))
+
+    data = [*products, {"id": str(existing_product.id), "name": "Bar", "description": "Dancers"},
+            products[0], {"id": "not an id", "name": "Bar"}]
+    response = client.post(f"{settings.API_V1_STR}/products/bulk", json=data, headers=normal_user_token_headers)
+
+    assert response.status_code == 200
+    content = response.json()
+    assert content["created_count"] == 2
+    assert [(item["index"], item["status"]) for item in content["items"]] == [
+        (0, "created"), (1, "created"), (2, "rejected"), (3, "failed"), (4, "exists"), (5, "duplicate"),
+        (6, "invalid")]
+    assert content["items"][2]["detail"] == "Offer service responded with 422"
+    assert "id" in content["items"][6]["detail"] and "description" in content["items"][6]["detail"]
+    assert crud.product.get(db, id=products[0]["id"]) and crud.product.get(db, id=products[1]["id"])
+    assert not crud.product.get(db, id=products[2]["id"]) and not crud.product.get(db, id=products[3]["id"])
+    assert sent_tasks == [[products[0]["id"], products[1]["id"]]]
+
+
+def test_products_should_be_created_in_bulk_from_ndjson(
+      client: TestClient, db: Session, normal_user_token_headers: Dict[str, str], clear_in_flight_products: None,
+      monkeypatch) -> None:
+    products = [{"id": str(random_uuid()), "name": "Bar", "description": "Dancers"} for _ in range(2)]
+
+    async def mocked_post(self, url, *args, json, **kwargs):
+        return Response(201, json={"id": json["id"]}, request=Request("POST", url))
+
+    monkeypatch.setattr(AsyncClient, "post", mocked_post)
+    monkeypatch.setattr(celery_app, "send_task", get_mocked_celery)
+
+    body = "\n".join(json.dumps(product) for product in products) + "\n{not json\n"
+    response = client.post(f"{settings.API_V1_STR}/products/bulk", content=body,
+                           headers={**normal_user_token_headers, "Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    content = response.json()
+    assert content["created_count"] == 2
+    assert [item["status"] for item in content["items"]] == ["created", "created", "invalid"]
+    assert crud.product.get(db, id=products[1]["id"])
+
+
+def test_products_bulk_creation_should_reject_non_array_body(
+      client: TestClient, normal_user_token_headers: Dict[str, str]) -> None:
+    response = client.post(f"{settings.API_V1_STR}/products/bulk", json={"id": str(random_uuid())},
+                           headers=normal_user_token_headers)
+    assert response.status_code == 400
+
+
+def test_products_bulk_creation_should_reject_too_many_products_before_validating_them(
+      client: TestClient, normal_user_token_headers: Dict[str, str], monkeypatch) -> None:
+    monkeypatch.setattr(settings, "API_MAX_BULK_SIZE", 2)
+    monkeypatch.setattr(products_endpoints, "_parse_bulk_product", lambda parse: pytest.fail("validated"))
+
+    body = "\n".join(json.dumps({"id": str(random_uuid()), "name": "Bar", "description": "Dancers"}) for _ in range(3))
+    response = client.post(f"{settings.API_V1_STR}/products/bulk", content=body,
+                           headers={**normal_user_token_headers, "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 422
+    assert response.json()["detail"] == "At most 2 products can be imported at once"
+
+
 def test_product_read_should_return_product(
       client: TestClient, db: Session) -> None:
     product = create_random_product(db=db)
@@ -211,11 +329,13 @@ def test_product_should_be_removed_including_related_offers(
 
 
 def test_product_offers_should_be_returned(
-      client: TestClient, db: Session) -> None:
+      client: TestClient, db: Session, assert_max_queries) -> None:
     product = create_random_product(db=db)
     create_random_offer(db=db, product_id=product.id)
     create_random_offer(db=db, product_id=product.id)
-    response = client.get(f"{settings.API_V1_STR}/products/{product.id}/offers")
+    url = f"{settings.API_V1_STR}/products/{product.id}/offers"
+    with assert_max_queries(3):
+        response = client.get(url)
     assert response.status_code == 200
     response_content = response.json()
     assert len(response_content) == 2
@@ -223,6 +343,22 @@ def test_product_offers_should_be_returned(
     assert response_content[1]["product_id"] == str(product.id)
 
 
+def test_product_offers_should_be_read_by_cursor(
+      client: TestClient, db: Session) -> None:
+    product = create_random_product(db=db)
+    cheap_offer = create_random_offer(db=db, product_id=product.id, price=10)
+    expensive_offer = create_random_offer(db=db, product_id=product.id, price=20)
+
+    response = client.get(f"{settings.API_V1_STR}/products/{product.id}/offers", params={"cursor": "", "limit": 1})
+    assert response.status_code == 200
+    assert [offer["id"] for offer in response.json()] == [str(cheap_offer.id)]
+
+    response = client.get(f"{settings.API_V1_STR}/products/{product.id}/offers",
+                          params={"cursor": response.headers["X-Next-Cursor"], "limit": 1})
+    assert response.status_code == 200
+    assert [offer["id"] for offer in response.json()] == [str(expensive_offer.id)]
+
+
 def test_product_offers_should_return_empty_list_if_no_offers_exist(
       client: TestClient, db: Session) -> None:
     product = create_random_product(db=db)
@@ -239,3 +375,118 @@ def test_product_offers_should_return_not_found_if_product_does_not_exist(
     assert response.status_code == 404
     response_content = response.json()
     assert response_content["detail"] == "Product not found"
+
+
+def test_product_offers_should_be_exported_as_ndjson(
+      client: TestClient, db: Session) -> None:
+    product = create_random_product(db=db)
+    offer = create_random_offer(db=db, product_id=product.id)
+    create_random_offer(db=db, product_id=create_random_product(db=db).id)  # offer of other product
+
+    response = client.get(f"{settings.API_V1_STR}/products/{product.id}/offers/export")
+    assert response.status_code == 200
+    exported_offers = [json.loads(line) for line in response.text.splitlines()]
+    assert exported_offers == [{
+        "id": str(offer.id),
+        "price": offer.price,
+        "items_in_stock": offer.items_in_stock,
+        "product_id": str(product.id),
+    }]
+
+
+def test_product_offers_export_should_return_not_found_if_product_does_not_exist(
+      client: TestClient) -> None:
+    response = client.get(f"{settings.API_V1_STR}/products/00000000-0000-0000-0000-000000000000/offers/export")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Product not found"
+
+
+def test_products_should_be_read_in_batch(
+      client: TestClient, db: Session) -> None:
+    product1 = create_random_product(db=db)
+    product2 = create_random_product(db=db)
+    missing_id = "00000000-0000-0000-0000-000000000000"
+
+    response = client.post(f"{settings.API_V1_STR}/products/batch-get",
+                           json={"ids": [str(product2.id), missing_id, str(product1.id)]})
+    assert response.status_code == 200
+    content = response.json()
+    assert list(content) == [str(product2.id), missing_id, str(product1.id)]
+    assert content[str(product1.id)]["name"] == product1.name
+    assert content[str(product2.id)]["name"] == product2.name
+    assert content[missing_id] is None
+
+
+def test_products_batch_read_should_reject_too_many_ids(client: TestClient) -> None:
+    ids = [str(random_uuid()) for _ in range(settings.API_MAX_BATCH_SIZE + 1)]
+    response = client.post(f"{settings.API_V1_STR}/products/batch-get", json={"ids": ids})
+    assert response.status_code == 422
+
+
+def test_product_stats_should_be_returned(
+      client: TestClient, db: Session) -> None:
+    product = create_random_product(db=db)
+    create_random_offer(db=db, product_id=product.id, price=10, items_in_stock=1)
+    create_random_offer(db=db, product_id=product.id, price=20, items_in_stock=3)
+    crud.product_offer_stats.refresh(db=db, product_id=product.id)
+    db.commit()
+
+    response = client.get(f"{settings.API_V1_STR}/products/{product.id}/stats")
+    assert response.status_code == 200
+    content = response.json()
+    assert content["offers_count"] == 2
+    assert content["min_price"] == 10
+    assert content["max_price"] == 20
+    assert content["avg_price"] == 15
+    assert content["items_in_stock"] == 4
+
+    response = client.get(f"{settings.API_V1_STR}/products/{product.id}")
+    assert response.json()["offer_stats"]["min_price"] == 10
+
+
+def test_product_stats_should_be_empty_if_offers_were_not_downloaded(
+      client: TestClient, db: Session) -> None:
+    product = create_random_product(db=db)
+    response = client.get(f"{settings.API_V1_STR}/products/{product.id}/stats")
+    assert response.status_code == 200
+    content = response.json()
+    assert content["offers_count"] == 0
+    assert content["min_price"] is None
+
+
+def test_product_stats_should_return_not_found_if_product_does_not_exist(
+      client: TestClient) -> None:
+    response = client.get(f"{settings.API_V1_STR}/products/00000000-0000-0000-0000-000000000000/stats")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Product not found"
+
+
+def test_product_price_history_should_be_returned(
+      client: TestClient, db: Session) -> None:
+    product = create_random_product(db=db)
+    db.add_all([
+        OfferHistory(offer_id=random_uuid(), product_id=product.id, price=price, items_in_stock=1,
+                     recorded_at=datetime(2024, 5, 1, hour, tzinfo=timezone.utc))
+        for hour, price in ((1, 10), (2, 30))
+    ])
+    db.commit()
+
+    response = client.get(f"{settings.API_V1_STR}/products/{product.id}/price-history",
+                          params={"from": "2024-05-01T00:00:00", "to": "2024-05-02T00:00:00", "bucket": "hour"})
+    assert response.status_code == 200
+    content = response.json()
+    assert [(bucket["min_price"], bucket["changes_count"]) for bucket in content] == [(10, 1), (30, 1)]
+
+
+def test_product_price_history_should_reject_inverted_range(
+      client: TestClient, db: Session) -> None:
+    product = create_random_product(db=db)
+    response = client.get(f"{settings.API_V1_STR}/products/{product.id}/price-history",
+                          params={"from": "2024-05-02T00:00:00", "to": "2024-05-01T00:00:00"})
+    assert response.status_code == 400
+
+
+def test_product_price_history_should_return_not_found_if_product_does_not_exist(
+      client: TestClient) -> None:
+    response = client.get(f"{settings.API_V1_STR}/products/00000000-0000-0000-0000-000000000000/price-history")
+    assert response.status_code == 404
@@ -0,0 +1,17 @@
+from app.core.config import settings
+from app.tests.utils.utils import random_uuid
+from fastapi.testclient import TestClient
+
+
+def test_metrics_should_be_exported(client: TestClient) -> None:
+    client.get(f"{settings.API_V1_STR}/products/{random_uuid()}")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    # requests are recorded by route, not by path
+    assert (f'http_request_duration_seconds_count{{method="GET",route="{settings.API_V1_STR}/products/{{id}}",'
+            f'status="404"}}') in response.text
+    assert f'http_request_queries_count{{method="GET",route="{settings.API_V1_STR}/products/{{id}}"}}' in response.text
+    assert 'offer_service_circuit_breaker_state{state="closed"} 1.0' in response.text
+    assert "offer_service_rate_limit_throttled_calls_total" in response.text
@@ -0,0 +1,98 @@
+import threading
+import time
+from typing import Generator, List
+
+import httpx
+import pytest
+from app.api.offer_api_auth import OfferServiceAuthorization
+from app.core.config import settings
+from app.core.redis import get_redis_pool
+from app.tests.utils.utils import random_lower_string
+
+TOKEN_URL = f"{settings.OFFER_SERVICE_BASE_URL}api/v1/auth"
+
+
+@pytest.fixture()
+def key() -> Generator:
+    key = f"test_offer_service_access_token_{random_lower_string()}"
+    yield key
+    redis = get_redis_pool(host=settings.REDIS_SERVER, password=settings.REDIS_PASSWORD)
+    redis.delete(key, f"{key}:refresh_lock")
+
+
+@pytest.fixture()
+def token_requests(monkeypatch) -> List[str]:
+    token_requests = []
+
+    def mocked_post(self, url, *args, **kwargs):
+        # slow enough for concurrent callers to overlap
+        time.sleep(0.2)
+        token_requests.append(url)
+        return httpx.Response(200, json={"access_token": f"token-{len(token_requests)}"},
+                              request=httpx.Request("POST", url))
+
+    monkeypatch.setattr(httpx.Client, "post", mocked_post)
+    return token_requests
+
+
+def _authorization(key: str, **kwargs) -> OfferServiceAuthorization:
+    # every instance has its own in-process cache, as if it ran in its own process
+    return OfferServiceAuthorization(
+        client_secret="secret", token_url=TOKEN_URL, key=key,
+        redis_pool=get_redis_pool(host=settings.REDIS_SERVER, password=settings.REDIS_PASSWORD), **kwargs)
+
+
+def test_token_should_be_cached_in_process(key: str, token_requests: List[str]) -> None:
+    authorization = _authorization(key)
+    assert authorization() == "token-1"
+    assert authorization() == "token-1"
+    # other processes get the token from Redis
+    assert _authorization(key)() == "token-1"
+    assert len(token_requests) == 1
+
+
+def test_concurrent_callers_should_share_one_refresh(key: str, token_requests: List[str]) -> None:
+    authorizations = [_authorization(key) for _ in range(5)]
+    tokens = []
+    threads = [threading.Thread(target=lambda authorization=authorization: tokens.append(authorization()))
+               for authorization in authorizations for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert tokens == ["token-1"] * 10
+    assert len(token_requests) == 1
+
+
+def test_expiring_token_should_be_refreshed_ahead(key: str, token_requests: List[str]) -> None:
+    authorization = _authorization(key, expire_seconds=60, refresh_margin=30)
+    redis = get_redis_pool(host=settings.REDIS_SERVER, password=settings.REDIS_PASSWORD)
+    redis.set(key, "old-token", ex=20)
+
+    # while another process refreshes the token, the old one is still used
+    lock = redis.lock(f"{key}:refresh_lock", timeout=10)
+    assert lock.acquire(blocking=False)
+    assert authorization() == "old-token"
+    assert token_requests == []
+    lock.release()
+
+    assert authorization() == "token-1"
+    assert 50 < redis.ttl(key) <= 60
+
+
+def test_invalidated_token_should_be_replaced(key: str, token_requests: List[str]) -> None:
+    authorization = _authorization(key)
+    assert authorization() == "token-1"
+    authorization.invalidate("token-1")
+    assert authorization() == "token-2"
+    # a token that was replaced already is not dropped again
+    _authorization(key).invalidate("token-1")
+    assert authorization() == "token-2"
+    assert len(token_requests) == 2
+
+
+def test_refresh_should_replace_valid_token(key: str, token_requests: List[str]) -> None:
+    authorization = _authorization(key)
+    assert authorization() == "token-1"
+    assert authorization.refresh() == "token-2"
+    assert _authorization(key)() == "token-2"
@@ -0,0 +1,21 @@
+from app.celery.fingerprint import offers_fingerprint
+
+offers = [
+    {"id": "3fa85f64-5717-4562-b3fc-2c963f66afa6", "price": 12345, "items_in_stock": 10},
+    {"id": "3fa85f64-5717-4562-b3fc-2c963f66afa7", "price": 100, "items_in_stock": 0},
+]
+
+
+def test_offers_fingerprint_should_not_depend_on_order_of_offers() -> None:
+    assert offers_fingerprint(offers) == offers_fingerprint(list(reversed(offers)))
+
+
+def test_offers_fingerprint_should_not_depend_on_id_case() -> None:
+    assert offers_fingerprint(offers) == offers_fingerprint([{**offers[0], "id": offers[0]["id"].upper()}, offers[1]])
+
+
+def test_offers_fingerprint_should_change_with_offers() -> None:
+    assert offers_fingerprint(offers) != offers_fingerprint([{**offers[0], "price": 12346}, offers[1]])
+    assert offers_fingerprint(offers) != offers_fingerprint(offers[:1])
+    assert offers_fingerprint(offers) != offers_fingerprint(offers + offers[:1])
+    assert offers_fingerprint([]) != offers_fingerprint(offers)
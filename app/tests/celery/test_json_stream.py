@@ -0,0 +1,26 @@
+import json
+
+import pytest
+from app.celery.json_stream import iter_json_array
+
+OFFERS = [
+    {"id": "3fa85f64-5717-4562-b3fc-2c963f66afa6", "price": 12345, "items_in_stock": 10},
+    {"id": "3fa85f64-5717-4562-b3fc-2c963f66afa7", "price": 1.5e3, "items_in_stock": -1, "note": "a, ]b"},
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1000])
+def test_iter_json_array_should_parse_items_split_between_chunks(chunk_size: int) -> None:
+    text = json.dumps(OFFERS + [10, 2.25e-3, [1, [2]], None], indent=2)
+    chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    assert list(iter_json_array(chunks)) == OFFERS + [10, 2.25e-3, [1, [2]], None]
+
+
+def test_iter_json_array_should_parse_empty_array() -> None:
+    assert list(iter_json_array([" [", " ] "])) == []
+
+
+@pytest.mark.parametrize("text", ["", "{}", "[1,", "[1 2]", "[1]x", "[1.x]"])
+def test_iter_json_array_should_raise_on_invalid_array(text: str) -> None:
+    with pytest.raises(ValueError):
+        list(iter_json_array([text]))
@@ -1,31 +1,29 @@
+from datetime import datetime, timedelta, timezone
+from uuid import UUID, uuid5
+
 import pytest
 from app import crud
-from app.celery.worker_tasks import (_get_number_of_batches,
-                                     do_download_offers_for_product,
-                                     do_download_product_offers)
+from app.celery.worker_tasks import (do_download_offers_for_product,
+                                     do_download_offers_for_products,
+                                     do_download_product_offers,
+                                     do_drain_product_registration_outbox,
+                                     do_maintain_offer_history_partitions)
 from app.core.celery_app import celery_app
+from app.core.circuit_breaker import HALF_OPEN, OPEN, offer_service_circuit_breaker
 from app.core.config import settings
-from app.tests.conftest import get_mocked_celery, get_mocked_client_get
+from app.core.offer_downloads import claim_products, redis_pool
+from app.models import ProductRegistrationOutbox
+from app.schemas.product import ProductCreate
+from app.tests.conftest import (MockClient, get_mocked_async_client_get,
+                                get_mocked_celery, get_mocked_client_stream)
 from app.tests.utils.offer import create_random_offer
 from app.tests.utils.product import create_random_product
-from httpx import Client
+from app.tests.utils.utils import random_lower_string, random_uuid
+from httpx import AsyncClient, Client, ConnectError, Request, Response
+from redis import Redis
+from sqlalchemy import delete
 from sqlalchemy.orm import Session
 
-batches_test_data = [
-    (0, 1),
-    (1, 1),
-    (settings.API_MAX_RECORDS_LIMIT + 1, 2),
-    (settings.API_MAX_RECORDS_LIMIT * 2, 2),
-    (settings.API_MAX_RECORDS_LIMIT * 2 + 1, 3),
-    (settings.API_MAX_RECORDS_LIMIT * 2 + (settings.API_MAX_RECORDS_LIMIT - 1), 3),
-]
-
-
-@pytest.mark.parametrize("products_count, expected_number_of_batches", batches_test_data)
-def test_get_number_of_batches_should_return_correct_number_of_batches(products_count, expected_number_of_batches):
-    number_of_batches = _get_number_of_batches(products_count)
-    assert number_of_batches == expected_number_of_batches
-
 
 def test_do_download_offers_for_product_should_raise_exception_if_client_fails(db: Session):
     with pytest.raises(Exception) as e:
@@ -34,30 +32,170 @@ def test_do_download_offers_for_product_should_raise_exception_if_client_fails(d
 
 
 def test_do_download_offers_for_product_should_succeed(db: Session, monkeypatch):
-    monkeypatch.setattr(Client, "get", get_mocked_client_get)
+    monkeypatch.setattr(Client, "stream", get_mocked_client_stream)
 
     create_random_product(db, id="6ba7b810-9dad-11d1-80b4-00c04fd430c8")
 
     result = do_download_offers_for_product(db, product_id="6ba7b810-9dad-11d1-80b4-00c04fd430c8")
-    assert result == "Created or updated 1 offers, deleted 0 offers."
+    assert result == "Created or updated 1 offers, deleted 0 offers, fingerprint hits 0, misses 1."
     saved_offer = crud.offer.get_multi_by_product(db, product_id="6ba7b810-9dad-11d1-80b4-00c04fd430c8")[0]
     assert str(saved_offer.id) == "3fa85f64-5717-4562-b3fc-2c963f66afa6"
     assert saved_offer.price == 12345
     assert saved_offer.items_in_stock == 10
+    stats = crud.product_offer_stats.get(db, id="6ba7b810-9dad-11d1-80b4-00c04fd430c8")
+    assert stats.offers_count == 1
+    assert stats.min_price == 12345
+    assert stats.items_in_stock == 10
 
 
 def test_do_download_offers_for_product_should_delete_offer_if_not_present_in_result(db: Session, monkeypatch):
-    monkeypatch.setattr(Client, "get", get_mocked_client_get)
+    monkeypatch.setattr(Client, "stream", get_mocked_client_stream)
 
     create_random_product(db, id="6ba7b810-9dad-11d1-80b4-00c04fd430c9")
     create_random_offer(db, product_id="6ba7b810-9dad-11d1-80b4-00c04fd430c9")  # not in feed, will delete
 
     result = do_download_offers_for_product(db, product_id="6ba7b810-9dad-11d1-80b4-00c04fd430c9")
-    assert result == "Created or updated 1 offers, deleted 1 offers."
+    assert result == "Created or updated 1 offers, deleted 1 offers, fingerprint hits 0, misses 1."
     assert not crud.offer.get_multi_by_product(db, product_id="6ba7b810-9dad-11d1-80b4-00c04fd430c8")
 
 
-def test_do_download_product_offers(db: Session, clear_db_products: None, monkeypatch):
+def test_do_download_offers_for_product_should_skip_unchanged_offers(db: Session, monkeypatch):
+    monkeypatch.setattr(Client, "stream", get_mocked_client_stream)
+
+    create_random_product(db, id="6ba7b810-9dad-11d1-80b4-00c04fd430ca")
+
+    do_download_offers_for_product(db, product_id="6ba7b810-9dad-11d1-80b4-00c04fd430ca")
+    state = crud.product_sync_state.get(db, id="6ba7b810-9dad-11d1-80b4-00c04fd430ca")
+    assert state.offers_fingerprint
+    result = do_download_offers_for_product(db, product_id="6ba7b810-9dad-11d1-80b4-00c04fd430ca")
+    assert result == "Offers unchanged, fingerprint hits 1, misses 0."
+
+
+def test_do_download_offers_for_products_should_succeed(db: Session, monkeypatch):
+    monkeypatch.setattr(AsyncClient, "get", get_mocked_async_client_get)
+
+    create_random_product(db, id="6ba7b810-9dad-11d1-80b4-00c04fd450c8")
+    create_random_offer(db, product_id="6ba7b810-9dad-11d1-80b4-00c04fd450c8")  # not in feed, will delete
+
+    result = do_download_offers_for_products(db, product_ids=["6ba7b810-9dad-11d1-80b4-00c04fd450c8"])
+    assert result == ("Downloaded offers for 1 product(s), 0 failed. "
+                      "Created or updated 1 offers, deleted 1 offers, fingerprint hits 0, misses 1.")
+    saved_offers = crud.offer.get_multi_by_product(db, product_id="6ba7b810-9dad-11d1-80b4-00c04fd450c8")
+    assert [str(offer.id) for offer in saved_offers] == ["3fa85f64-5717-4562-b3fc-2c963f66afa6"]
+    stats = crud.product_offer_stats.get(db, id="6ba7b810-9dad-11d1-80b4-00c04fd450c8")
+    assert stats.offers_count == 1
+
+
+def test_do_download_offers_for_products_should_run_a_fixed_number_of_queries_per_product(
+    db: Session, monkeypatch, assert_max_queries
+):
+    async def mocked_get(self, url, *args, **kwargs):
+        product_id = url.split("/")[-2]
+        return Response(200, json=[{"id": str(uuid5(UUID(product_id), str(i))), "price": 100 + i, "items_in_stock": i}
+                                   for i in range(3)], request=Request("GET", url))
+
+    monkeypatch.setattr(AsyncClient, "get", mocked_get)
+    product_ids = [str(create_random_product(db).id) for _ in range(5)]
+    for product_id in product_ids:
+        create_random_offer(db, product_id=product_id)  # not in feed, will delete
+
+    # one query for the fingerprints of all products, then six statements per product - SAVEPOINT, the offer
+    # upsert, the delete of missing offers, the stats refresh, the fingerprint and RELEASE SAVEPOINT
+    with assert_max_queries(1 + 6 * len(product_ids)) as profile:
+        do_download_offers_for_products(db, product_ids=product_ids)
+    assert profile.count == 1 + 6 * len(product_ids)
+    # unchanged offers are not written again - the fingerprints, then one update of the sync state of all products
+    with assert_max_queries(2) as profile:
+        do_download_offers_for_products(db, product_ids=product_ids)
+    assert profile.count == 2
+
+
+def test_do_download_offers_for_products_should_skip_failed_products(db: Session, monkeypatch):
+    async def mocked_get(self, url, *args, **kwargs):
+        if "6ba7b810-9dad-11d1-80b4-00c04fd450d9" in url:
+            raise ConnectError("Connection refused")
+        return MockClient()
+
+    monkeypatch.setattr(AsyncClient, "get", mocked_get)
+
+    create_random_product(db, id="6ba7b810-9dad-11d1-80b4-00c04fd450d9")
+    offer_kept = create_random_offer(db, product_id="6ba7b810-9dad-11d1-80b4-00c04fd450d9")  # fetch fails, is kept
+    create_random_product(db, id="6ba7b810-9dad-11d1-80b4-00c04fd450d8")
+
+    result = do_download_offers_for_products(
+        db, product_ids=["6ba7b810-9dad-11d1-80b4-00c04fd450d8", "6ba7b810-9dad-11d1-80b4-00c04fd450d9"])
+    assert result == ("Downloaded offers for 1 product(s), 1 failed. "
+                      "Created or updated 1 offers, deleted 0 offers, fingerprint hits 0, misses 1.")
+    assert crud.offer.get(db, id=offer_kept.id)
+
+
+def test_do_download_offers_for_product_should_stream_large_payloads(db: Session, monkeypatch):
+    offers = [{"id": f"3fa85f64-5717-4562-b3fc-2c963f66b{i:03d}", "price": i, "items_in_stock": 1} for i in range(5)]
+
+    class MockLargeClient(MockClient):
+        @staticmethod
+        def json():
+            return offers
+
+    monkeypatch.setattr(Client, "stream", lambda *args, **kwargs: MockLargeClient())
+    monkeypatch.setattr(settings, "OFFER_COPY_THRESHOLD", 2)
+
+    product_id = str(create_random_product(db).id)
+    create_random_offer(db, product_id=product_id)  # not in feed, will delete
+
+    result = do_download_offers_for_product(db, product_id=product_id)
+    assert result == "Created or updated 5 offers, deleted 1 offers, fingerprint hits 0, misses 1."
+    assert [offer.price for offer in crud.offer.get_multi_by_product(db, product_id=product_id)] == list(range(5))
+    assert crud.product_offer_stats.get(db, id=product_id).offers_count == 5
+
+    result = do_download_offers_for_product(db, product_id=product_id)
+    assert result == "Offers unchanged, fingerprint hits 1, misses 0."
+
+    offers[4] = {"price": 1, "items_in_stock": 1}
+    with pytest.raises(Exception) as e:
+        do_download_offers_for_product(db, product_id=product_id)
+    assert str(e.value) == f"Task download_offers_for_product({product_id}) failed"
+    db.rollback()
+    assert len(crud.offer.get_multi_by_product(db, product_id=product_id)) == 5
+
+
+def test_do_download_offers_for_products_should_count_fingerprint_hits(db: Session, monkeypatch):
+    monkeypatch.setattr(AsyncClient, "get", get_mocked_async_client_get)
+
+    create_random_product(db, id="6ba7b810-9dad-11d1-80b4-00c04fd450f8")
+
+    do_download_offers_for_products(db, product_ids=["6ba7b810-9dad-11d1-80b4-00c04fd450f8"])
+    result = do_download_offers_for_products(db, product_ids=["6ba7b810-9dad-11d1-80b4-00c04fd450f8"])
+    assert result == ("Downloaded offers for 1 product(s), 0 failed. "
+                      "Created or updated 0 offers, deleted 0 offers, fingerprint hits 1, misses 0.")
+
+
+def test_do_download_offers_for_products_should_skip_products_with_invalid_offers(db: Session, monkeypatch):
+    class MockInvalidClient(MockClient):
+        @staticmethod
+        def json():
+            return [{"price": 1, "items_in_stock": 1}]
+
+    async def mocked_get(self, url, *args, **kwargs):
+        if "6ba7b810-9dad-11d1-80b4-00c04fd450e8" in url:
+            return MockInvalidClient()
+        return MockClient()
+
+    monkeypatch.setattr(AsyncClient, "get", mocked_get)
+
+    create_random_product(db, id="6ba7b810-9dad-11d1-80b4-00c04fd450e8")
+    create_random_product(db, id="6ba7b810-9dad-11d1-80b4-00c04fd450e9")
+
+    result = do_download_offers_for_products(
+        db, product_ids=["6ba7b810-9dad-11d1-80b4-00c04fd450e8", "6ba7b810-9dad-11d1-80b4-00c04fd450e9"])
+    assert result == ("Downloaded offers for 1 product(s), 1 failed. "
+                      "Created or updated 1 offers, deleted 0 offers, fingerprint hits 0, misses 1.")
+    assert crud.offer.get_multi_by_product(db, product_id="6ba7b810-9dad-11d1-80b4-00c04fd450e9")
+    assert not crud.offer.get_multi_by_product(db, product_id="6ba7b810-9dad-11d1-80b4-00c04fd450e8")
+
+
+def test_do_download_product_offers(db: Session, clear_db_products: None, clear_in_flight_products: None,
+                                    monkeypatch):
     monkeypatch.setattr(celery_app, "send_task", get_mocked_celery)
 
     create_random_product(db, id="6ba7b810-9dad-11d1-80b4-00c04fd440c9")
@@ -66,4 +204,201 @@ def test_do_download_product_offers(db: Session, clear_db_products: None, monkey
     create_random_offer(db, product_id="6ba7b810-9dad-11d1-80b4-00c04fd440c8")
 
     result = do_download_product_offers(db)
-    assert result == "Send tasks to update offers for 2 product(s)."
+    assert result == "Send tasks to update offers for 2 product(s), 0 deduplicated, 0 skipped."
+
+
+def test_do_download_product_offers_should_send_one_task_per_batch(
+    db: Session, clear_db_products: None, clear_in_flight_products: None, monkeypatch
+):
+    sent_tasks = []
+    monkeypatch.setattr(celery_app, "send_task", lambda *args, **kwargs: sent_tasks.append((args, kwargs)))
+    monkeypatch.setattr(settings, "OFFER_DOWNLOAD_BATCH_SIZE", 2)
+
+    # the most overdue first, i.e. in the order the products were created
+    product_ids = [str(create_random_product(db).id) for _ in range(5)]
+
+    result = do_download_product_offers(db)
+    assert result == "Send tasks to update offers for 5 product(s), 0 deduplicated, 0 skipped."
+    assert [kwargs["args"][0] for _, kwargs in sent_tasks] == [product_ids[0:2], product_ids[2:4], product_ids[4:]]
+    # all tasks are published by the same producer
+    assert len({id(kwargs["producer"]) for _, kwargs in sent_tasks}) == 1
+
+
+def test_do_download_product_offers_should_send_full_batches_of_claimed_products(
+    db: Session, clear_db_products: None, clear_in_flight_products: None, monkeypatch
+):
+    sent_tasks = []
+    monkeypatch.setattr(celery_app, "send_task", lambda *args, **kwargs: sent_tasks.append(kwargs["args"][0]))
+    monkeypatch.setattr(settings, "OFFER_DOWNLOAD_BATCH_SIZE", 2)
+    monkeypatch.setattr(settings, "OFFER_DOWNLOAD_ROUND_PAGE_SIZE", 3)
+
+    product_ids = [str(create_random_product(db).id) for _ in range(5)]
+    with redis_pool as redis:
+        claim_products(redis, [product_ids[1]])
+
+    # products are claimed a page at a time, the pending one does not leave a gap in the batch
+    result = do_download_product_offers(db)
+    assert result == "Send tasks to update offers for 4 product(s), 1 deduplicated, 0 skipped."
+    assert sent_tasks == [[product_ids[0], product_ids[2]], product_ids[3:]]
+
+
+def test_do_download_product_offers_should_not_enqueue_pending_products_again(
+    db: Session, clear_db_products: None, clear_in_flight_products: None, monkeypatch
+):
+    sent_tasks = []
+    monkeypatch.setattr(celery_app, "send_task", lambda *args, **kwargs: sent_tasks.append(kwargs["args"][0]))
+
+    product_ids = [str(create_random_product(db).id) for _ in range(2)]
+
+    do_download_product_offers(db)
+    result = do_download_product_offers(db)
+    assert result == "Send tasks to update offers for 0 product(s), 2 deduplicated, 0 skipped."
+    assert len(sent_tasks) == 1
+
+    # finished downloads release their products, failed ones are due again right away
+    async def mocked_get(self, url, *args, **kwargs):
+        raise ConnectError("Connection refused")
+
+    monkeypatch.setattr(AsyncClient, "get", mocked_get)
+    do_download_offers_for_products(db, product_ids=product_ids)
+    result = do_download_product_offers(db)
+    assert result == "Send tasks to update offers for 2 product(s), 0 deduplicated, 0 skipped."
+
+
+def test_do_download_product_offers_should_send_only_due_products(
+    db: Session, clear_db_products: None, clear_in_flight_products: None, monkeypatch
+):
+    sent_tasks = []
+    monkeypatch.setattr(celery_app, "send_task", lambda *args, **kwargs: sent_tasks.append(kwargs["args"][0]))
+    monkeypatch.setattr(Client, "stream", get_mocked_client_stream)
+
+    synced_product_id = str(create_random_product(db, id="6ba7b810-9dad-11d1-80b4-00c04fd460c8").id)
+    due_product_id = str(create_random_product(db).id)
+    do_download_offers_for_product(db, product_id=synced_product_id)
+
+    result = do_download_product_offers(db)
+    assert result == "Send tasks to update offers for 1 product(s), 0 deduplicated, 0 skipped."
+    assert sent_tasks == [[due_product_id]]
+
+
+def test_do_download_offers_for_product_should_sync_unchanged_products_less_often(db: Session, monkeypatch):
+    monkeypatch.setattr(Client, "stream", get_mocked_client_stream)
+
+    create_random_product(db, id="6ba7b810-9dad-11d1-80b4-00c04fd460c9")
+    do_download_offers_for_product(db, product_id="6ba7b810-9dad-11d1-80b4-00c04fd460c9")
+    do_download_offers_for_product(db, product_id="6ba7b810-9dad-11d1-80b4-00c04fd460c9")
+
+    state = crud.product_sync_state.get(db, id="6ba7b810-9dad-11d1-80b4-00c04fd460c9")
+    db.refresh(state)
+    assert state.sync_interval_seconds == 2 * settings.OFFER_DOWNLOAD_MIN_INTERVAL_SECONDS
+    assert (state.syncs_count, state.changes_count) == (2, 1)
+
+
+def test_do_download_product_offers_should_pause_while_circuit_breaker_is_open(
+    db: Session, clear_db_products: None, clear_in_flight_products: None, monkeypatch
+):
+    sent_tasks = []
+    monkeypatch.setattr(celery_app, "send_task", lambda *args, **kwargs: sent_tasks.append(kwargs["args"][0]))
+    for _ in range(3):
+        create_random_product(db)
+
+    monkeypatch.setattr(offer_service_circuit_breaker, "state", lambda: OPEN)
+    result = do_download_product_offers(db)
+    assert result == "Offer service circuit breaker is open, no tasks sent."
+    assert not sent_tasks
+
+    # half-open breaker gets a single probing task
+    monkeypatch.setattr(offer_service_circuit_breaker, "state", lambda: HALF_OPEN)
+    monkeypatch.setattr(settings, "OFFER_DOWNLOAD_BATCH_SIZE", 1)
+    result = do_download_product_offers(db)
+    assert result == "Send tasks to update offers for 1 product(s), 0 deduplicated, 2 skipped."
+
+
+def test_do_download_offers_for_products_should_fail_fast_while_circuit_breaker_is_open(db: Session, monkeypatch):
+    calls = []
+
+    async def mocked_get(self, url, *args, **kwargs):
+        calls.append(url)
+        raise ConnectError("Connection refused")
+
+    monkeypatch.setattr(AsyncClient, "get", mocked_get)
+    monkeypatch.setattr(settings, "OFFER_SERVICE_MAX_CONCURRENCY", 1)
+    product_ids = [str(create_random_product(db).id) for _ in range(settings.OFFER_SERVICE_BREAKER_FAILURE_THRESHOLD + 2)]
+
+    result = do_download_offers_for_products(db, product_ids=product_ids)
+    assert result.startswith(f"Downloaded offers for 0 product(s), {len(product_ids)} failed.")
+    # calls after the breaker opened did not reach the offer service
+    assert len(calls) == settings.OFFER_SERVICE_BREAKER_FAILURE_THRESHOLD
+    assert offer_service_circuit_breaker.state() == OPEN
+
+
+def test_do_download_product_offers_should_shrink_round_if_queue_is_full(
+    db: Session, clear_db_products: None, clear_in_flight_products: None, monkeypatch
+):
+    sent_tasks = []
+    monkeypatch.setattr(celery_app, "send_task", lambda *args, **kwargs: sent_tasks.append(kwargs["args"][0]))
+    monkeypatch.setattr(Redis, "llen", lambda self, name: 9)
+    monkeypatch.setattr(settings, "OFFER_DOWNLOAD_MAX_QUEUE_DEPTH", 10)
+    monkeypatch.setattr(settings, "OFFER_DOWNLOAD_BATCH_SIZE", 2)
+
+    for _ in range(5):
+        create_random_product(db)
+
+    result = do_download_product_offers(db)
+    assert result == "Send tasks to update offers for 2 product(s), 0 deduplicated, 3 skipped."
+    assert len(sent_tasks) == 1
+
+    monkeypatch.setattr(Redis, "llen", lambda self, name: 10)
+    result = do_download_product_offers(db)
+    assert result == "Send tasks to update offers for 0 product(s), 0 deduplicated, 5 skipped."
+
+
+def test_do_maintain_offer_history_partitions_should_create_partitions_ahead(db: Session):
+    do_maintain_offer_history_partitions(db)
+
+    partition_days = crud.offer_history.get_partition_days(db)
+    today = datetime.now(timezone.utc).date()
+    assert today + timedelta(days=settings.OFFER_HISTORY_PRECREATE_DAYS - 1) in partition_days
+    result = do_maintain_offer_history_partitions(db)
+    assert result == "Created 0 and dropped 0 offer history partition(s)."
+
+
+def test_do_drain_product_registration_outbox_should_register_products(
+    db: Session, clear_in_flight_products: None, monkeypatch
+):
+    db.execute(delete(ProductRegistrationOutbox))
+    db.commit()
+    # the outbox is drained in two batches
+    monkeypatch.setattr(settings, "OFFER_REGISTRATION_BATCH_SIZE", 3)
+    statuses = {}
+    for status_code in (201, 409, 422, 503):
+        product_in = ProductCreate(id=random_uuid(), name=random_lower_string(), description=random_lower_string())
+        crud.product_registration_outbox.create_with_product(db=db, obj_in=product_in)
+        statuses[str(product_in.id)] = status_code
+
+    in_transaction = []
+
+    async def mocked_post(self, url, *args, json, **kwargs):
+        in_transaction.append(db.in_transaction())
+        return Response(statuses[json["id"]], json={"id": json["id"]}, request=Request("POST", url))
+
+    sent_tasks = []
+    monkeypatch.setattr(AsyncClient, "post", mocked_post)
+    monkeypatch.setattr(celery_app, "send_task", lambda *args, **kwargs: sent_tasks.append(kwargs["args"][0]))
+
+    result = do_drain_product_registration_outbox(db)
+    assert result == "Registered 2 product(s), 1 rejected, 1 to be retried."
+    # the claimed batch is committed before the offer service is called
+    assert in_transaction == [False] * 4
+    product_ids = {status_code: product_id for product_id, status_code in statuses.items()}
+    assert sent_tasks == [[product_ids[201], product_ids[409]]]
+    assert not crud.product.get(db, id=product_ids[422])
+    # registered products are due for the periodic download, the one waiting for a retry is not
+    assert crud.product_sync_state.get(db, id=product_ids[201]) is not None
+    assert crud.product_sync_state.get(db, id=product_ids[409]) is not None
+    assert crud.product_sync_state.get(db, id=product_ids[503]) is None
+    retried = db.query(ProductRegistrationOutbox).one()
+    assert (str(retried.product_id), retried.attempts) == (product_ids[503], 1)
+
+    # the failed registration is not due again yet
+    assert do_drain_product_registration_outbox(db) == "Registered 0 product(s), 0 rejected, 0 to be retried."
@@ -1,9 +1,14 @@
-from typing import Dict, Generator
+import json
+from contextlib import contextmanager
+from typing import Callable, ContextManager, Dict, Generator, Iterator
 
 import pytest
 from app.api.deps import get_db
 from app.api.offer_api_auth import auth_token
+from app.core.circuit_breaker import offer_service_circuit_breaker
 from app.core.config import settings
+from app.core.offer_downloads import IN_FLIGHT_KEY_PREFIX, redis_pool
+from app.core.query_profiler import QueryProfile, profile_engine
 from app.db.base import Base
 from app.db.init_db import init_db
 from app.main import app
@@ -41,13 +46,28 @@ class MockClient:
     def raise_for_status():
         pass
 
+    def iter_text(self, chunk_size=None):
+        # the body arrives in small chunks, so offers are split between them
+        text = json.dumps(self.json())
+        return (text[i:i + 10] for i in range(0, len(text), 10))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
 
 def get_mocked_celery(*args, **kwargs):
     return MockCelery()
 
 
-def get_mocked_client_get(*args, **kwargs):
-        return MockClient()
+def get_mocked_client_stream(*args, **kwargs):
+    return MockClient()
+
+
+async def get_mocked_async_client_get(*args, **kwargs):
+    return MockClient()
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -74,6 +94,39 @@ def clear_db_products(db: Session) -> None:
     db.commit()
 
 
+@pytest.fixture(autouse=True)
+def reset_offer_service_circuit_breaker() -> Generator:
+    # failures of one test must not open the shared breaker for the following ones
+    yield
+    with redis_pool as redis:
+        redis.delete(*offer_service_circuit_breaker.keys)
+
+
+@pytest.fixture()
+def clear_in_flight_products() -> Generator:
+    yield
+    with redis_pool as redis:
+        keys = list(redis.scan_iter(f"{IN_FLIGHT_KEY_PREFIX}*"))
+        if keys:
+            redis.delete(*keys)
+
+
+@pytest.fixture()
+def assert_max_queries() -> Callable[[int], ContextManager[QueryProfile]]:
+    """
+    `with assert_max_queries(n):` fails the test if the block runs more than `n` statements, so an added round trip,
+    e.g. a query per item of a list, is noticed before it gets to production.
+    """
+    @contextmanager
+    def assert_max_queries(max_count: int) -> Iterator[QueryProfile]:
+        # the application runs in threads of the test client, statements of all threads are counted
+        with profile_engine(engine) as profile:
+            yield profile
+        assert profile.count <= max_count, f"Expected at most {max_count} queries, got {profile.report()}"
+
+    return assert_max_queries
+
+
 @pytest.fixture(scope="module")
 def client() -> Generator:
     with TestClient(app) as c:
@@ -0,0 +1,102 @@
+import asyncio
+import time
+from typing import Generator
+
+import httpx
+import pytest
+from app.core.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+from app.core.config import settings
+from app.core.redis import get_redis_pool
+from app.tests.utils.utils import random_lower_string
+
+
+@pytest.fixture()
+def breaker() -> Generator:
+    redis = get_redis_pool(host=settings.REDIS_SERVER, password=settings.REDIS_PASSWORD)
+    breaker = CircuitBreaker(name=f"test_{random_lower_string()}", failure_threshold=2, failure_window=10,
+                             reset_timeout=0.2, redis=redis)
+    yield breaker
+    redis.delete(*breaker.keys)
+
+
+def _fail(breaker: CircuitBreaker) -> None:
+    with pytest.raises(httpx.ConnectError):
+        with breaker.protect():
+            raise httpx.ConnectError("Connection refused")
+
+
+def _server_error() -> httpx.HTTPStatusError:
+    request = httpx.Request("GET", "http://offers.invalid/")
+    return httpx.HTTPStatusError("Server error", request=request, response=httpx.Response(503, request=request))
+
+
+def test_breaker_should_open_after_failure_threshold(breaker: CircuitBreaker) -> None:
+    _fail(breaker)
+    assert breaker.state() == CLOSED
+    _fail(breaker)
+    assert breaker.state() == OPEN
+    with pytest.raises(CircuitOpen):
+        with breaker.protect():
+            pytest.fail("call must not run while the breaker is open")
+
+
+def test_breaker_should_count_server_errors_but_not_client_errors(breaker: CircuitBreaker) -> None:
+    for _ in range(3):
+        with breaker.protect() as call:
+            call.check(httpx.Response(404))
+    assert breaker.state() == CLOSED
+    with breaker.protect() as call:
+        call.check(httpx.Response(500))
+    with pytest.raises(httpx.HTTPStatusError):
+        with breaker.protect():
+            raise _server_error()
+    assert breaker.state() == OPEN
+
+
+def test_half_open_breaker_should_let_single_trial_through(breaker: CircuitBreaker) -> None:
+    _fail(breaker)
+    _fail(breaker)
+    time.sleep(0.3)
+    assert breaker.state() == HALF_OPEN
+    with breaker.protect() as call:
+        assert call.trial
+        with pytest.raises(CircuitOpen):
+            with breaker.protect():
+                pass
+    assert breaker.state() == CLOSED
+
+
+def test_failed_trial_should_open_breaker_again(breaker: CircuitBreaker) -> None:
+    _fail(breaker)
+    _fail(breaker)
+    time.sleep(0.3)
+    _fail(breaker)
+    assert breaker.state() == OPEN
+
+
+def test_trial_that_did_not_reach_service_should_not_close_breaker(breaker: CircuitBreaker) -> None:
+    _fail(breaker)
+    _fail(breaker)
+    time.sleep(0.3)
+    with pytest.raises(RuntimeError):
+        with breaker.protect():
+            raise RuntimeError("rate limited")
+    assert breaker.state() == HALF_OPEN
+    # the next call gets the trial
+    with breaker.protect() as call:
+        assert call.trial
+    assert breaker.state() == CLOSED
+
+
+def test_protect_async_should_open_breaker(breaker: CircuitBreaker) -> None:
+    async def fail():
+        with pytest.raises(httpx.ConnectError):
+            async with breaker.protect_async():
+                raise httpx.ConnectError("Connection refused")
+
+    async def fail_twice():
+        await fail()
+        await fail()
+
+    asyncio.run(fail_twice())
+    assert breaker.state() == OPEN
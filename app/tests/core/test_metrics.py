@@ -0,0 +1,31 @@
+import httpx
+from app.core import metrics
+from app.core.config import settings
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine
+
+
+def test_instrumented_pool_should_export_its_state() -> None:
+    engine = create_engine(
+        str(settings.SQLALCHEMY_TESTING_DATABASE_URI), poolclass=metrics.InstrumentedQueuePool, pool_size=1,
+        max_overflow=1)
+    checkouts = REGISTRY.get_sample_value("db_pool_checkout_duration_seconds_count")
+    try:
+        with engine.connect(), engine.connect():
+            assert REGISTRY.get_sample_value("db_pool_checked_out") == 2
+            assert REGISTRY.get_sample_value("db_pool_overflow") == 1
+        assert REGISTRY.get_sample_value("db_pool_size") == 1
+        assert REGISTRY.get_sample_value("db_pool_checked_out") == 0
+        assert REGISTRY.get_sample_value("db_pool_overflow") == 0
+        assert REGISTRY.get_sample_value("db_pool_checkout_duration_seconds_count") == checkouts + 2
+    finally:
+        engine.dispose()
+
+
+def test_instrumented_transport_should_record_latency_by_endpoint_and_status() -> None:
+    transport = metrics.InstrumentedTransport(httpx.MockTransport(lambda request: httpx.Response(404)))
+    labels = {"endpoint": "/api/v1/products/{id}/offers", "status": "404"}
+    before = REGISTRY.get_sample_value("offer_service_request_duration_seconds_count", labels) or 0
+    with httpx.Client(transport=transport) as client:
+        client.get("http://offers.invalid/api/v1/products/3fa85f64-5717-4562-b3fc-2c963f66afa6/offers")
+    assert REGISTRY.get_sample_value("offer_service_request_duration_seconds_count", labels) == before + 1
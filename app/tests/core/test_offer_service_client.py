@@ -0,0 +1,60 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Generator
+
+import httpx
+import pytest
+from app.core import offer_service_client
+from app.core.config import settings
+
+
+@pytest.fixture(autouse=True)
+def close_clients() -> Generator:
+    yield
+    offer_service_client.close()
+
+
+def test_client_should_be_shared_by_calls() -> None:
+    client = offer_service_client.get_client()
+    assert offer_service_client.get_client() is client
+    assert client.timeout.connect == settings.OFFER_SERVICE_CONNECT_TIMEOUT_SECONDS
+    assert client.timeout.read == settings.OFFER_SERVICE_READ_TIMEOUT_SECONDS
+
+    offer_service_client.close()
+    assert client.is_closed
+    assert offer_service_client.get_client() is not client
+
+
+def test_forked_process_should_get_new_clients(monkeypatch) -> None:
+    client = offer_service_client.get_client()
+    monkeypatch.setattr(os, "getpid", lambda: -1)
+    offer_service_client.reset_after_fork()
+    assert offer_service_client.get_client() is not client
+    # connections of the parent process are left open
+    assert not client.is_closed
+    client.close()
+
+
+def test_run_async_should_reuse_loop_and_async_client() -> None:
+    async def get_loop_and_client():
+        return asyncio.get_running_loop(), offer_service_client.get_async_client()
+
+    loop, client = offer_service_client.run_async(get_loop_and_client())
+    assert offer_service_client.run_async(get_loop_and_client()) == (loop, client)
+    assert isinstance(client, httpx.AsyncClient)
+
+    offer_service_client.close()
+    assert client.is_closed
+    assert loop.is_closed()
+
+
+def test_run_async_should_run_coroutines_of_threads_concurrently() -> None:
+    threads = [threading.Thread(target=offer_service_client.run_async, args=(asyncio.sleep(0.2),)) for _ in range(10)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - start < 1
@@ -0,0 +1,59 @@
+import logging
+import threading
+
+from app.core import query_profiler
+from app.core.config import settings
+from app.tests.utils.test_db import engine
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+
+def test_profile_queries_should_record_statements_of_the_block(db: Session) -> None:
+    with query_profiler.profile_queries() as profile:
+        db.execute(select(1))
+        for _ in range(3):
+            db.execute(text("SELECT pg_sleep(0.01)"))
+    db.execute(select(2))
+    assert profile.count == 4
+    assert profile.seconds >= 0.03
+    assert profile.duplicates() == [("SELECT pg_sleep(0.01)", 3)]
+
+
+def test_profile_queries_should_count_queries_of_the_block(db: Session) -> None:
+    with query_profiler.profile_queries() as profile:
+        db.execute(select(1))
+        db.execute(select(2))
+    db.execute(select(3))
+    assert profile.count == 2
+
+
+def test_nested_profiles_should_record_statements_in_all_of_them(db: Session) -> None:
+    with query_profiler.profile_queries() as outer:
+        db.execute(select(1))
+        with query_profiler.profile_queries() as inner:
+            db.execute(select(2))
+    assert (outer.count, inner.count) == (2, 1)
+
+
+def test_profile_engine_should_record_statements_of_other_threads(db: Session) -> None:
+    def query() -> None:
+        with engine.connect() as connection:
+            connection.execute(select(1))
+
+    with query_profiler.profile_engine(engine) as profile:
+        thread = threading.Thread(target=query)
+        thread.start()
+        thread.join()
+    assert profile.count == 1
+
+
+def test_slow_units_of_work_should_be_logged(db: Session, monkeypatch, caplog) -> None:
+    with query_profiler.profile_queries() as profile:
+        db.execute(text("SELECT 1"))
+    monkeypatch.setattr(settings, "QUERY_PROFILE_LOG_THRESHOLD_SECONDS", 0.5)
+    with caplog.at_level(logging.WARNING, logger=query_profiler.__name__):
+        query_profiler.log_if_slow("GET /fast", 0.1, profile)
+        query_profiler.log_if_slow("GET /slow", 0.5, profile)
+    assert [record.getMessage().splitlines() for record in caplog.records] == [[
+        f"GET /slow took 500.0 ms, 1 queries in {profile.seconds * 1000:.1f} ms",
+        "    1x SELECT 1"]]
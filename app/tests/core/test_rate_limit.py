@@ -0,0 +1,86 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Generator
+
+import pytest
+from app.core.config import settings
+from app.core.rate_limit import RateLimitExceeded, TokenBucket
+from app.core.redis import get_redis_pool
+from app.tests.utils.utils import random_lower_string
+
+
+@pytest.fixture()
+def bucket_name() -> Generator:
+    name = f"test_{random_lower_string()}"
+    yield name
+    redis = get_redis_pool(host=settings.REDIS_SERVER, password=settings.REDIS_PASSWORD)
+    redis.delete(f"rate_limit:{name}", f"rate_limit:{name}:metrics")
+
+
+def _bucket(name: str, rate: float = 10, burst: int = 2, max_wait: float = 5) -> TokenBucket:
+    return TokenBucket(name=name, rate=rate, burst=burst, max_wait=max_wait,
+                       redis=get_redis_pool(host=settings.REDIS_SERVER, password=settings.REDIS_PASSWORD))
+
+
+def test_reserve_should_take_burst_then_reserve_next_tokens(bucket_name: str) -> None:
+    bucket = _bucket(bucket_name)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert 0 < bucket.reserve() <= 0.1
+    # the reserved token is not handed out again, the next caller waits for the following one
+    assert 0.1 < bucket.reserve() <= 0.2
+
+
+def test_bucket_should_be_shared_by_limiter_instances(bucket_name: str) -> None:
+    # instances stand for limiters of different processes
+    assert _bucket(bucket_name).reserve(tokens=2) == 0
+    assert _bucket(bucket_name).reserve() > 0
+
+
+def test_acquire_should_wait_for_token_and_record_throttling(bucket_name: str) -> None:
+    bucket = _bucket(bucket_name)
+    assert bucket.acquire(tokens=2) == 0
+    throttled_seconds = bucket.acquire()
+    assert 0 < throttled_seconds < 1
+    assert bucket.throttled_calls == 1
+    metrics = _bucket(bucket_name).get_metrics()
+    assert metrics["throttled_calls"] == 1
+    assert metrics["throttled_seconds"] == pytest.approx(throttled_seconds)
+
+
+def test_acquire_async_should_wait_for_token(bucket_name: str) -> None:
+    bucket = _bucket(bucket_name)
+
+    async def acquire_concurrently():
+        return await asyncio.gather(*(bucket.acquire_async() for _ in range(3)))
+
+    throttled = asyncio.run(acquire_concurrently())
+    assert sorted(throttled)[:2] == [0, 0]
+    assert sorted(throttled)[2] > 0
+    assert bucket.get_metrics()["throttled_calls"] == 1
+
+
+def test_acquire_should_raise_if_wait_is_too_long(bucket_name: str) -> None:
+    bucket = _bucket(bucket_name, rate=0.1, max_wait=1)
+    bucket.acquire(tokens=2)
+    with pytest.raises(RateLimitExceeded):
+        bucket.acquire()
+    # refused calls do not reserve, the wait of the next caller does not grow
+    assert 9 < bucket.reserve() <= 10
+
+
+def test_concurrent_acquire_should_wait_for_consecutive_tokens(bucket_name: str, monkeypatch) -> None:
+    bucket = _bucket(bucket_name, rate=20, burst=1)
+    script_calls = []
+    script = bucket.script
+    monkeypatch.setattr(bucket, "script", lambda **kwargs: script_calls.append(kwargs) or script(**kwargs))
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        list(executor.map(lambda _: bucket.acquire(), range(10)))
+
+    # the first token is in the bucket, every other caller sleeps once until its own token is due
+    assert len(script_calls) == 10
+    assert 9 / 20 <= time.monotonic() - start < 9 / 20 + 0.3
+    assert bucket.throttled_calls == 9
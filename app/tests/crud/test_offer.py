@@ -1,4 +1,7 @@
+import pytest
 from app import crud
+from app.core import query_profiler
+from app.core.config import settings
 from app.schemas.offer import OfferCreate, OfferUpdate
 from app.tests.utils.offer import create_random_offer, create_random_offer_with_product
 from app.tests.utils.product import create_random_product
@@ -105,3 +108,142 @@ def test_remove_multiple_by_id_should_remove_multiple_offers(db: Session) -> Non
     assert crud.offer.get(db=db, id=offer_2_id) is None
     assert offer_3_id == crud.offer.get(db=db, id=offer_3_id).id
     assert offer_4_id == crud.offer.get(db=db, id=offer_4_id).id
+
+
+def test_replace_product_offers_should_upsert_offers_and_remove_missing_ones(db: Session) -> None:
+    product = create_random_product(db=db)
+    offer_kept = create_random_offer(db=db, product_id=product.id)
+    offer_removed = create_random_offer(db=db, product_id=product.id)
+    other_offer = create_random_offer_with_product(db=db)
+    offer_removed_id, other_offer_id = offer_removed.id, other_offer.id
+    new_offer_id = str(random_uuid())
+    changed_count, removed_count = crud.offer.replace_product_offers(
+        db=db,
+        product_id=product.id,
+        objects=[
+            {"id": str(offer_kept.id), "price": offer_kept.price + 1, "items_in_stock": offer_kept.items_in_stock},
+            {"id": new_offer_id, "price": 1, "items_in_stock": 1}])
+    assert (changed_count, removed_count) == (2, 1)
+    db.expire_all()
+    offer_ids = {str(offer.id) for offer in crud.offer.get_multi_by_product(db=db, product_id=product.id)}
+    assert offer_ids == {str(offer_kept.id), new_offer_id}
+    assert crud.offer.get(db=db, id=offer_removed_id) is None
+    assert crud.offer.get(db=db, id=other_offer_id) is not None
+
+
+def test_replace_product_offers_should_remove_all_offers_if_none_given(db: Session) -> None:
+    product = create_random_product(db=db)
+    create_random_offer(db=db, product_id=product.id)
+    create_random_offer(db=db, product_id=product.id)
+    assert crud.offer.replace_product_offers(db=db, product_id=product.id, objects=[]) == (0, 2)
+    db.expire_all()
+    assert not crud.offer.get_multi_by_product(db=db, product_id=product.id)
+
+
+def test_bulk_create_or_update_should_copy_offers_above_threshold(db: Session, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "OFFER_COPY_THRESHOLD", 1)
+    product = create_random_product(db=db)
+    offer = create_random_offer(db=db, product_id=product.id)
+    objects = [
+        {"id": str(offer.id), "price": offer.price, "items_in_stock": offer.items_in_stock + 1,
+         "product_id": str(product.id)},
+        {"id": str(random_uuid()), "price": 1, "items_in_stock": 1, "product_id": str(product.id)},
+    ]
+    assert crud.offer.bulk_create_or_update(db=db, objects=objects) == 2
+    db.expire_all()
+    offers = crud.offer.get_multi_by_product(db=db, product_id=product.id)
+    assert {(str(o.id), o.price, o.items_in_stock) for o in offers} == {
+        (obj["id"], obj["price"], obj["items_in_stock"]) for obj in objects}
+    # unchanged offers are not rewritten by the copy path either
+    assert crud.offer.bulk_create_or_update(db=db, objects=objects) == 0
+
+
+@pytest.mark.parametrize("copy_threshold", [0, 100])
+def test_bulk_create_or_update_should_not_move_offers_between_products_if_disabled(
+    db: Session, monkeypatch, copy_threshold: int
+) -> None:
+    monkeypatch.setattr(settings, "OFFER_COPY_THRESHOLD", copy_threshold)
+    product = create_random_product(db=db)
+    other_offer = create_random_offer(db=db, product_id=create_random_product(db=db).id, price=10)
+    new_offer_id = str(random_uuid())
+    objects = [
+        {"id": str(other_offer.id), "price": 20, "items_in_stock": 1, "product_id": str(product.id)},
+        {"id": new_offer_id, "price": 30, "items_in_stock": 1, "product_id": str(product.id)},
+    ]
+    assert crud.offer.bulk_create_or_update(db=db, objects=objects, move_between_products=False) == 1
+    db.expire_all()
+    assert [str(offer.id) for offer in crud.offer.get_multi_by_product(db=db, product_id=product.id)] == [new_offer_id]
+    assert (crud.offer.get(db=db, id=other_offer.id).product_id, crud.offer.get(db=db, id=other_offer.id).price) == (
+        other_offer.product_id, 10)
+
+
+def test_replace_product_offers_should_copy_offers_above_threshold(db: Session, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "OFFER_COPY_THRESHOLD", 1)
+    product_1 = create_random_product(db=db)
+    product_2 = create_random_product(db=db)
+    offer_removed = create_random_offer(db=db, product_id=product_1.id)
+    offer_removed_id = offer_removed.id
+    objects_1 = [{"id": str(random_uuid()), "price": i, "items_in_stock": i} for i in range(1, 4)]
+    objects_2 = [{"id": str(random_uuid()), "price": i, "items_in_stock": i} for i in range(1, 3)]
+    # the staging table is reused within one transaction
+    assert crud.offer.replace_product_offers(db=db, product_id=product_1.id, objects=objects_1, commit=False) == (3, 1)
+    assert crud.offer.replace_product_offers(db=db, product_id=product_2.id, objects=objects_2, commit=False) == (2, 0)
+    db.commit()
+    db.expire_all()
+    assert crud.offer.get(db=db, id=offer_removed_id) is None
+    assert len(crud.offer.get_multi_by_product(db=db, product_id=product_1.id)) == 3
+    assert len(crud.offer.get_multi_by_product(db=db, product_id=product_2.id)) == 2
+
+
+def test_replace_product_offers_should_reject_invalid_offers_above_threshold(db: Session, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "OFFER_COPY_THRESHOLD", 0)
+    product = create_random_product(db=db)
+    with pytest.raises(ValueError):
+        crud.offer.replace_product_offers(
+            db=db, product_id=product.id, objects=[{"id": "invalid", "price": 1, "items_in_stock": 1}])
+    db.rollback()
+
+
+def test_get_multi_by_product_keyset_should_return_offers_ordered_by_price_in_pages(db: Session) -> None:
+    product = create_random_product(db=db)
+    offers = [create_random_offer(db=db, product_id=product.id, price=price) for price in (30, 10, 20, 10)]
+    create_random_offer_with_product(db=db)  # random other offer
+    expected_offer_ids = [offer.id for offer in sorted(offers, key=lambda offer: (offer.price, offer.id))]
+
+    first_page = crud.offer.get_multi_by_product_keyset(db=db, product_id=product.id, limit=3)
+    last_page = crud.offer.get_multi_by_product_keyset(
+        db=db, product_id=product.id, after=(first_page[-1].price, first_page[-1].id), limit=3)
+
+    assert [offer.id for offer in first_page + last_page] == expected_offer_ids
+
+
+def test_stream_multi_should_return_offers_of_product_in_batches(db: Session) -> None:
+    product = create_random_product(db=db)
+    offer_ids = {create_random_offer(db=db, product_id=product.id).id for _ in range(3)}
+    create_random_offer_with_product(db=db)  # random other offer
+
+    batches = list(crud.offer.stream_multi(db=db, product_id=product.id, batch_size=2))
+
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert {row.id for batch in batches for row in batch} == offer_ids
+
+
+def test_get_multi_by_products_should_return_offers_of_all_requested_products(db: Session) -> None:
+    product1 = create_random_product(db=db)
+    product2 = create_random_product(db=db)
+    product_without_offers = create_random_product(db=db)
+    offers1 = [create_random_offer(db=db, product_id=product1.id, price=price) for price in (30, 10, 20)]
+    offer2 = create_random_offer(db=db, product_id=product2.id)
+    create_random_offer_with_product(db=db)  # random other offer
+
+    product_ids = [product1.id, product2.id, product_without_offers.id, random_uuid()]
+    expected_offer_ids = {product1.id: [offers1[1].id, offers1[2].id], product2.id: [offer2.id],
+                          product_without_offers.id: []}
+
+    with query_profiler.profile_queries() as profile:
+        offers = crud.offer.get_multi_by_products(db=db, product_ids=product_ids, limit=2)
+
+    assert profile.count == 1
+    # the cheapest offers up to the limit, missing products are left out
+    assert {product_id: [offer.id for offer in product_offers]
+            for product_id, product_offers in offers.items()} == expected_offer_ids
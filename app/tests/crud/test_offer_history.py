@@ -0,0 +1,101 @@
+from datetime import date, datetime, timedelta, timezone
+
+from app import crud
+from app.models import OfferHistory
+from app.schemas import PriceHistoryBucketSize
+from app.schemas.offer import OfferCreate
+from app.tests.utils.offer import create_random_offer
+from app.tests.utils.product import create_random_product
+from app.tests.utils.utils import random_uuid
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+
+def _history_of(db: Session, offer_id) -> list:
+    return db.execute(
+        select(OfferHistory.price, OfferHistory.items_in_stock).where(OfferHistory.offer_id == offer_id)
+    ).all()
+
+
+def test_bulk_create_or_update_should_record_only_changed_offers(db: Session) -> None:
+    product = create_random_product(db)
+    offer = OfferCreate(id=random_uuid(), price=100, items_in_stock=5, product_id=product.id).model_dump()
+
+    assert crud.offer.bulk_create_or_update(db=db, objects=[offer]) == 1
+    assert crud.offer.bulk_create_or_update(db=db, objects=[offer]) == 0
+    assert crud.offer.bulk_create_or_update(db=db, objects=[{**offer, "price": 90}]) == 1
+
+    assert sorted(_history_of(db, offer["id"])) == [(90, 5), (100, 5)]
+
+
+def test_remove_multiple_by_id_should_record_offers_as_sold_out(db: Session) -> None:
+    offer = create_random_offer(db=db, product_id=create_random_product(db).id)
+    offer_id, offer_price = offer.id, offer.price
+
+    assert crud.offer.remove_multiple_by_id(db=db, ids=[offer_id]) == 1
+
+    assert _history_of(db, offer_id) == [(offer_price, 0)]
+
+
+def test_get_price_buckets_should_aggregate_changes_of_product(db: Session) -> None:
+    product = create_random_product(db)
+    day = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    db.add_all([
+        OfferHistory(offer_id=random_uuid(), product_id=product.id, price=10, items_in_stock=1,
+                     recorded_at=day + timedelta(hours=1)),
+        OfferHistory(offer_id=random_uuid(), product_id=product.id, price=20, items_in_stock=1,
+                     recorded_at=day + timedelta(hours=2)),
+        OfferHistory(offer_id=random_uuid(), product_id=product.id, price=40, items_in_stock=1,
+                     recorded_at=day + timedelta(days=1)),
+        OfferHistory(offer_id=random_uuid(), product_id=random_uuid(), price=1000, items_in_stock=1,
+                     recorded_at=day + timedelta(hours=1)),  # other product
+    ])
+    db.commit()
+
+    buckets = crud.offer_history.get_price_buckets(
+        db=db, product_id=product.id, start=day, end=day + timedelta(days=7), bucket=PriceHistoryBucketSize.day)
+
+    assert [(bucket.min_price, bucket.max_price, bucket.avg_price, bucket.changes_count) for bucket in buckets] == [
+        (10, 20, 15, 2),
+        (40, 40, 40, 1),
+    ]
+
+
+def test_get_price_buckets_should_use_utc_days_in_any_session_time_zone(db: Session) -> None:
+    product = create_random_product(db)
+    day = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    # 21:00 and 19:00 on different days in New York
+    db.add_all([
+        OfferHistory(offer_id=random_uuid(), product_id=product.id, price=price, items_in_stock=1,
+                     recorded_at=day + timedelta(hours=hours))
+        for price, hours in ((10, 1), (20, 23))
+    ])
+    db.commit()
+
+    db.execute(text("SET LOCAL TimeZone = 'America/New_York'"))
+    buckets = crud.offer_history.get_price_buckets(
+        db=db, product_id=product.id, start=day, end=day + timedelta(days=1), bucket=PriceHistoryBucketSize.day)
+    db.rollback()
+
+    assert [(bucket.bucket, bucket.changes_count) for bucket in buckets] == [(day, 2)]
+
+
+def test_create_partitions_should_move_rows_from_default_partition(db: Session) -> None:
+    start = date(2100, 1, 1)
+    offer_id = random_uuid()
+    db.add(OfferHistory(offer_id=offer_id, product_id=random_uuid(), price=1, items_in_stock=1,
+                        recorded_at=datetime(2100, 1, 2, 12, tzinfo=timezone.utc)))
+    db.commit()
+
+    created_days = crud.offer_history.create_partitions(db=db, start=start, days=3)
+    assert created_days == [date(2100, 1, 1), date(2100, 1, 2), date(2100, 1, 3)]
+    assert crud.offer_history.create_partitions(db=db, start=start, days=3) == []
+    assert _history_of(db, offer_id) == [(1, 1)]
+
+    try:
+        dropped_days = crud.offer_history.drop_partitions_before(db=db, since=start, before=date(2100, 1, 3))
+        assert dropped_days == [date(2100, 1, 1), date(2100, 1, 2)]
+        assert _history_of(db, offer_id) == []
+        assert date(2100, 1, 3) in crud.offer_history.get_partition_days(db)
+    finally:
+        crud.offer_history.drop_partitions_before(db=db, since=start, before=date(2100, 1, 4))
@@ -55,3 +55,24 @@ def test_get_number_of_products_should_return_number_of_products(db: Session, cl
     for _ in range(product_count):
         create_random_product(db)
     assert crud.product.get_number_of_products(db=db) == product_count
+
+
+def test_get_multi_keyset_should_return_all_products_ordered_by_id_in_pages(db: Session, clear_db_products) -> None:
+    product_ids = sorted(create_random_product(db).id for _ in range(5))
+
+    first_page = crud.product.get_multi_keyset(db=db, limit=2)
+    second_page = crud.product.get_multi_keyset(db=db, after=(first_page[-1].id,), limit=2)
+    last_page = crud.product.get_multi_keyset(db=db, after=(second_page[-1].id,), limit=2)
+
+    assert [product.id for product in first_page + second_page + last_page] == product_ids
+    assert len(last_page) == 1
+
+
+def test_get_multi_by_ids_should_return_only_existing_requested_products(db: Session) -> None:
+    product1 = create_random_product(db)
+    product2 = create_random_product(db)
+    create_random_product(db)  # not requested
+
+    products = crud.product.get_multi_by_ids(db=db, ids=[product1.id, product2.id, random_uuid()])
+
+    assert {product.id for product in products} == {product1.id, product2.id}
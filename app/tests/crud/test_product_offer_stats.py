@@ -0,0 +1,52 @@
+from app import crud
+from app.tests.utils.offer import create_random_offer
+from app.tests.utils.product import create_random_product
+from sqlalchemy.orm import Session
+
+
+def test_refresh_should_compute_offer_stats_of_product(db: Session) -> None:
+    product = create_random_product(db)
+    create_random_offer(db=db, product_id=product.id, price=10, items_in_stock=1)
+    create_random_offer(db=db, product_id=product.id, price=30, items_in_stock=2)
+    create_random_offer(db=db, product_id=create_random_product(db).id, price=1000)  # offer of other product
+
+    crud.product_offer_stats.refresh(db=db, product_id=product.id)
+    db.commit()
+
+    stats = crud.product_offer_stats.get(db=db, id=product.id)
+    assert stats.offers_count == 2
+    assert stats.min_price == 10
+    assert stats.max_price == 30
+    assert stats.avg_price == 20
+    assert stats.items_in_stock == 3
+
+
+def test_refresh_should_reset_stats_of_product_without_offers(db: Session) -> None:
+    product = create_random_product(db)
+    offer = create_random_offer(db=db, product_id=product.id)
+    crud.product_offer_stats.refresh(db=db, product_id=product.id)
+    crud.offer.remove_multiple_by_id(db=db, ids=[offer.id], commit=False)
+
+    crud.product_offer_stats.refresh(db=db, product_id=product.id)
+    db.commit()
+
+    stats = crud.product_offer_stats.get(db=db, id=product.id)
+    db.refresh(stats)
+    assert stats.offers_count == 0
+    assert stats.min_price is None
+    assert stats.items_in_stock == 0
+
+
+def test_refresh_multi_should_compute_offer_stats_of_products(db: Session) -> None:
+    product = create_random_product(db)
+    create_random_offer(db=db, product_id=product.id, price=10, items_in_stock=1)
+    create_random_offer(db=db, product_id=product.id, price=30, items_in_stock=2)
+    product_without_offers = create_random_product(db)
+
+    crud.product_offer_stats.refresh_multi(db=db, product_ids=[product.id, product_without_offers.id])
+    db.commit()
+
+    stats = crud.product_offer_stats.get(db=db, id=product.id)
+    assert (stats.offers_count, stats.min_price, stats.max_price, stats.items_in_stock) == (2, 10, 30, 3)
+    stats = crud.product_offer_stats.get(db=db, id=product_without_offers.id)
+    assert (stats.offers_count, stats.min_price, stats.items_in_stock) == (0, None, 0)
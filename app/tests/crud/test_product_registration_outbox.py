@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+from app import crud
+from app.core.config import settings
+from app.models import ProductRegistrationOutbox
+from app.schemas.product import ProductCreate
+from app.tests.utils.product import create_random_product
+from app.tests.utils.test_db import TestingSessionLocal
+from app.tests.utils.utils import random_lower_string, random_uuid
+from sqlalchemy import delete, func, update
+from sqlalchemy.orm import Session
+
+
+def _create_deferred_product(db: Session):
+    product_in = ProductCreate(id=random_uuid(), name=random_lower_string(), description=random_lower_string())
+    return crud.product_registration_outbox.create_with_product(db=db, obj_in=product_in)
+
+
+def test_claim_due_should_lease_claimed_rows(db: Session, monkeypatch) -> None:
+    db.execute(delete(ProductRegistrationOutbox))
+    db.commit()
+    products = [_create_deferred_product(db) for _ in range(3)]
+    product_ids = [product.id for product in products]
+
+    claimed = crud.product_registration_outbox.claim_due(db=db, limit=2)
+    assert [row.product_id for row in claimed] == product_ids[:2]
+    # the claim is committed, other drains see the leased rows as not due
+    with TestingSessionLocal() as other_db:
+        assert [row.product_id for row in crud.product_registration_outbox.claim_due(db=other_db)] == product_ids[2:]
+    assert not crud.product_registration_outbox.claim_due(db=db)
+
+    # rows of a drain that did not finish are due again once the lease ends
+    monkeypatch.setattr(settings, "OFFER_REGISTRATION_LEASE_SECONDS", 0)
+    db.execute(update(ProductRegistrationOutbox).values(next_attempt_at=func.now()))
+    db.commit()
+    assert [row.product_id for row in crud.product_registration_outbox.claim_due(db=db)] == product_ids
+
+
+def test_claim_due_should_claim_a_batch_by_default(db: Session, monkeypatch) -> None:
+    db.execute(delete(ProductRegistrationOutbox))
+    db.commit()
+    monkeypatch.setattr(settings, "OFFER_REGISTRATION_BATCH_SIZE", 2)
+    product_ids = [_create_deferred_product(db).id for _ in range(3)]
+
+    assert [row.product_id for row in crud.product_registration_outbox.claim_due(db=db)] == product_ids[:2]
+
+
+def test_record_failures_should_back_off(db: Session) -> None:
+    product = _create_deferred_product(db)
+    outbox = db.query(ProductRegistrationOutbox).filter(ProductRegistrationOutbox.product_id == product.id).one()
+    for attempts in (1, 2):
+        crud.product_registration_outbox.record_failures(db=db, errors={outbox.id: "Offer service responded with 503"})
+        db.commit()
+        db.refresh(outbox)
+        assert outbox.attempts == attempts
+        assert outbox.last_error == "Offer service responded with 503"
+        retry_seconds = settings.OFFER_REGISTRATION_RETRY_MIN_SECONDS * 2 ** (attempts - 1)
+        assert outbox.next_attempt_at - outbox.created_at >= timedelta(seconds=retry_seconds)
+
+
+def test_sync_state_should_not_be_created_for_products_waiting_for_registration(db: Session) -> None:
+    deferred_product_id = _create_deferred_product(db).id
+    product_id = create_random_product(db=db).id
+    assert crud.product_sync_state.get(db=db, id=deferred_product_id) is None
+    assert crud.product_sync_state.get(db=db, id=product_id) is not None
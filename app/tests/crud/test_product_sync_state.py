@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta, timezone
+
+from app import crud
+from app.core.config import settings
+from app.schemas.product import ProductCreate
+from app.tests.utils.product import create_random_product
+from app.tests.utils.utils import random_lower_string, random_uuid
+from sqlalchemy.orm import Session
+
+
+def test_set_fingerprint_should_create_and_update_sync_state(db: Session) -> None:
+    product = create_random_product(db=db)
+    crud.product_sync_state.set_fingerprint(db=db, product_id=product.id, fingerprint="a" * 64)
+    crud.product_sync_state.set_fingerprint(db=db, product_id=product.id, fingerprint="b" * 64)
+    db.commit()
+    fingerprints = crud.product_sync_state.get_fingerprints(db=db, product_ids=[product.id])
+    assert fingerprints == {str(product.id): "b" * 64}
+
+
+def test_get_fingerprints_should_skip_products_without_sync_state(db: Session) -> None:
+    product = create_random_product(db=db)
+    assert crud.product_sync_state.get_fingerprints(db=db, product_ids=[product.id, random_uuid()]) == {
+        str(product.id): None}
+
+
+def test_sync_state_should_be_created_with_products(db: Session) -> None:
+    product = create_random_product(db=db)
+    product_in = ProductCreate(id=random_uuid(), name=random_lower_string(), description=random_lower_string())
+    created_ids = crud.product.create_multi(db=db, objs_in=[product_in])
+    for product_id in (product.id, *created_ids):
+        state = crud.product_sync_state.get(db=db, id=product_id)
+        assert state.next_sync_at <= datetime.now(timezone.utc)
+        assert (state.offers_fingerprint, state.syncs_count) == (None, 0)
+
+
+def test_sync_state_should_be_deleted_with_product(db: Session) -> None:
+    product = create_random_product(db=db)
+    product_id = product.id
+    crud.product_sync_state.set_fingerprint(db=db, product_id=product_id, fingerprint="a" * 64)
+    db.commit()
+    crud.product.remove(db=db, id=product_id)
+    db.expire_all()
+    assert crud.product_sync_state.get(db=db, id=product_id) is None
+
+
+def test_set_fingerprint_should_schedule_next_sync_after_min_interval(db: Session) -> None:
+    product = create_random_product(db=db)
+    crud.product_sync_state.set_fingerprint(db=db, product_id=product.id, fingerprint="a" * 64)
+    db.commit()
+    state = crud.product_sync_state.get(db=db, id=product.id)
+    assert state.sync_interval_seconds == settings.OFFER_DOWNLOAD_MIN_INTERVAL_SECONDS
+    assert state.next_sync_at - state.synced_at == timedelta(seconds=settings.OFFER_DOWNLOAD_MIN_INTERVAL_SECONDS)
+    assert (state.syncs_count, state.changes_count) == (1, 1)
+
+
+def test_record_pushed_should_postpone_next_sync_and_drop_fingerprint(db: Session) -> None:
+    product = create_random_product(db=db)
+    new_product = create_random_product(db=db)
+    crud.product_sync_state.set_fingerprint(db=db, product_id=product.id, fingerprint="a" * 64)
+    crud.product_sync_state.record_pushed(db=db, product_ids=[product.id, new_product.id])
+    db.commit()
+    for product_id in (product.id, new_product.id):
+        state = crud.product_sync_state.get(db=db, id=product_id)
+        assert state.offers_fingerprint is None
+        assert state.next_sync_at - state.synced_at == timedelta(seconds=settings.OFFER_INGEST_SYNC_DELAY_SECONDS)
+    assert crud.product_sync_state.get(db=db, id=product.id).changes_count == 2
+
+
+def test_record_unchanged_should_double_interval_up_to_max(db: Session, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "OFFER_DOWNLOAD_MIN_INTERVAL_SECONDS", 30)
+    monkeypatch.setattr(settings, "OFFER_DOWNLOAD_MAX_INTERVAL_SECONDS", 100)
+    product = create_random_product(db=db)
+    crud.product_sync_state.set_fingerprint(db=db, product_id=product.id, fingerprint="a" * 64)
+    intervals = []
+    for _ in range(3):
+        crud.product_sync_state.record_unchanged(db=db, product_ids=[str(product.id)])
+        db.commit()
+        state = crud.product_sync_state.get(db=db, id=product.id)
+        db.refresh(state)
+        intervals.append(state.sync_interval_seconds)
+    assert intervals == [60, 100, 100]
+    assert state.next_sync_at - state.synced_at == timedelta(seconds=100)
+    assert (state.syncs_count, state.changes_count) == (4, 1)
+
+    # a change brings the product back to the minimal interval
+    crud.product_sync_state.set_fingerprint(db=db, product_id=product.id, fingerprint="b" * 64)
+    db.commit()
+    db.refresh(state)
+    assert state.sync_interval_seconds == 30
+
+
+def test_stream_due_product_ids_should_return_due_products_most_overdue_first(
+    db: Session, clear_db_products: None
+) -> None:
+    products = [create_random_product(db=db) for _ in range(4)]
+    # synced product is not due until its interval passes
+    crud.product_sync_state.set_fingerprint(db=db, product_id=products[0].id, fingerprint="a" * 64)
+    db.commit()
+    due_at = datetime.now(timezone.utc)
+
+    pages = list(crud.product_sync_state.stream_due_product_ids(db=db, due_at=due_at, batch_size=2))
+    assert pages == [[str(products[1].id), str(products[2].id)], [str(products[3].id)]]
+    assert crud.product_sync_state.count_due(db=db, due_at=due_at) == 3
@@ -0,0 +1,70 @@
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import pytest
+from app import crud
+from app.tests.utils.offer import create_random_offer
+from app.tests.utils.product import create_random_product
+from app.tests.utils.test_db import engine
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+
+def _plan_node_types(plan: Dict[str, Any]) -> Iterator[str]:
+    yield plan["Node Type"]
+    for subplan in plan.get("Plans", []):
+        yield from _plan_node_types(subplan)
+
+
+def _explain_queries(db: Session, run_queries: Callable[[], Any]) -> List[List[str]]:
+    statements: List[Tuple[str, Any]] = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        run_queries()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    # test tables are tiny, so sequential (or bitmap scan followed by sort) would be the cheapest plan - disallow
+    # them to see whether the planner has an index it can use at all
+    db.execute(text("SET LOCAL enable_seqscan = off"))
+    db.execute(text("SET LOCAL enable_bitmapscan = off"))
+    plans = [
+        list(_plan_node_types(
+            db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()[0]["Plan"]))
+        for statement, parameters in statements
+    ]
+    db.rollback()
+    return plans
+
+
+hot_queries = {
+    "offer_get": lambda db, offer: crud.offer.get(db=db, id=offer.id),
+    "offer_get_multi_keyset": lambda db, offer: crud.offer.get_multi_keyset(db=db, after=(offer.id,)),
+    "offer_get_multi_by_product": lambda db, offer: crud.offer.get_multi_by_product(
+        db=db, product_id=offer.product_id),
+    "offer_get_multi_by_product_keyset": lambda db, offer: crud.offer.get_multi_by_product_keyset(
+        db=db, product_id=offer.product_id, after=(offer.price, offer.id)),
+    "offer_replace_product_offers": lambda db, offer: crud.offer.replace_product_offers(
+        db=db, product_id=offer.product_id, objects=[], commit=False),
+    "product_sync_state_stream_due_product_ids": lambda db, offer: list(
+        crud.product_sync_state.stream_due_product_ids(db=db, due_at=datetime.now(timezone.utc))),
+    "product_get": lambda db, offer: crud.product.get(db=db, id=offer.product_id),
+    "product_get_multi_keyset": lambda db, offer: crud.product.get_multi_keyset(db=db, after=(offer.product_id,)),
+}
+
+
+@pytest.mark.parametrize("query_name", hot_queries)
+def test_hot_queries_should_use_index_without_sort(db: Session, query_name: str) -> None:
+    offer = create_random_offer(db=db, product_id=create_random_product(db=db).id)
+
+    plans = _explain_queries(db, lambda: hot_queries[query_name](db, offer))
+
+    assert plans
+    for node_types in plans:
+        assert "Seq Scan" not in node_types
+        assert "Sort" not in node_types
+        assert "Incremental Sort" not in node_types
@@ -3,4 +3,8 @@ set -e
 
 python ./app/backend_pre_start.py
 
-celery -A app.celery.worker worker -E -l info -Q main-queue -c 1
+# the threads pool runs tasks concurrently in one process, offer downloads of all of them share one event loop and one
+# pool of offer service connections, see app/core/offer_service_client.py
+# CELERY_WORKER_POOL=prefork CELERY_WORKER_CONCURRENCY=1 switches back to a single task per process
+celery -A app.celery.worker worker -E -l info -Q main-queue \
+    --pool "${CELERY_WORKER_POOL:-threads}" --concurrency "${CELERY_WORKER_CONCURRENCY:-20}"